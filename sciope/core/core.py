@@ -1,7 +1,11 @@
-from dask.distributed import get_client, futures_of
+from dask.distributed import get_client, futures_of, as_completed
 from dask import delayed
 from toolz import partition_all
+from functools import partial
+from sciope.core import executors
 import numpy as np
+import dask
+import time
 
 
 def _cluster_mode():
@@ -27,6 +31,29 @@ def get_futures(lst):
         f.append(futures_of(i)[0])
     return f
 
+def cancel_futures(futures):
+    """ Cancel futures that are no longer needed, including the ones
+        still queued or running on the workers. Keys only needed by the
+        cancelled futures (e.g. simulations and summary statistics) are
+        released by the scheduler as well.
+
+    Parameters
+    ----------
+    futures : array-like
+        array containing futures
+
+    Returns
+    -------
+    int
+        the number of futures that had not finished when cancelled
+    """
+    futures = list(futures)
+    if len(futures) == 0:
+        return 0
+    n_pending = sum(1 for f in futures if not f.done())
+    get_client().cancel(futures)
+    return n_pending
+
 @delayed
 def delay_func_chunk(func, chunk):
     res = []
@@ -34,9 +61,429 @@ def delay_func_chunk(func, chunk):
         res.append(func(x))
     return res
 
+def run_chunk(chunk, sim_func, summaries_func=None, dist_func=None, return_all=False):
+    """ Run simulation, summary statistics and distance for every point in
+        a chunk of parameters within a single call
+
+    Parameters
+    ----------
+    chunk : array-like
+        chunk of parameter points
+    sim_func : callable
+        the simulator function which takes a parameter point as argument
+    summaries_func : callable, optional
+        the summaries statistics function which takes a simulation result,
+        by default None
+    dist_func : callable, optional
+        the distance function which takes summary statistics, by default None
+    return_all : bool, optional
+        return the results of every stage instead of only the last one,
+        by default False
+
+    Returns
+    -------
+    list
+        the last computed stage (trajectories, summary statistics or distances)
+        for each point in the chunk, or if return_all is True, a list
+        with one such list per computed stage
+    """
+    stages = [sim_func]
+    if summaries_func is not None:
+        stages.append(summaries_func)
+        if dist_func is not None:
+            stages.append(dist_func)
+
+    res = [[] for _ in stages]
+    for x in chunk:
+        for e, func in enumerate(stages):
+            x = func(x)
+            if return_all or e == len(stages) - 1:
+                res[e].append(x)
+    if return_all:
+        return res
+    return res[-1]
+
+
+def _run_chunk_timed(chunk, sim_func, summaries_func=None, dist_func=None):
+    """ run_chunk returning (result, duration in seconds) """
+    start = time.perf_counter()
+    res = run_chunk(chunk, sim_func, summaries_func, dist_func)
+    return res, time.perf_counter() - start
+
+
+def _run_chunk_all(chunk, sim_func, summaries_func, dist_func, keep_trajectories, timed=False):
+    start = time.perf_counter()
+    res = run_chunk(chunk, sim_func, summaries_func, dist_func, return_all=True)
+    if not keep_trajectories and len(res) > 1:
+        # avoid sending trajectories back when they are not needed
+        res[0] = None
+    if timed:
+        res.append(time.perf_counter() - start)
+    return res
+
+
+class AdaptiveChunker(object):
+    """
+    Chooses chunk sizes from measured task durations. The time per point is
+    estimated from completed chunks using an exponential moving average and
+    the chunk size is grown or shrunk towards target_duration, so that cheap
+    simulations are not dominated by scheduler overhead and expensive ones
+    do not create stragglers. Can be passed as chunk_size wherever a chunk
+    size is accepted, 'auto' creates one with default settings and a chunk size
+    capped at the batch size, see get_chunk_size.
+
+    Parameters
+    ----------
+    chunk_size : int, optional
+        the initial chunk size, by default 2
+    target_duration : float, optional
+        the desired duration of a chunk task in seconds, by default 1.0
+    min_chunk_size : int, optional
+        the smallest allowed chunk size, by default 1
+    max_chunk_size : int, optional
+        the largest allowed chunk size, by default None (unbounded)
+    max_factor : float, optional
+        the maximum factor by which the chunk size may change in one update,
+        by default 2.0
+    smoothing : float, optional
+        the weight of the newest measurement in the moving average,
+        by default 0.5
+    """
+
+    def __init__(self, chunk_size=2, target_duration=1.0, min_chunk_size=1,
+                 max_chunk_size=None, max_factor=2.0, smoothing=0.5):
+        assert target_duration > 0, "target_duration must be positive"
+        assert max_factor > 1, "max_factor must be larger than 1"
+        assert 0 < smoothing <= 1, "smoothing must be in (0, 1]"
+        self.target_duration = target_duration
+        self.min_chunk_size = max(1, int(min_chunk_size))
+        self.max_chunk_size = max_chunk_size
+        self.max_factor = max_factor
+        self.smoothing = smoothing
+        self.time_per_point = None
+        self.chunk_size = self._bound(chunk_size)
+        self.chunk_sizes = []
+        self.durations = []
+
+    def _bound(self, chunk_size):
+        chunk_size = max(self.min_chunk_size, int(round(chunk_size)))
+        if self.max_chunk_size is not None:
+            chunk_size = min(chunk_size, int(self.max_chunk_size))
+        return chunk_size
+
+    def update(self, durations, chunk_sizes):
+        """
+        Record completed chunks and adapt the chunk size
+
+        Parameters
+        ----------
+        durations : array-like
+            the measured duration of each chunk task in seconds
+        chunk_sizes : array-like
+            the number of points in each chunk
+
+        Returns
+        -------
+        int
+            the chunk size to use for the next chunks
+        """
+        for duration, size in zip(durations, chunk_sizes):
+            if size <= 0:
+                continue
+            self.durations.append(float(duration))
+            self.chunk_sizes.append(int(size))
+            t = float(duration) / size
+            if self.time_per_point is None:
+                self.time_per_point = t
+            else:
+                self.time_per_point = self.smoothing * t + (1 - self.smoothing) * self.time_per_point
+
+        if self.time_per_point is None:
+            return self.chunk_size
+        if self.time_per_point > 0:
+            proposed = self.target_duration / self.time_per_point
+        else:
+            proposed = self.chunk_size * self.max_factor
+        proposed = np.clip(proposed, self.chunk_size / self.max_factor, self.chunk_size * self.max_factor)
+        self.chunk_size = self._bound(proposed)
+        return self.chunk_size
+
+    def report(self):
+        """
+        Summary of the chunk sizes chosen so far
+
+        Returns
+        -------
+        dict
+            with keys 'chunk_sizes' and 'durations' of every completed chunk, the current
+            'chunk_size', the estimated 'time_per_point' and the 'target_duration'
+        """
+        return {'chunk_sizes': np.asarray(self.chunk_sizes, dtype=int),
+                'durations': np.asarray(self.durations),
+                'chunk_size': self.chunk_size,
+                'time_per_point': self.time_per_point,
+                'target_duration': self.target_duration}
+
+
+# the largest chunk size chosen by 'auto' when the batch size is not known
+AUTO_MAX_CHUNK_SIZE = 32
+
+
+def get_chunk_size(chunk_size, batch_size=None):
+    """
+    Resolve a chunk size argument
+
+    Parameters
+    ----------
+    chunk_size : int, str or AdaptiveChunker
+        a fixed chunk size, an AdaptiveChunker or 'auto'
+    batch_size : int, optional
+        the number of points per batch, caps the chunk size chosen by 'auto'. By default
+        None, which caps it at AUTO_MAX_CHUNK_SIZE
+
+    Returns
+    -------
+    int or AdaptiveChunker
+        the fixed chunk size, or an AdaptiveChunker ('auto' creates a new one, so that
+        cheap simulators do not grow chunks beyond what a batch or the in-flight window
+        of cluster mode can use)
+    """
+    if isinstance(chunk_size, AdaptiveChunker):
+        return chunk_size
+    if chunk_size == 'auto':
+        max_chunk_size = AUTO_MAX_CHUNK_SIZE if batch_size is None else max(1, int(batch_size))
+        return AdaptiveChunker(chunk_size=min(2, max_chunk_size), max_chunk_size=max_chunk_size)
+    return chunk_size
+
+
+def _current_chunk_size(chunk_size, batch_size=None):
+    if isinstance(chunk_size, AdaptiveChunker):
+        if batch_size is not None:
+            # samplers expect at least one full chunk per batch
+            return min(chunk_size.chunk_size, batch_size)
+        return chunk_size.chunk_size
+    return chunk_size
+
+
+def compute_chunked(param_func, sim_func, summaries_func=None, dist_func=None,
+                    batch_size=10, chunk_size=2, executor=None, keep_trajectories=True):
+    """
+    Computes a batch of sampling, simulation, summary statistics and distances
+    using an executor, see sciope.core.executors. With a dask executor (the default)
+    the fused dask graph from get_graph_chunked is computed, otherwise parameters
+    are drawn locally and each chunk is processed by a single call to the executor.
+
+    Parameters
+    ----------
+    param_func : callable
+        the parameter sampling function, see sciope.designs, sciope.sampling
+        and sciope.utilities.priors
+    sim_func : callable
+        the simulator function which takes a parameter point as argument
+    summaries_func : callable, optional
+        the summaries statistics function which takes a simulation result,
+        by default None
+    dist_func : callable, optional
+        the function applied to the summary statistics of each point, e.g. a
+        distance or a predictor, by default None
+    batch_size : int, optional
+        the number of points being sampled in each batch, by default 10
+    chunk_size : int or AdaptiveChunker, optional
+        the number of points in each chunk, by default 2. An AdaptiveChunker is
+        updated with the measured duration of each chunk
+    executor : sciope.core.executors.ExecutorBase or str, optional
+        the executor, by default None which uses dask
+    keep_trajectories : bool, optional
+        whether trajectories should be returned when summaries are computed,
+        by default True
+
+    Returns
+    -------
+    dict
+        with keys 'parameters', 'trajectories', 'summarystats' and 'distances'
+        values being lists of computed chunks, or None if not computed/kept
+    """
+    executor = executors.get_executor(executor)
+    chunker = chunk_size if isinstance(chunk_size, AdaptiveChunker) else None
+    timed = chunker is not None
+    res = {"parameters": None, "trajectories": None,
+           "summarystats": None, "distances": None}
+    keys = ["trajectories", "summarystats", "distances"]
+    n_stages = 1 if summaries_func is None else (2 if dist_func is None else 3)
+    wanted = [k for k in keys[:n_stages] if keep_trajectories or k != "trajectories" or n_stages == 1]
+
+    if isinstance(executor, executors.DaskExecutor):
+        graph_dict = get_graph_chunked(param_func, sim_func, summaries_func,
+                                       batch_size, chunk_size, dist_func=dist_func,
+                                       fused=True, keep_trajectories=keep_trajectories)
+        timed_keys = ["durations"] if timed else []
+        computed = dask.compute(graph_dict["parameters"], *[graph_dict[k] for k in wanted + timed_keys])
+        res["parameters"] = computed[0]
+        for k, v in zip(wanted, computed[1:]):
+            res[k] = v
+        if timed:
+            chunker.update(computed[-1], [len(c) for c in res["parameters"]])
+        return res
+
+    # sampling is cheap, materialize the parameter chunks locally
+    params, = dask.compute(param_func(batch_size, chunk_size=_current_chunk_size(chunk_size, batch_size)),
+                           scheduler='synchronous')
+    res["parameters"] = list(params)
+    func = partial(_run_chunk_all, sim_func=sim_func, summaries_func=summaries_func,
+                   dist_func=dist_func, keep_trajectories=keep_trajectories, timed=timed)
+    results = executor.map(func, res["parameters"])
+    for e, k in enumerate(keys[:n_stages]):
+        if k in wanted:
+            res[k] = [r[e] for r in results]
+    if timed:
+        chunker.update([r[-1] for r in results], [len(c) for c in res["parameters"]])
+    return res
+
+
+class SubmissionEngine(object):
+    """
+    Submits chunks of sampling, simulation, summary statistics and distance
+    tasks to a distributed client while keeping a bounded number of chunks
+    in flight. Parameters are drawn on the client in one batch per submission
+    and the remaining stages are fused into a single task per chunk via
+    client.map, so that no graph has to be built per chunk.
+
+    Parameters
+    ----------
+    param_func : callable
+        the parameter sampling function, see sciope.designs, sciope.sampling
+        and sciope.utilities.priors
+    sim_func : callable
+        the simulator function which takes a parameter point as argument
+    summaries_func : callable
+        the summaries statistics function which takes a simulation result
+    dist_func : callable
+        the distance function which takes summary statistics
+    chunk_size : int or AdaptiveChunker
+        the number of parameter points in each chunk. An AdaptiveChunker is
+        updated with the measured duration of each completed chunk
+    max_in_flight : int, optional
+        the maximum number of chunks in flight, by default in_flight_factor
+        times the number of worker threads
+    in_flight_factor : int, optional
+        multiple of the worker thread count used as default window, by default 2
+    """
+
+    def __init__(self, param_func, sim_func, summaries_func, dist_func,
+                 chunk_size, max_in_flight=None, in_flight_factor=2):
+        self.client = get_client()
+        self.param_func = param_func
+        self.sim_func = sim_func
+        self.summaries_func = summaries_func
+        self.dist_func = dist_func
+        self.chunk_size = chunk_size
+        if max_in_flight is None:
+            max_in_flight = in_flight_factor * sum(self.client.nthreads().values())
+        self.max_in_flight = max(1, max_in_flight)
+        self.submitted_count = 0
+        self.cancelled_count = 0
+        self.discarded_count = 0
+        self._pending_points = 0
+        self._pending = {}
+        self._completed = as_completed(with_results=True)
+
+    @property
+    def in_flight(self):
+        """ The number of submitted chunks that have not been consumed """
+        return len(self._pending)
+
+    def submit(self, n_chunks):
+        """ Submit new chunks, limited by the free room in the in-flight window
+
+        Parameters
+        ----------
+        n_chunks : int
+            the number of chunks to submit
+
+        Returns
+        -------
+        int
+            the number of chunks submitted
+        """
+        n_chunks = min(n_chunks, self.max_in_flight - self.in_flight)
+        if n_chunks <= 0:
+            return 0
+        chunk_size = _current_chunk_size(self.chunk_size)
+        params = self.param_func(n_chunks * chunk_size, chunk_size=chunk_size)
+        f_params = self.client.compute(params)
+        f_results = self.client.map(_run_chunk_timed, f_params, sim_func=self.sim_func,
+                                    summaries_func=self.summaries_func,
+                                    dist_func=self.dist_func, pure=False)
+        for f_param, f_result in zip(f_params, f_results):
+            self._pending[f_result.key] = (f_result, f_param, chunk_size)
+            self._completed.add(f_result)
+        self._pending_points += len(f_results) * chunk_size
+        self.submitted_count += len(f_results)
+        return len(f_results)
+
+    def n_needed(self, remaining, acceptance_rate):
+        """ Estimate how many new chunks are needed to reach the remaining number
+            of accepted samples, given the chunks already in flight
+
+        Parameters
+        ----------
+        remaining : int
+            the number of accepted samples still needed
+        acceptance_rate : float
+            the observed acceptance rate so far
+
+        Returns
+        -------
+        int
+            the number of chunks to submit, at most the free room in the window
+        """
+        room = self.max_in_flight - self.in_flight
+        if remaining <= 0:
+            return 0
+        if acceptance_rate <= 0:
+            return room
+        chunk_size = _current_chunk_size(self.chunk_size)
+        expected = self._pending_points * acceptance_rate
+        needed = int(np.ceil((remaining - expected) / (chunk_size * acceptance_rate)))
+        # always keep at least one chunk in flight while samples are needed
+        needed = max(needed, 1 - self.in_flight)
+        return max(0, min(room, needed))
+
+    def __iter__(self):
+        """ Yield (parameters, results) of chunks as they are completed """
+        for f, (res, duration) in self._completed:
+            _, f_param, chunk_size = self._pending.pop(f.key)
+            self._pending_points -= chunk_size
+            params = f_param.result()
+            del f, f_param
+            if isinstance(self.chunk_size, AdaptiveChunker):
+                self.chunk_size.update([duration], [len(params)])
+            yield params, res
+
+    def cancel(self):
+        """ Cancel all chunks still in flight. Chunks that had not finished are added to
+            cancelled_count, chunks that had finished but were never consumed to discarded_count
+
+        Returns
+        -------
+        int
+            the number of chunks that had not finished when cancelled
+        """
+        self._completed.clear()
+        pending = list(self._pending.values())
+        self._pending = {}
+        self._pending_points = 0
+        cancelled_count = cancel_futures([f_result for f_result, _, _ in pending])
+        cancel_futures([f_param for _, f_param, _ in pending])
+        self.cancelled_count += cancelled_count
+        self.discarded_count += len(pending) - cancelled_count
+        return cancelled_count
+
+
 def get_summaries(data, func, chunk_size):
 
     # assumed data is large, make chunks
+    chunk_size = _current_chunk_size(get_chunk_size(chunk_size))
     #assert len(data)/chunk_size > 1.0, "With chunk_size: {0} will only create 1 chunk, choose a sampler chunk_size".format(chunk_size)
     data_chunked = partition_all(chunk_size, data)
     stats_final = [delayed(func)(chunk) for chunk in data_chunked]
@@ -73,7 +520,8 @@ def get_fixed_mean(data, func, chunk_size):
         return stats_mean
 
 def get_graph_chunked(param_func, sim_func, summaries_func=None,
-                      batch_size=10, chunk_size=2):
+                      batch_size=10, chunk_size=2, dist_func=None,
+                      fused=False, keep_trajectories=True):
     """
     Constructs the dask computational graph involving sampling, simulation,
     summary statistics and distances.
@@ -88,23 +536,34 @@ def get_graph_chunked(param_func, sim_func, summaries_func=None,
     summaries_func : callable, optional
         the summaries statistics function which takes a simulation result,
         by default None
-    dist_func : callable, optional
-        the distance function between , by default None
     batch_size : int, optional
         the number of points being sampled in each batch, by default 10
-    chunk_size : int, optional
-        decription, by default 2
-    ensemble_size : int, optional
-        [description], by default 1
-
-        Returns
+    chunk_size : int or AdaptiveChunker, optional
+        the number of points in each chunk, by default 2. For an AdaptiveChunker
+        its current chunk size is used, and a fused graph also contains the
+        duration of each chunk task which the caller should pass to its update
+    dist_func : callable, optional
+        the function applied to the summary statistics of each point, e.g. a
+        distance or a predictor. Only used if fused is True, by default None
+    fused : bool, optional
+        run simulation, summary statistics and distance in a single task per
+        chunk instead of one task per stage, by default False
+    keep_trajectories : bool, optional
+        whether trajectories should be returned from the fused tasks when
+        summaries are computed, by default True
+
+    Returns
     -------
     dict
         with keys 'parameters', 'trajectories', 'summarystats' and 'distances'
-        values being dask delayed objects
+        values being dask delayed objects. 'distances' is only present when
+        fused is True, 'durations' when fused is True and chunk_size is an
+        AdaptiveChunker
     """
 
     # worflow sampling with batch size = batch_size
+    timed = isinstance(chunk_size, AdaptiveChunker)
+    chunk_size = _current_chunk_size(chunk_size, batch_size)
 
     # Draw from the prior/design
     trial_param = param_func(batch_size, chunk_size=chunk_size)
@@ -112,6 +571,10 @@ def get_graph_chunked(param_func, sim_func, summaries_func=None,
     #params_chunked = partition_all(chunk_size, trial_param)
     params_chunked = trial_param
 
+    if fused:
+        return _get_graph_fused(params_chunked, sim_func, summaries_func,
+                                dist_func, keep_trajectories, timed)
+
     # Perform the simulation
 
     sim_result = [delay_func_chunk(sim_func, chunk) for chunk in params_chunked]
@@ -130,6 +593,33 @@ def get_graph_chunked(param_func, sim_func, summaries_func=None,
     return {"parameters": trial_param, "trajectories": sim_result, 
             "summarystats": stats_final}
 
+def _get_graph_fused(params_chunked, sim_func, summaries_func=None, dist_func=None,
+                     keep_trajectories=True, timed=False):
+    """
+    One task per chunk running all stages, intermediate results never
+    become separate dask keys. Trajectories are dropped inside the task
+    unless keep_trajectories is True or they are the only stage.
+    """
+    n_stages = 1 if summaries_func is None else (2 if dist_func is None else 3)
+    n_out = n_stages + 1 if timed else n_stages
+    fused_chunk = delayed(_run_chunk_all, nout=n_out)
+
+    stages = [fused_chunk(chunk, sim_func, summaries_func, dist_func, keep_trajectories, timed)
+              for chunk in params_chunked]
+    stages = list(zip(*stages)) if len(stages) > 0 else [[] for _ in range(n_out)]
+
+    res = {"parameters": params_chunked, "trajectories": None,
+           "summarystats": None, "distances": None}
+    if n_stages == 1 or keep_trajectories:
+        res["trajectories"] = list(stages[0])
+    if n_stages > 1:
+        res["summarystats"] = list(stages[1])
+    if n_stages > 2:
+        res["distances"] = list(stages[2])
+    if timed:
+        res["durations"] = list(stages[-1])
+    return res
+
 def get_distance(dist_func, X, chunked=True):
 
     if chunked:
@@ -151,6 +641,11 @@ def get_prediction(pred_func, X, chunked=True):
     return pred
 
 def _reshape_chunks(data):
+    if len(set(len(chunk) for chunk in data)) > 1:
+        # chunks of different sizes, e.g. a smaller last chunk or adaptive chunk sizes
+        data = np.concatenate([np.asarray(chunk) for chunk in data])
+        if data.ndim == 1:
+            data = data.reshape(-1, 1)
     data = np.asarray(data)
     if len(data.shape) > 1:
         data = data.reshape(-1, data.shape[-1])
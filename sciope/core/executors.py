@@ -0,0 +1,201 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Executors for running chunked workflows with or without dask
+"""
+
+# Imports
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from abc import ABCMeta, abstractmethod
+import numpy as np
+import cloudpickle
+import dask
+
+
+def _call_pickled(payload, item):
+    """ Unpickle a callable serialized with cloudpickle and apply it, allows
+        lambdas and closures to be sent to a process pool """
+    func = cloudpickle.loads(payload)
+    return func(item)
+
+
+def _seed_worker():
+    """ Reseed the global numpy random state of a pool worker from OS entropy, forked
+        workers would otherwise all draw the same random numbers """
+    np.random.seed()
+
+
+class ExecutorBase(object):
+    """
+    Base class for executors. An executor applies a function to each item
+    of an iterable and returns the results in order.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, name):
+        self.name = name
+
+    @abstractmethod
+    def map(self, func, items):
+        """
+        Apply func to each item
+
+        Parameters
+        ----------
+        func : callable
+            function taking a single item
+        items : iterable
+            the items, typically chunks of parameter points
+
+        Returns
+        -------
+        list
+            the results, in the same order as items
+        """
+
+    def shutdown(self):
+        """
+        Release any resources held by the executor
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def __getstate__(self):
+        # pools can not be pickled, a copy creates its own pool when needed
+        state = self.__dict__.copy()
+        if '_pool' in state:
+            state['_pool'] = None
+        return state
+
+
+class SerialExecutor(ExecutorBase):
+    """
+    Runs everything in the calling process, without any scheduling overhead.
+    """
+
+    def __init__(self):
+        super(SerialExecutor, self).__init__('serial')
+
+    def map(self, func, items):
+        return [func(item) for item in items]
+
+
+class ThreadExecutor(ExecutorBase):
+    """
+    Runs chunks in a concurrent.futures.ThreadPoolExecutor. Suitable for
+    simulators that release the GIL.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        the number of threads, by default decided by concurrent.futures
+    """
+
+    def __init__(self, max_workers=None):
+        super(ThreadExecutor, self).__init__('threads')
+        self.max_workers = max_workers
+        self._pool = None
+
+    def map(self, func, items):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        return list(self._pool.map(func, items))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+class ProcessExecutor(ExecutorBase):
+    """
+    Runs chunks in a concurrent.futures.ProcessPoolExecutor. The function is
+    serialized with cloudpickle, so lambdas and closures are supported. Each
+    worker reseeds the numpy random state when it starts, so stochastic
+    simulators give independent results in different workers.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        the number of processes, by default the number of CPUs
+    """
+
+    def __init__(self, max_workers=None):
+        super(ProcessExecutor, self).__init__('processes')
+        self.max_workers = max_workers
+        self._pool = None
+
+    def map(self, func, items):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_seed_worker)
+        items = list(items)
+        payload = cloudpickle.dumps(func)
+        return list(self._pool.map(_call_pickled, [payload] * len(items), items))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+class DaskExecutor(ExecutorBase):
+    """
+    Runs chunks as dask delayed tasks, using the distributed client if one
+    exists and the default dask scheduler otherwise.
+    """
+
+    def __init__(self):
+        super(DaskExecutor, self).__init__('dask')
+
+    def map(self, func, items):
+        res, = dask.compute([dask.delayed(func)(item) for item in items])
+        return list(res)
+
+
+_executors = {'serial': SerialExecutor, 'threads': ThreadExecutor,
+              'processes': ProcessExecutor, 'dask': DaskExecutor}
+
+
+def get_executor(executor=None):
+    """
+    Get an executor instance. Executors created from a name are owned by the
+    caller, which should shut them down when done.
+
+    Parameters
+    ----------
+    executor : ExecutorBase or str, optional
+        an executor instance or one of 'serial', 'threads', 'processes' and
+        'dask', by default None which gives a DaskExecutor
+
+    Returns
+    -------
+    ExecutorBase
+
+    Raises
+    ------
+    ValueError
+        if executor is not supported
+    """
+    if executor is None:
+        return DaskExecutor()
+    if isinstance(executor, ExecutorBase):
+        return executor
+    if executor not in _executors:
+        raise ValueError("Supported executors are: {0} got executor={1}".format(list(_executors), executor))
+    return _executors[executor]()
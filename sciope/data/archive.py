@@ -0,0 +1,224 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Chunked, compressed columnar archives of arrays
+
+An archive is a zip file with one member per chunk of rows of each array, written in the
+.npy format. Arrays are read lazily, only the chunks covering the requested rows are
+decompressed, and rows can be appended to an existing archive.
+"""
+
+# Imports
+import numpy as np
+import zipfile
+import json
+
+_CONFIG = '__config__'
+_CHUNK_BYTES = 2 ** 26
+
+
+def _chunk_name(field, i):
+    return "{0}/{1:08d}.npy".format(field, i)
+
+
+def _split_name(name):
+    field, _, chunk = name.rpartition('/')
+    return field, int(chunk[:-4])
+
+
+def _json_default(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError("{0} is not JSON serializable".format(type(value)))
+
+
+class LazyArray(object):
+    """
+    Read-only array-like view of an array stored in chunks of rows. Indexing reads only the chunks
+    covering the requested rows, np.asarray reads the whole array.
+    """
+
+    def __init__(self, zf, names, shapes, dtype):
+        self._zf = zf
+        self._names = names
+        self._offsets = np.cumsum([0] + [shape[0] for shape in shapes])
+        self.shape = (int(self._offsets[-1]),) + tuple(shapes[0][1:])
+        self.dtype = dtype
+        self._cached = (None, None)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _chunk(self, i):
+        if self._cached[0] != i:
+            with self._zf.open(self._names[i]) as f:
+                self._cached = (i, np.lib.format.read_array(f, allow_pickle=False))
+        return self._cached[1]
+
+    def _rows(self, start, stop):
+        """ Rows start, ..., stop - 1 """
+        if start >= stop:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+        first = np.searchsorted(self._offsets, start, side='right') - 1
+        last = np.searchsorted(self._offsets, stop, side='left')
+        chunks = [self._chunk(i) for i in range(first, last)]
+        rows = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        return rows[start - self._offsets[first]:stop - self._offsets[first]]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = key[0], key[1:]
+        if isinstance(first, (int, np.integer)):
+            i = first + len(self) if first < 0 else first
+            if not 0 <= i < len(self):
+                raise IndexError("index {0} is out of bounds for axis 0 with size {1}".format(first, len(self)))
+            return self._rows(i, i + 1)[(0,) + rest]
+        if isinstance(first, slice) and (first.step is None or first.step > 0):
+            start, stop, step = first.indices(len(self))
+            return self._rows(start, stop)[(slice(None, None, step),) + rest]
+        if first is Ellipsis:
+            return np.asarray(self)[key]
+        idx = np.arange(len(self))[first]
+        if idx.size == 0:
+            return self._rows(0, 0)[(idx,) + rest]
+        lo = idx.min()
+        return self._rows(lo, idx.max() + 1)[(idx - lo,) + rest]
+
+    def __array__(self, dtype=None):
+        x = self._rows(0, len(self))
+        return x if dtype is None else x.astype(dtype)
+
+
+class Archive(object):
+    """
+    Read access to an archive written by save_arrays. The arrays are LazyArray objects,
+    0-d arrays are returned as numpy scalars.
+
+    Parameters
+    ----------
+    path : str
+        the archive file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._zf = zipfile.ZipFile(path, 'r')
+        chunks = {}
+        configs = []
+        for name in self._zf.namelist():
+            field, i = _split_name(name)
+            if field == _CONFIG:
+                configs.append((i, name))
+            else:
+                chunks.setdefault(field, []).append((i, name))
+        self.config = {}
+        if configs:
+            with self._zf.open(max(configs)[1]) as f:
+                self.config = json.loads(f.read().decode())
+
+        self._arrays = {}
+        for field, names in chunks.items():
+            names = [name for _, name in sorted(names)]
+            shapes = []
+            for name in names:
+                with self._zf.open(name) as f:
+                    version = np.lib.format.read_magic(f)
+                    if version == (1, 0):
+                        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+                    else:
+                        shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+                shapes.append(shape)
+            if len(shapes[0]) == 0:
+                # appending to a 0-d field replaces its value
+                with self._zf.open(names[-1]) as f:
+                    self._arrays[field] = np.lib.format.read_array(f, allow_pickle=False)[()]
+            else:
+                self._arrays[field] = LazyArray(self._zf, names, shapes, dtype)
+
+    def keys(self):
+        return self._arrays.keys()
+
+    def __contains__(self, field):
+        return field in self._arrays
+
+    def __getitem__(self, field):
+        return self._arrays[field]
+
+    def close(self):
+        self._zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def save_arrays(path, arrays, config=None, append=False, chunk_rows=None):
+    """
+    Write arrays to an archive, each array is split in compressed chunks of rows
+
+    Parameters
+    ----------
+    path : str
+        the archive file
+    arrays : dict
+        field name to array, None values are not stored. Field names may contain '/'. Appending
+        to a 0-d field replaces its value
+    config : dict, optional
+        JSON serializable metadata, replaces the metadata of an existing archive
+    append : bool, optional
+        append the rows to the fields of an existing archive instead of overwriting it, by default False
+    chunk_rows : int, optional
+        number of rows per chunk, by default chunks of about 64 MB
+    """
+    counts = {}
+    if append:
+        with zipfile.ZipFile(path, 'r') as zf:
+            for name in zf.namelist():
+                field, i = _split_name(name)
+                counts[field] = max(counts.get(field, -1), i) + 1
+
+    with zipfile.ZipFile(path, 'a' if append else 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for field, values in arrays.items():
+            if values is None:
+                continue
+            values = np.asarray(values)
+            if values.ndim == 0:
+                chunks = [values]
+            else:
+                rows = chunk_rows
+                if rows is None:
+                    row_bytes = max(1, values[:1].nbytes)
+                    rows = max(1, _CHUNK_BYTES // row_bytes)
+                chunks = [values[i:i + rows] for i in range(0, len(values), rows)]
+                if not chunks and field not in counts:
+                    # an empty chunk keeps the shape and dtype of a zero-row array
+                    chunks = [values]
+            i = counts.get(field, 0)
+            for chunk in chunks:
+                with zf.open(_chunk_name(field, i), 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.require(chunk, requirements='C'), allow_pickle=False)
+                i += 1
+            counts[field] = i
+
+        if config is not None:
+            i = counts.get(_CONFIG, 0)
+            with zf.open(_chunk_name(_CONFIG, i), 'w') as f:
+                f.write(json.dumps(config, default=_json_default).encode())
@@ -16,10 +16,140 @@ Dataset Class
 """
 
 # Imports
+from sciope.data.archive import Archive, save_arrays
+from sciope.data.streaming import RunningMoments, QuantileSketch
 import numpy as np
+import os
 from collections import OrderedDict
-from scipy.stats.mstats import mquantiles
-from scipy.stats import zscore
+
+
+class _ColumnBuffer(object):
+    """
+    Array-backed buffer that grows along the first axis by amortized doubling. The stored
+    rows are exposed as a view, appending copies only the new rows.
+    """
+
+    def __init__(self):
+        self._data = None
+        self.n = 0
+
+    @property
+    def view(self):
+        if self._data is None:
+            return None
+        if self.n == len(self._data):
+            # full buffer, also keeps lazily loaded fields lazy
+            return self._data
+        return self._data[:self.n]
+
+    def set(self, values):
+        """ Replace the content, the array (or LazyArray) is used as the buffer without copying """
+        if values is None:
+            self._data = None
+            self.n = 0
+        else:
+            self._data = values if hasattr(values, 'shape') else np.asarray(values)
+            self.n = len(self._data)
+
+    def reserve(self, n):
+        """ Make room for n rows in total """
+        if self._data is not None and n > len(self._data):
+            self._resize(n)
+
+    def append(self, values, reserve=0):
+        """ Append rows, reserve is the initial capacity if the buffer is empty """
+        values = np.asarray(values)
+        if self._data is not None and not isinstance(self._data, np.ndarray):
+            # lazily loaded, read before appending
+            self.set(np.asarray(self._data))
+        if self._data is None:
+            self._create(max(len(values), reserve), values.shape[1:], values.dtype)
+        else:
+            if values.shape[1:] != self._data.shape[1:]:
+                raise ValueError("Dataset: can not append rows of shape {0} to rows of shape {1}".format(
+                    values.shape[1:], self._data.shape[1:]))
+            dtype = np.promote_types(self._data.dtype, values.dtype)
+            if dtype != self._data.dtype:
+                self._recast(dtype)
+
+        needed = self.n + len(values)
+        if needed > len(self._data):
+            self._resize(max(needed, 2 * len(self._data)))
+        self._data[self.n:needed] = values
+        self.n = needed
+
+    def _create(self, capacity, shape, dtype):
+        self._data = np.empty((capacity,) + shape, dtype=dtype)
+
+    def _resize(self, capacity):
+        data = np.empty((capacity,) + self._data.shape[1:], dtype=self._data.dtype)
+        data[:self.n] = self._data[:self.n]
+        self._data = data
+
+    def _recast(self, dtype):
+        self._data = self._data.astype(dtype)
+
+
+class _MemmapBuffer(_ColumnBuffer):
+    """
+    _ColumnBuffer stored in a raw memory-mapped file. Growing extends the file and maps it again,
+    the rows are never copied and views are zero-copy slices of the mapping.
+    """
+
+    def __init__(self, path):
+        super(_MemmapBuffer, self).__init__()
+        self.path = path
+
+    def _map(self, capacity, shape, dtype):
+        row_bytes = int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+        capacity = max(capacity, 1)
+        mode = 'r+b' if os.path.exists(self.path) else 'w+b'
+        with open(self.path, mode) as f:
+            f.truncate(max(capacity * row_bytes, 1))
+        self._data = np.memmap(self.path, dtype=dtype, mode='r+', shape=(capacity,) + shape)
+
+    def set(self, values):
+        if values is None:
+            super(_MemmapBuffer, self).set(None)
+        else:
+            values = np.asarray(values)
+            self._create(len(values), values.shape[1:], values.dtype)
+            self._data[:] = values
+            self.n = len(values)
+
+    def _create(self, capacity, shape, dtype):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._map(capacity, shape, dtype)
+
+    def _resize(self, capacity):
+        self._data.flush()
+        self._map(capacity, self._data.shape[1:], self._data.dtype)
+
+    def _recast(self, dtype):
+        # rare, e.g. integer labels followed by floats, the rows are rewritten in memory
+        values = np.array(self.view, dtype=dtype)
+        capacity = len(self._data)
+        self._create(capacity, values.shape[1:], dtype)
+        self._data[:self.n] = values
+
+    def flush(self):
+        if self._data is not None:
+            self._data.flush()
+
+
+def _field(name):
+    """ A DataSet attribute stored in a _ColumnBuffer """
+
+    def get(self):
+        return self._buffer(name).view
+
+    def set(self, values):
+        self._buffer(name).set(values)
+        if name == 's':
+            self._reset_statistics()
+
+    return property(get, set)
 
 
 # Class definition
@@ -41,29 +171,59 @@ class DataSet(object):  # pragma: no cover
     Methods:
     * get_size					(returns current size of the dataset)
     * add_points				(add data to the dataset, data can be added incrementally)
+    * reserve					(preallocate room for a known number of points)
+    * flush                     (write memory-mapped fields to disk)
+    * save / load               (persist the dataset in a chunked, compressed archive)
     * process_outliers			(check summary stats that contain outliers, and apply log scaling)
     * apply_func_to_columns     (Applies a transformation function to selected column indices of a matrix)
 
 
+    The fields are stored in preallocated buffers that grow by doubling, x, y, ts and s are
+    views of the rows added so far. With a storage_dir the buffers are memory-mapped files in
+    that directory, one per field, and the data is kept on disk instead of in memory.
     """
 
-    def __init__(self, name):
+    x = _field('x')
+    y = _field('y')
+    ts = _field('ts')
+    s = _field('s')
+
+    def __init__(self, name, storage_dir=None):
         """
         Initialize a dataset with parameters specified above
         
         Parameters
         ----------
         see above
+        storage_dir : str, optional
+            directory of the memory-mapped field files, by default None which keeps the data in memory.
+            Existing field files in the directory are overwritten, use one directory per dataset
         """
         self.name = name
-        self.x = None
-        self.y = None
-        self.ts = None
-        self.s = None
+        self.storage_dir = storage_dir
+        if storage_dir is not None:
+            os.makedirs(storage_dir, exist_ok=True)
+        self._buffers = {}
+        self._reserved = 0
         self.outlier_column_indices = None
         self.outlier_detection = False
         self.configurations = OrderedDict()
-        self.size = 0
+        self._reset_statistics()
+
+    def _buffer(self, name):
+        if name not in self._buffers:
+            if self.storage_dir is None:
+                self._buffers[name] = _ColumnBuffer()
+            else:
+                self._buffers[name] = _MemmapBuffer(os.path.join(self.storage_dir, name + '.dat'))
+        return self._buffers[name]
+
+    def _append(self, name, values):
+        self._buffer(name).append(values, reserve=self._reserved)
+
+    @property
+    def size(self):
+        return max([buffer.n for buffer in self._buffers.values()] + [0])
 
     def get_size(self):
         """
@@ -76,6 +236,73 @@ class DataSet(object):  # pragma: no cover
         """
         return self.size
 
+    def reserve(self, n):
+        """
+        Preallocate room for n points in total, so that adding up to n points needs a single
+        allocation per field. Only a hint, the dataset grows beyond n points when needed.
+
+        Parameters
+        ----------
+        n : int
+            The expected total number of points
+        """
+        self._reserved = n
+        for buffer in self._buffers.values():
+            buffer.reserve(n)
+
+    def flush(self):
+        """
+        Write memory-mapped fields to disk, no-op for in-memory datasets
+        """
+        for buffer in self._buffers.values():
+            if isinstance(buffer, _MemmapBuffer):
+                buffer.flush()
+
+    def save(self, path, append=False):
+        """
+        Save the dataset to a chunked, compressed archive, see sciope.data.archive
+
+        Parameters
+        ----------
+        path : str
+            the archive file
+        append : bool, optional
+            only write the points added since the archive was saved, by default False
+        """
+        start = {}
+        if append and os.path.exists(path):
+            with Archive(path) as archive:
+                start = {field: len(archive[field]) for field in archive.keys()}
+        arrays = {name: buffer.view[start.get(name, 0):] for name, buffer in self._buffers.items()
+                  if buffer.view is not None}
+        config = {'name': self.name, 'configurations': self.configurations,
+                  'outlier_column_indices': self.outlier_column_indices}
+        save_arrays(path, arrays, config=config, append=append and os.path.exists(path))
+
+    def load(self, path, lazy=True):
+        """
+        Load a dataset saved by DataSet.save, replacing the current content
+
+        Parameters
+        ----------
+        path : str
+            the archive file
+        lazy : bool, optional
+            keep the fields on disk and only read the rows that are indexed, by default True.
+            Adding points to a lazily loaded field reads it into memory first
+        """
+        archive = Archive(path)
+        self._reset_statistics()
+        for field in archive.keys():
+            values = archive[field]
+            self._buffer(field).set(values if lazy else np.asarray(values))
+        self.name = archive.config.get('name', self.name)
+        self.configurations = OrderedDict(archive.config.get('configurations', {}))
+        outliers = archive.config.get('outlier_column_indices')
+        self.outlier_column_indices = None if outliers is None else np.asarray(outliers)
+        if not lazy:
+            archive.close()
+
     def add_points(self, inputs=None, targets=None, time_series=None, summary_stats=None):
         """
         Updates the dataset to include new points
@@ -103,41 +330,47 @@ class DataSet(object):  # pragma: no cover
             if self.x is not None:
                 np.testing.assert_equal(self.x.shape[1], inputs.shape[1], "Please validate the values and ensure the \
                                                                           shape equality of new samples to be added.")
-                self.x = np.concatenate((self.x, inputs), axis=0)
-            else:
-                self.x = inputs
+            self._append('x', inputs)
 
         if targets is not None:
             if self.y is not None:
                 np.testing.assert_equal(self.y.shape[1], targets.shape[1], "Please validate the values and ensure the \
                                                                            shape equality of new samples to be added.")
-                self.y = np.concatenate((self.y, targets), axis=0)
-            else:
-                self.y = targets
+            self._append('y', targets)
 
         if time_series is not None:
-            if self.ts is not None:
-                self.ts = np.concatenate((self.ts, time_series), axis=0)
-            else:
-                self.ts = time_series
+            self._append('ts', time_series)
 
         if summary_stats is not None:
             if self.s is not None:
                 np.testing.assert_equal(self.s.shape[1], summary_stats.shape[1], "Please validate the values and \
                                                                                  ensure the shape equality of new \
                                                                                  samples to be added.")
-                self.s = np.concatenate((self.s, summary_stats), axis=0)
-            else:
-                self.s = summary_stats
+            self._append('s', summary_stats)
 
             if self.outlier_detection and len(self.s) > 1:
                 self.process_outliers()
 
+    def _reset_statistics(self):
+        self._moments = RunningMoments()
+        self._sketch = QuantileSketch()
+
+    def _update_statistics(self):
+        """ Add the summary statistics added since the last update to the streaming statistics """
+        n = 0 if self.s is None else len(self.s)
+        if n < self._moments.count:
+            self._reset_statistics()
+        new = self.s[self._moments.count:]
+        self._moments.update(new)
+        self._sketch.update(new)
+
     def process_outliers(self, mode='zscore'):
         """
         Check for outliers in calculated summary stats. Outliers are the few very high or very low values that can
         potentially introduce bias in tasks such as parameter inference. One can either remove them, replace with mean
         value, or use log scale for the statistic in question. This choice is left to the user.
+        The statistics are streaming (Welford moments, column extremes and a quantile sketch, see
+        sciope.data.streaming), each call only processes the summary stats added since the previous call.
         
         Parameters
         ----------
@@ -149,27 +382,26 @@ class DataSet(object):  # pragma: no cover
         array
             Indices of dataset.s columns containing outliers
         """
+        self._update_statistics()
+        # Any value of a column violates a bound if and only if its minimum or maximum does
         if mode == 'zscore':
-            # This will give us per-feature/per-statistic z-scores
-            zscores = zscore(self.s, axis=0)
-
-            # Find columns where abs(zscore) > threshold
+            # Find columns where abs(zscore) > threshold, with per-feature/per-statistic z-scores
             zscore_threshold = 3
-            violation_indices = np.argwhere(np.abs(zscores) > zscore_threshold)
-            if len(violation_indices) < 1:
-                return
-            outlier_indices = np.unique(np.argwhere(np.abs(zscores) > zscore_threshold)[:, 1])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                violations = (np.maximum(self._moments.max - self._moments.mean,
+                                         self._moments.mean - self._moments.min) / self._moments.std) > zscore_threshold
         else:
-            # Outlier detection using IQR
-            quants = mquantiles(self.s)
+            # Outlier detection using IQR, over all summary statistics
+            quants = self._sketch.quantiles()
             iqr = quants[2] - quants[0]
             iqr_factor = 1.5
-            violations_left = self.s < quants[0] - iqr_factor * iqr
-            violations_right = self.s > quants[2] + iqr_factor * iqr
-            violation_indices = np.argwhere(violations_left | violations_right)
-            if len(violation_indices) < 1:
-                return
-            outlier_indices = np.unique(np.argwhere(violations_left | violations_right)[:, 1])
+            violations = (self._moments.min < quants[0] - iqr_factor * iqr) | \
+                         (self._moments.max > quants[2] + iqr_factor * iqr)
+
+        violation_indices = np.argwhere(violations)
+        if len(violation_indices) < 1:
+            return
+        outlier_indices = np.unique(violation_indices[:, 0])
 
         if len(outlier_indices) > 0:
             self.outlier_column_indices = outlier_indices
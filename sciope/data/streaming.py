@@ -0,0 +1,189 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Streaming statistics that are updated in O(batch) time and can be merged across workers
+"""
+
+# Imports
+import numpy as np
+from scipy.stats.mstats import mquantiles
+
+
+class RunningMoments(object):
+    """
+    Per-column count, mean, variance, minimum and maximum of a stream of rows, using
+    Welford's algorithm for batches (Chan et al.) so that a batch update and a merge are
+    the same operation.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def update(self, x):
+        """
+        Add a batch of rows
+
+        Parameters
+        ----------
+        x : ndarray
+            array of shape (n, ...), the statistics are computed over the first axis
+        """
+        x = np.asarray(x, dtype=float)
+        if len(x) == 0:
+            return
+        other = RunningMoments()
+        other.count = len(x)
+        other.mean = x.mean(axis=0)
+        other.m2 = ((x - other.mean) ** 2).sum(axis=0)
+        other.min = x.min(axis=0)
+        other.max = x.max(axis=0)
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        Merge the statistics of another stream, e.g. computed by a worker
+
+        Parameters
+        ----------
+        other : RunningMoments
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            self.min, self.max = other.min.copy(), other.max.copy()
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * (self.count * other.count / count)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.count = count
+
+    @property
+    def var(self):
+        """ The population variance (ddof=0) """
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch of a stream of values, a hierarchy of compactors (Manku et al.,
+    Karnin et al.). Level h holds values of weight 2 ** h. A level holding more than 2 * size
+    values is sorted and compacted, every other value is promoted to the next level with twice
+    the weight. Each compaction at level h moves the rank of any value by at most 2 ** h, so the
+    rank error of the quantiles of n values is at most (1 + log2(n / size)) / size. Quantiles
+    are exact (as scipy.stats.mstats.mquantiles) until the first compaction.
+
+    Parameters
+    ----------
+    size : int, optional
+        half the capacity of each level, by default 2048
+    """
+
+    def __init__(self, size=2048):
+        self.size = size
+        self._levels = []
+        self._offsets = []
+
+    @property
+    def values(self):
+        return np.concatenate(self._levels) if self._levels else np.empty(0)
+
+    @property
+    def weights(self):
+        return np.concatenate([np.full(len(values), 2.0 ** h) for h, values in enumerate(self._levels)]) \
+            if self._levels else np.empty(0)
+
+    @property
+    def count(self):
+        return sum(len(values) * 2.0 ** h for h, values in enumerate(self._levels))
+
+    def update(self, x):
+        """
+        Add values, any shape
+
+        Parameters
+        ----------
+        x : array-like
+        """
+        self._add([np.asarray(x, dtype=float).ravel()])
+
+    def merge(self, other):
+        """
+        Merge another sketch, e.g. computed by a worker
+
+        Parameters
+        ----------
+        other : QuantileSketch
+        """
+        self._add(other._levels)
+
+    def _add(self, levels):
+        for h, values in enumerate(levels):
+            if h == len(self._levels):
+                self._levels.append(np.empty(0))
+                self._offsets.append(0)
+            self._levels[h] = np.concatenate((self._levels[h], values))
+        self._compress()
+
+    def _compress(self):
+        h = 0
+        while h < len(self._levels):
+            values = self._levels[h]
+            if len(values) > 2 * self.size:
+                values = np.sort(values)
+                # an odd value out stays, every other value of the sorted pairs is promoted
+                even = len(values) - len(values) % 2
+                promoted = values[self._offsets[h]:even:2]
+                # alternating between the lower and upper values of the pairs cancels most of the error
+                self._offsets[h] ^= 1
+                self._levels[h] = values[even:]
+                if h + 1 == len(self._levels):
+                    self._levels.append(np.empty(0))
+                    self._offsets.append(0)
+                self._levels[h + 1] = np.concatenate((self._levels[h + 1], promoted))
+            h += 1
+
+    def quantiles(self, prob=(0.25, 0.5, 0.75)):
+        """
+        Estimate quantiles of the values seen so far
+
+        Parameters
+        ----------
+        prob : sequence, optional
+            the probabilities, by default the quartiles
+
+        Returns
+        -------
+        ndarray
+        """
+        if len(self._levels) <= 1:
+            return np.asarray(mquantiles(self.values, prob=prob))
+        values = self.values
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        weights = self.weights[order]
+        # interpolate between the centers of the weighted points
+        centers = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return np.interp(prob, centers, values)
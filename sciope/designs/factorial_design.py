@@ -18,12 +18,93 @@ Factorial Initial Design
 # Imports
 from sciope.designs.initial_design_base import InitialDesignBase
 from sciope.utilities.housekeeping import sciope_logger as ml
-from toolz import partition_all
 from dask import delayed
 import dask.array as da
 import numpy as np
 
 
+_MIX1 = np.uint64(0x9E3779B97F4A7C15)
+_MIX2 = np.uint64(0xBF58476D1CE4E5B9)
+
+
+class _IndexPermutation(object):
+    """
+    A pseudo-random permutation of range(n) that is evaluated arithmetically, positions are mapped
+    to indices by a keyed Feistel network with cycle-walking. Any contiguous range of positions
+    is permuted in O(range) memory, and the object is small enough to be sent to workers.
+    Slicing with a step of 1 returns a view with the same key.
+    """
+
+    def __init__(self, n, keys=None, start=0, stop=None):
+        self.n = n
+        self.start = start
+        self.stop = n if stop is None else stop
+        bits = max(2, int(n - 1).bit_length())
+        self._half = np.uint64((bits + 1) // 2)
+        self._mask = np.uint64((1 << int(self._half)) - 1)
+        if keys is None:
+            keys = np.random.randint(0, 2 ** 32, size=4).astype(np.uint64)
+        self.keys = keys
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step not in (None, 1):
+            return np.asarray(self)[item]
+        start, stop, _ = item.indices(len(self))
+        return _IndexPermutation(self.n, self.keys, self.start + start, self.start + max(start, stop))
+
+    def __array__(self, dtype=None):
+        return self.take(0, len(self)).astype(dtype) if dtype is not None else self.take(0, len(self))
+
+    def _round(self, r, key):
+        z = (r ^ key) * _MIX1
+        z ^= z >> np.uint64(29)
+        z *= _MIX2
+        z ^= z >> np.uint64(32)
+        return z & self._mask
+
+    def _encrypt(self, x):
+        left = x >> self._half
+        right = x & self._mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self._half) | right
+
+    def take(self, start, stop):
+        """
+        The permuted indices at positions self.start + start, ..., self.start + stop - 1
+        """
+        x = self._encrypt(np.arange(self.start + start, self.start + stop, dtype=np.uint64))
+        # cycle-walk until every index falls inside range(n)
+        outside = x >= self.n
+        while outside.any():
+            x[outside] = self._encrypt(x[outside])
+            outside = x >= self.n
+        return x.astype(np.int64)
+
+
+def _grid_points(idx, levels, xmin, xmax):
+    """
+    Decode flat indices into factorial grid points. The flat index is a mixed-radix number with the
+    level of the second variable as its most significant digit, followed by the first, third, ...
+    variable, which is the row order of a meshgrid of the grid coordinates.
+    """
+    d = len(xmin)
+    digits = np.unravel_index(np.asarray(idx, dtype=np.int64), (levels,) * d)
+    if d > 1:
+        digits = (digits[1], digits[0]) + digits[2:]
+    x = np.empty((len(idx), d))
+    for i in range(d):
+        x[:, i] = np.linspace(xmin[i], xmax[i], num=levels)[digits[i]]
+    return x
+
+
+def _permuted_grid_points(perm, start, stop, levels, xmin, xmax):
+    return _grid_points(perm.take(start, stop), levels, xmin, xmax)
+
+
 # Class definition
 class FactorialDesign(InitialDesignBase):
     """
@@ -41,6 +122,7 @@ class FactorialDesign(InitialDesignBase):
 
     Methods:
     * generate					(returns a delayed object that can generated the desired number of samples)
+    * index_to_point            (maps flat indices to design points)
     """
 
     def __init__(self, levels, xmin, xmax, use_logger=False):
@@ -66,32 +148,68 @@ class FactorialDesign(InitialDesignBase):
             self.logger.info("Factorial design in {0} dimensions initialized".format(len(self.xmin)))
 
     
+    @property
+    def n_points(self):
+        """
+        The number of points in the design, levels^d
+        """
+        return self.levels ** len(self.xmin)
+
+    def index_to_point(self, idx):
+        """
+        Map flat indices in [0, levels^d) to points of the factorial design, without generating the grid
+
+        Parameters
+        ----------
+        idx : integer or vector
+            flat indices into the design
+
+        Returns
+        -------
+        matrix
+            one point per index
+        """
+        return _grid_points(np.atleast_1d(idx), self.levels, self.xmin, self.xmax)
+
     def generate(self):
         """
         Sub-classable method for generating a factorial design of specified 'levels' in the given domain.
-        The number of generated points is levels^d.
+        The number of generated points is levels^d. The design is lazy, each block of the returned
+        dask array decodes its own range of flat indices into grid points.
         
         Returns
         -------
-        dask.delayed
+        dask.array
             
         """
-        if hasattr(self, 'random_idx'):
-            del self.random_idx
-
-        # Get grid coordinates
-        grid_coords = [da.linspace(lb, ub, num=self.levels) for lb, ub in zip(self.xmin, self.xmax)]
-
-        # Generate the full grid
-        x = da.meshgrid(*grid_coords)
-        dim_idx = [item.ravel() for item in x]
-        x = da.vstack(dim_idx).T
-        x = x.rechunk(('auto', x.shape[1]))
+        del self.random_idx
+
+        d = len(self.xmin)
+        n = self.n_points
+        # blocks of about 128 MB
+        idx = da.arange(n, chunks=max(1, 2 ** 24 // d))
+        x = idx.map_blocks(_grid_points, self.levels, self.xmin, self.xmax, new_axis=1,
+                           chunks=(idx.chunks[0], (d,)), dtype=float)
         if self.use_logger:
-            self.logger.info("Factorial design: generated {0} points in {1} dimensions".format(len(x), len(self.xmin)))
+            self.logger.info("Factorial design: generated {0} points in {1} dimensions".format(n, d))
         self.generated = x
         return x
-    
+
+    def _draw_generated(self, n_samples, chunk_size=1):
+        """
+        Draw points without replacement through a lazy random permutation of the flat indices,
+        each chunk is decoded by the worker from its range of permutation positions.
+        """
+        if getattr(self, '_perm', None) is None:
+            self._perm = _IndexPermutation(self.n_points)
+            self._cursor = 0
+
+        start = self._cursor
+        stop = min(start + n_samples, len(self._perm))
+        self._cursor = stop
+        points = delayed(_permuted_grid_points, pure=True)
+        return [points(self._perm, i, min(i + chunk_size, stop), self.levels, self.xmin, self.xmax)
+                for i in range(start, stop, chunk_size)]
 
     def draw(self,n_samples, chunk_size=1, auto_redesign=True):
         """
@@ -113,39 +231,20 @@ class FactorialDesign(InitialDesignBase):
         if not hasattr(self, 'generated'):
             self.generate()
 
-        if not hasattr(self, 'random_idx'):
-            self.random_idx = np.arange(self.generated.shape[0])
-        
-        len_random = len(self.random_idx)
+        len_random = len(self.random_idx) if hasattr(self, 'random_idx') else self.generated.shape[0]
         if len_random == 0:
             del self.generated
             del self.random_idx
             if auto_redesign:
                 if self.use_logger:
-                    self.logger.info("{0} points left to draw form Latin hypercube design:\
-                    computing new design for {0} points".format(n))
+                    self.logger.info("0 points left to draw from factorial design: computing new design")
                 return self.draw(n_samples, chunk_size=chunk_size)
             else:
-                raise(ValueError)("{0} points left to draw form Latin hypercube design:\
+                raise(ValueError)("{0} points left to draw from factorial design:\
                 clearing design".format(len_random))
 
-        if n_samples > len_random: 
-            if self.use_logger:
-                self.logger.info("Only {0} points left to draw form Latin hypercube design:\
-                    setting n_samples to {0}".format(len_random))
-            idx = range(len_random)
-        else:   
-            idx = np.random.choice(range(len_random), n_samples, replace=False)
-        
-        idx_chunks = partition_all(chunk_size, idx)
-        delays = []
-        for i in idx_chunks:
-            i = list(i)
-            rand_idx = self.random_idx[i]
-            delay = self.generated[rand_idx].to_delayed()[0]
-            delays.append(delay[0])
-            
-        self.random_idx = np.delete(self.random_idx, idx)    
-
-        return delays
+        if n_samples > len_random and self.use_logger:
+            self.logger.info("Only {0} points left to draw from factorial design:\
+                setting n_samples to {0}".format(len_random))
 
+        return self._draw_generated(n_samples, chunk_size)
@@ -17,6 +17,7 @@ Initial Design Base Class
 
 # Imports
 from abc import ABCMeta, abstractmethod
+from dask import delayed
 import numpy as np
 
 
@@ -70,6 +71,48 @@ class InitialDesignBase(object):
         Sub-classable method for generating 'n' points within a given domain. Each derived class must implement.
         """
 
+    @property
+    def random_idx(self):
+        """
+        Indices of the generated points that have not been drawn yet, in the order they will be drawn
+        """
+        if getattr(self, '_perm', None) is None:
+            raise AttributeError("random_idx")
+        return self._perm[self._cursor:]
+
+    @random_idx.deleter
+    def random_idx(self):
+        self._perm = None
+        self._shuffled = None
+
+    def _draw_generated(self, n_samples, chunk_size=1):
+        """
+        Draw points without replacement from self.generated. The design is materialized and
+        shuffled once, each draw then advances a cursor and returns contiguous blocks.
+
+        Parameters
+        ----------
+        n_samples : integer
+            number of points to draw, at most the number of points left
+        chunk_size : integer, optional
+            number of points in each chunk, by default 1
+
+        Returns
+        -------
+        list
+            dask.delayed (m, d) arrays, full chunks first
+        """
+        if getattr(self, '_perm', None) is None:
+            x = np.asarray(self.generated)
+            self._perm = np.random.permutation(x.shape[0])
+            self._shuffled = x[self._perm]
+            self._cursor = 0
+
+        start = self._cursor
+        stop = min(start + n_samples, len(self._perm))
+        self._cursor = stop
+        return [delayed(self._shuffled[i:min(i + chunk_size, stop)]) for i in range(start, stop, chunk_size)]
+
     @staticmethod
     def scale_variable(x, old_min, old_max, new_min, new_max):
         """
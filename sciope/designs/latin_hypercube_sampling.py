@@ -25,12 +25,14 @@ International journal for numerical methods in engineering 82, no. 2 (2010): 135
 # Imports
 from sciope.designs.initial_design_base import InitialDesignBase
 from sciope.utilities.housekeeping import sciope_logger as ml
-from scipy.spatial.distance import cdist, pdist
+from sciope.core import executors
+from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
+from functools import partial
 import numpy as np
 from dask import delayed
 from dask.distributed import wait, get_client
 import dask.array as da
-from toolz import partition_all
 
 def _cluster_mode():
     try:
@@ -40,6 +42,17 @@ def _cluster_mode():
         return False
 
 
+def _min_distance(x, workers=1):
+    """
+    The minimum inter-site distance of a design, through nearest-neighbour queries
+    on a KD-tree instead of all pairwise distances
+    """
+    if x.shape[0] < 2:
+        return 0.0
+    distances, _ = cKDTree(x, balanced_tree=False).query(x, k=2, workers=workers)
+    return distances[:, 1].min()
+
+
 # Class definition
 class LatinHypercube(InitialDesignBase):
     """
@@ -82,7 +95,6 @@ class LatinHypercube(InitialDesignBase):
             self.logger = ml.SciopeLogger().get_logger()
             self.logger.info("Latin hypercube design in {0} dimensions initialized".format(len(self.xmin)))
 
-    @delayed
     def _tplhsdesign(self, n, seed, ns):
         """
         Creates a LH using translational propagation.
@@ -109,21 +121,20 @@ class LatinHypercube(InitialDesignBase):
         nb = np.power(nd_star, self._nv) if nd_star > nd else n / ns
 
         # Size of TPLHD to be created
-        np_star = nb * ns
+        np_star = int(round(nb * ns))
 
         # Reshape the seed to properly create the first design
-        seed = self._reshape_seed(seed, ns, np_star, nd_star).compute()
+        seed = self._reshape_seed(seed, ns, np_star, nd_star)
 
         # Create a TPLHD with np_star points
-        x = self._create_tplhd(seed, np_star, nd_star).compute()
+        x = self._create_tplhd(seed, np_star, nd_star)
 
         # Resize if necessary
         if np_star > n:
-            x = self._resize_tplhd(x, np_star, n).compute()
+            x = self._resize_tplhd(x, np_star, n)
 
         return x
 
-    @delayed
     def _reshape_seed(self, seed, ns, np_star, nd_star):
         """
         Scales the seed design as needed.
@@ -153,10 +164,10 @@ class LatinHypercube(InitialDesignBase):
             b = ut - a * uf
             return np.round(a * seed + b)
 
-    @delayed
     def _create_tplhd(self, seed, np_star, nd_star):
         """
-        Generate a TP LHD
+        Generate a TP LHD. The design is preallocated and grown in place, each variable
+        propagates the current block of points nd_star - 1 times by a translation.
 
         Parameters
         ----------
@@ -171,23 +182,24 @@ class LatinHypercube(InitialDesignBase):
         -------
         vector/array
         """
-        x = seed
+        nd = int(nd_star)
+        x = np.empty((np_star, self._nv))
+        m = seed.shape[0]
+        x[:m] = seed
         for c1 in range(0, self._nv):
-            # propagate
-            seed = x
-
             # translate
             d = np.concatenate((np.power(nd_star, c1 - 1) * np.ones(np.max((c1, 0))), [np_star / nd_star],
                                 np.power(nd_star, c1) * np.ones(self._nv - np.max((c1, 0)) - 1)))
 
-            for c2 in np.arange(1, nd_star):
-                seed = seed + d
-                x = np.vstack((x, seed))
+            # propagate
+            block = x[:m]
+            for c2 in range(1, nd):
+                np.add(block, c2 * d, out=x[c2 * m:(c2 + 1) * m])
+            m *= nd
 
-        np.testing.assert_equal(x.shape, (np_star, self._nv))
+        np.testing.assert_equal(m, np_star)
         return x
 
-    @delayed
     def _resize_tplhd(self, x, np_star, n):
         """
         In case the design is larger than requested, resize it. Else, return unchanged.
@@ -220,55 +232,123 @@ class LatinHypercube(InitialDesignBase):
 
         # remove spaces
         x_sorted = np.argsort(x, axis=0)
-        x[x_sorted, np.arange(self._nv)] = np.tile(np.arange(1, n + 1), (self._nv, 1)).T
+        x[x_sorted, np.arange(self._nv)] = np.arange(1, n + 1)[:, None]
         np.testing.assert_equal(x.shape[0], n)
         return x
 
+    def _seed(self, ns):
+        """
+        The deterministic seed design of 'ns' points, seeds of 3 or more points are
+        built by recursive division
+        """
+        if ns < 3:
+            # 1/2 points
+            return np.arange(1, ns + 1)[:, None] * np.ones(shape=(1, self._nv))
+        seed = LatinHypercube(self.xmin, self.xmax, seed_size=ns - 1)._generate(ns)
+        return self.scale_to_new_domain(seed, self.xmin, self.xmax)
+
+    def _generate(self, n):
+        """
+        Generate an unscaled TPLHD of 'n' points from the largest seed, plain NumPy
+        """
+        ns = min(n, self._seed_size)
+        return self._tplhsdesign(n, self._seed(ns), ns)
+
+    def _candidate(self, n, seed, workers=1):
+        """
+        Propagate a seed design to a scaled 'n' point design and score it
+
+        Returns
+        -------
+        tuple
+            the design and its minimum inter-site distance
+        """
+        x = self._tplhsdesign(n, seed, seed.shape[0])
+        x = self.scale_to_new_domain(x, self.xmin, self.xmax)
+        return x, _min_distance(x, workers=workers)
+
+    def search(self, n, n_candidates=None, executor=None):
+        """
+        Generate several candidate designs, rank them based on inter-site distance and
+        return the top-ranked candidate. The candidates are the TPLHDs propagated from
+        the seeds of 1, ..., seed_size points, and n_candidates - seed_size designs
+        propagated from random Latin hypercube seeds of seed_size points.
+        Candidates are evaluated in parallel by the executor and scored by their
+        minimum nearest-neighbour distance, using a KD-tree over every point. The
+        KD-tree queries only use all cores when the executor is serial, so parallel
+        candidates do not oversubscribe the threads.
+
+        Parameters
+        ----------
+        n: integer
+            # of desired points in the design
+        n_candidates: integer, optional
+            # of candidate designs, by default one per seed size
+        executor : sciope.core.executors.ExecutorBase or str, optional
+            the executor evaluating the candidates, by default None which uses dask. An executor
+            created from a name is shut down before returning, an executor instance is left to the caller
+
+        Returns
+        -------
+        tuple
+            the best design, scaled to [xmin, xmax], and its minimum inter-site distance
+        """
+        ns = min(n, self._seed_size)
+        seeds = [self._seed(i) for i in range(1, ns + 1)]
+        if n_candidates is not None and ns > 1:
+            for i in range(len(seeds), n_candidates):
+                # random Latin hypercube seed, an independent permutation of the levels per variable
+                seeds.append(np.argsort(np.random.random((ns, self._nv)), axis=0) + 1.0)
+
+        owns_executor = not isinstance(executor, executors.ExecutorBase)
+        executor = executors.get_executor(executor)
+        workers = -1 if isinstance(executor, executors.SerialExecutor) else 1
+        try:
+            candidates = executor.map(partial(self._candidate, n, workers=workers), seeds)
+        finally:
+            if owns_executor:
+                executor.shutdown()
+        lhd, score = max(candidates, key=lambda candidate: candidate[1])
+
+        if self.use_logger:
+            self.logger.info("Latin hypercube design: best of {0} candidates has minimum distance {1}".format(
+                len(candidates), score))
+
+        return lhd, score
+
     @delayed
-    def generate(self, n):
+    def generate(self, n, n_candidates=None, executor='serial'):
         """
         Sub-classable method for generating 'n' points in the given 'domain'.
-        Generate several candidate designs, rank them based on inter-site distance and select the top-ranked candidate
-        Implementation similar to gpflowopt/LHD
+        By default a single TPLHD is propagated from the largest seed, without scoring.
+        With n_candidates, several candidate designs are generated, ranked based on
+        inter-site distance and the top-ranked candidate is selected.
+        Implementation similar to gpflowopt/LHD, see search
 
         Parameters
         ----------
         n: integer
             # of desired points in the initial design
+        n_candidates: integer, optional
+            # of candidate designs to search, by default None which skips the search
+        executor : sciope.core.executors.ExecutorBase or str, optional
+            the executor evaluating the candidates, by default 'serial'
 
         Returns
         -------
         dask.delayed
         """
-        candidates = []
-        scores = []
-        nv = len(self.xmin)
-        for i in np.arange(1, min(n, self._seed_size) + 1):
-            if i < 3:
-                # 1/2 points
-                seed = delayed(np.arange(1, i + 1)[:, None] * np.ones(shape=(1, nv)))
-            else:
-                # Larger seeds using recursive division
-                seed = LatinHypercube(self.xmin, self.xmax, self.use_logger, seed_size=i - 1).generate(i)
-
-        # Create candidate designs and compute inter-site distance
-        ns = seed.shape[0]
-        x = self._tplhsdesign(n, seed, ns).compute()
-        candidates.append(x)
-        scores.append(np.min(pdist(x)))
-
-        # Select the top-ranked candidate
-        lhd = candidates[np.argmax(scores)]
-
-        # Scale to [xmin, xmax]
-        lhd_scaled = self.scale_to_new_domain(lhd, self.xmin, self.xmax)
+        if n_candidates is None:
+            lhd_scaled = self.scale_to_new_domain(self._generate(n), self.xmin, self.xmax)
+        else:
+            lhd_scaled, _ = self.search(n, n_candidates=n_candidates, executor=executor)
 
         if self.use_logger:
-            self.logger.info("Latin hypercube design: generated {0} points in {1} dimensions".format(n, nv))
+            self.logger.info("Latin hypercube design: generated {0} points in {1} dimensions".format(n, self._nv))
 
         return lhd_scaled
 
-    def generate_array(self, n, chunk_size=('auto', 'auto')):
+    def generate_array(self, n, chunk_size=('auto', 'auto'), n_candidates=None, executor='serial'):
         """
         Generate a partial design of specified points
 
@@ -276,22 +356,27 @@ class LatinHypercube(InitialDesignBase):
         ----------
         n: integer
             # of desired points
+        n_candidates: integer, optional
+            # of candidate designs to search, see generate
+        executor : sciope.core.executors.ExecutorBase or str, optional
+            the executor evaluating the candidates, see generate
 
         Returns
         -------
         vector/array
         """
-        if _cluster_mode:
-            lhd = self.generate(n).persist()
+        if _cluster_mode():
+            lhd = self.generate(n, n_candidates, executor).persist()
             wait(lhd)
         else:
-            lhd = self.generate(n)
+            lhd = self.generate(n, n_candidates, executor)
             
-        lhd_array = da.from_delayed(lhd, shape=(n, self._nv), dtype=np.float)
+        lhd_array = da.from_delayed(lhd, shape=(n, self._nv), dtype=float)
         lhd_array = lhd_array.rechunk(chunk_size)
         self.generated = lhd_array #store for sampling of design
+        del self.random_idx
 
-    def draw(self, n_samples, n=50, chunk_size = 1, auto_redesign=True):
+    def draw(self, n_samples, n=50, chunk_size = 1, auto_redesign=True, n_candidates=None, executor='serial'):
         """
         Draw specified number of points from a generated LHD
 
@@ -303,47 +388,33 @@ class LatinHypercube(InitialDesignBase):
             []
         auto_redesign : boolean
             []
+        n_candidates: integer, optional
+            # of candidate designs to search when a design is generated, see generate
+        executor : sciope.core.executors.ExecutorBase or str, optional
+            the executor evaluating the candidates, see generate
 
         Returns
         -------
         vector/array
         """
         if not hasattr(self, 'generated'):
-            self.generate_array(n)
+            self.generate_array(n, n_candidates=n_candidates, executor=executor)
 
-        if not hasattr(self, 'random_idx'):
-            self.random_idx = np.arange(self.generated.shape[0])
-        
-        len_random = len(self.random_idx)
+        len_random = len(self.random_idx) if hasattr(self, 'random_idx') else self.generated.shape[0]
         if len_random == 0:
             del self.generated
             del self.random_idx
             if auto_redesign:
                 if self.use_logger:
                     self.logger.info("{0} points left to draw form Latin hypercube design:\
-                    computing new design for {0} points".format(n))
-                return self.draw(n_samples, n, chunk_size=chunk_size)
+                    computing new design for {1} points".format(len_random, n))
+                return self.draw(n_samples, n, chunk_size=chunk_size, n_candidates=n_candidates, executor=executor)
             else:
                 raise(ValueError)("{0} points left to draw form Latin hypercube design:\
                  clearing design".format(len_random))
 
-        if n_samples > len_random: 
-            if self.use_logger:
-                self.logger.info("Only {0} points left to draw form Latin hypercube design:\
-                    setting n_samples to {0}".format(len_random))
-            idx = range(len_random)
-        else:   
-            idx = np.random.choice(range(len_random), n_samples, replace=False)
-        
-        idx_chunks = partition_all(chunk_size, idx)
-        delays = []
-        for i in idx_chunks:
-            i = list(i)
-            rand_idx = self.random_idx[i]
-            delay = self.generated[rand_idx].to_delayed()[0]
-            delays.append(delay[0])
-            
-        self.random_idx = np.delete(self.random_idx, idx)    
-
-        return delays
+        if n_samples > len_random and self.use_logger:
+            self.logger.info("Only {0} points left to draw form Latin hypercube design:\
+                setting n_samples to {0}".format(len_random))
 
+        return self._draw_generated(n_samples, chunk_size)
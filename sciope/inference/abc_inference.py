@@ -20,14 +20,9 @@ from sciope.inference.inference_base import InferenceBase
 from sciope.utilities.distancefunctions import euclidean as euc
 from sciope.utilities.summarystats import burstiness as bs
 from sciope.core import core
+from sciope.core import executors
 from sciope.utilities.housekeeping import sciope_logger as ml
-from toolz import partition_all
 import numpy as np
-from dask.distributed import futures_of, as_completed, get_client
-import dask
-
-# The following variable stores n normalized distance values after n summary statistics have been calculated
-normalized_distances = None
 
 # Class definition: ABC rejection sampling
 class ABC(InferenceBase):
@@ -50,7 +45,8 @@ class ABC(InferenceBase):
     """
 
     def __init__(self, data, sim, prior_function, epsilon=0.1, summaries_function=bs.Burstiness(),
-                 distance_function=euc.EuclideanDistance(), summaries_divisor=None, use_logger=False):
+                 distance_function=euc.EuclideanDistance(), summaries_divisor=None, use_logger=False,
+                 executor=None):
         """
         ABC class for rejection sampling
         
@@ -74,15 +70,21 @@ class ABC(InferenceBase):
             factors. These may come from prior knowledge, or pre-studies, etc.
         use_logger : bool
             enable/disable logging
+        executor : sciope.core.executors.ExecutorBase or str, optional
+            executor used for running the simulations when no dask cluster is used, one of 'serial',
+            'threads', 'processes' and 'dask'; by default dask. An executor created from a name is
+            shut down at the end of infer, an executor instance is left to the caller
         """
         self.name = 'ABC'
         self.epsilon = epsilon
         self.summaries_function = summaries_function
         self.prior_function = prior_function.draw
         self.distance_function = distance_function.compute
-        self.historical_distances = []
+        self.distance_maxima = None
         self.summaries_divisor = summaries_divisor
         self.use_logger = use_logger
+        self.executor = executors.get_executor(executor)
+        self._owns_executor = not isinstance(executor, executors.ExecutorBase)
         super(ABC, self).__init__(self.name, data, sim, self.use_logger)
         self.sim = sim
 
@@ -104,21 +106,40 @@ class ABC(InferenceBase):
         ndarray
             scaled distance
         """
+        dist = np.asarray(dist, dtype=float)
+        return self.scale_distances(dist.reshape(1, -1))[0]
+
+    def scale_distances(self, dists):
+        """
+        Performs scaling in [0,1] of a chunk of distances, one row per trial. Each row is scaled
+        by the running per-statistic maximum over all distances seen so far, including the rows
+        preceding it in the chunk. Only the running maxima are kept between calls.
+        
+        Parameters
+        ----------
+        dists : ndarray
+            distances of shape (n_trials, n_stats)
+        
+        Returns
+        -------
+        ndarray
+            scaled distances of shape (n_trials, n_stats)
+        """
+        dists = np.asarray(dists, dtype=float)
+        dists = dists.reshape(dists.shape[0], -1)
+        if self.distance_maxima is None:
+            self.distance_maxima = np.full(dists.shape[1], -np.inf)
 
-        dist = np.asarray(dist)
-        global normalized_distances
-        self.historical_distances.append(dist.ravel())
-        all_distances = np.array(self.historical_distances)
         if self.summaries_divisor is not None:
-            divisor = self.summaries_divisor
+            divisor = np.broadcast_to(np.asarray(self.summaries_divisor, dtype=float), dists.shape)
         else:
-            divisor = np.asarray(np.nanmax(all_distances, axis=0))
-        normalized_distances = all_distances
-        for j in range(0, len(divisor), 1):
-            if divisor[j] > 0:
-                normalized_distances[:, j] = normalized_distances[:, j] / divisor[j]
+            # running maximum per trial, fmax ignores nan values like nanmax
+            divisor = np.fmax.accumulate(np.vstack((self.distance_maxima, dists)), axis=0)[1:]
+        if len(dists) > 0:
+            self.distance_maxima = np.fmax(self.distance_maxima, np.fmax.reduce(dists, axis=0))
 
-        return normalized_distances[-1, :]
+        scale = divisor > 0
+        return np.divide(dists, divisor, out=dists.copy(), where=scale)
 
     def compute_fixed_mean(self, chunk_size):
         """
@@ -141,7 +162,7 @@ class ABC(InferenceBase):
         del stats_mean
 
     # @sciope_profiler.profile
-    def rejection_sampling(self, num_samples, batch_size, chunk_size, ensemble_size, normalize):
+    def rejection_sampling(self, num_samples, batch_size, chunk_size, ensemble_size, normalize, max_in_flight=None):
         """
         Perform ABC inference according to initialized configuration.
 
@@ -150,10 +171,16 @@ class ABC(InferenceBase):
         num_samples : int
             The number of required accepted samples
         batch_size : int
-            The batch size of samples for performing rejection sampling
-        chunk_size : int
+            The batch size of samples for performing rejection sampling. In cluster mode samples
+            are not drawn in batches; the number of trials in flight is set by max_in_flight
+            and the chunk size instead, and batch_size only caps the 'auto' chunk size
+        chunk_size : int, str or sciope.core.core.AdaptiveChunker
             the partition size when splitting the fixed data. For avoiding many individual tasks
-            in dask if the data is large.
+            in dask if the data is large. 'auto' or an AdaptiveChunker adapts the chunk size
+            to the measured simulation time.
+        max_in_flight : int, optional
+            the maximum number of chunks in flight in cluster mode, by default twice the number
+            of worker threads
         
         Returns
         -------
@@ -163,150 +190,156 @@ class ABC(InferenceBase):
             'distances: Accepted distance values', 
             'accepted_count: Number of accepted samples',
             'trial_count: The number of total trials performed in order to converge',
-            'inferred_parameters': The mean of accepted parameter samples
+            'inferred_parameters': The mean of accepted parameter samples,
+            'cancelled_count': Number of unfinished chunks cancelled on completion (cluster mode only),
+            'discarded_count': Number of finished chunks that were never used (cluster mode only),
+            'chunk_report': The chunk sizes chosen by the AdaptiveChunker (adaptive chunk size only)
         """
         accepted_count = 0
         trial_count = 0
-        accepted_samples = []
-        distances = []
+        accepted_samples = None
+        distances = None
+        capacity = num_samples + batch_size
+        chunk_size = core.get_chunk_size(chunk_size, batch_size)
 
         # if fixed_mean has not been computed
         assert hasattr(self, "fixed_mean"), "Please call compute_fixed_mean before infer"
 
-        # Get dask graph
-        graph_dict = core.get_graph_chunked(self.prior_function, self.sim, self.summaries_function,
-                                      batch_size, chunk_size)
-        
-        dist_func = lambda x: self.distance_function(self.fixed_mean, x)
-        graph_dict["distances"] = core.get_distance(dist_func, graph_dict["summarystats"], chunked=True)
-
-        cluster_mode = core._cluster_mode()
+        # avoid capturing self, which would send the whole instance along with every task
+        distance_function = self.distance_function
+        fixed_mean = self.fixed_mean
+        dist_func = lambda x: distance_function(fixed_mean, x)
 
-        # do rejection sampling
-        #while accepted_count < num_samples:
+        cluster_mode = core._cluster_mode() and isinstance(self.executor, executors.DaskExecutor)
 
-            #sim_dist_scaled = []
-            #params = []
-            #dists = []
-
-        # If dask cluster is used, use persist and futures, and scale as result is completed
+        # If dask cluster is used, keep a window of chunks in flight and scale as results are completed
         if cluster_mode:
             if self.use_logger:
                 self.logger.info("running in cluster mode")
-            res_param, res_dist = dask.persist(graph_dict["parameters"], graph_dict["distances"])
-
-            futures_dist = core.get_futures(res_dist)
-            futures_params = core.get_futures(res_param)
+            engine = core.SubmissionEngine(self.prior_function, self.sim, self.summaries_function, dist_func,
+                                           chunk_size, max_in_flight=max_in_flight)
+            try:
+                engine.submit(engine.max_in_flight)
+
+                for params, dists in engine:
+                    params = np.asarray(params)
+                    dists = np.asarray(dists)
+                    trial_count += len(dists)
+
+                    accept = self._scale_reject(dists, params, normalize)
+                    accepted_samples = self._append_rows(accepted_samples, params[accept], accepted_count, capacity)
+                    distances = self._append_rows(distances, dists[accept], accepted_count, capacity)
+                    accepted_count += int(np.count_nonzero(accept))
+
+                    if accepted_count >= num_samples:
+                        break
+                    # let the acceptance rate decide how many new chunks are needed
+                    engine.submit(engine.n_needed(num_samples - accepted_count, accepted_count / trial_count))
+            finally:
+                # cancel chunks still in flight, also when interrupted, so no orphan futures keep running
+                cancelled_count = engine.cancel()
 
-            keep_idx = {f.key: idx for idx, f in enumerate(futures_dist)}
-
-            while accepted_count < num_samples:
-
-                for f, dist in as_completed(futures_dist, with_results=True):
-                    sim_dist_scaled = []
-                    params = []
-                    dists = []
-                    for d in dist:
-                        dists.append(d)
-                        trial_count += 1
-                        if normalize:
-                            # Normalize distances between [0,1]
-                            sim_dist_scaled.append(self.scale_distance(d))
-                    
-                    idx = keep_idx[f.key]
-                    param = futures_params[idx]
-                    params_res = param.result()
-                    for p in params_res:
-                        params.append(p)
-                    
-                    accepted_samples, distances, accepted_count = self._scale_reject(sim_dist_scaled, 
-                                                                                        dists, 
-                                                                                        accepted_samples, 
-                                                                                        distances,
-                                                                                        params,
-                                                                                        accepted_count, 
-                                                                                        normalize)
-                    del dist, param #TODO: remove all futures including simulation and summarystats
-                    if accepted_count < num_samples:
-                        new_chunk = core.get_graph_chunked(self.prior_function, self.sim, self.summaries_function,
-                                        chunk_size, chunk_size)
-                        new_chunk["distances"] = core.get_distance(dist_func, new_chunk["summarystats"], chunked=True)
-
-                        c_param, c_dist = dask.persist(new_chunk["parameters"], new_chunk["distances"])
-                        f_dist = core.get_futures(c_dist)[0]
-                        f_param = core.get_futures(c_param)[0]
-                        futures_dist.append(f_dist)
-                        futures_params.append(f_param)
-
-                        keep_idx[f_dist.key] = len(keep_idx)
-
-                    else:
-                        del futures_dist, futures_params, res_param, res_dist
-                        self.results = {'accepted_samples': accepted_samples, 'distances': distances, 'accepted_count': accepted_count,
-                        'trial_count': trial_count, 'inferred_parameters': np.mean(accepted_samples, axis=0)}
-                        return self.results
+            if self.use_logger:
+                self.logger.info("ABC Rejection Sampling: cancelled {0} unfinished and discarded {1} finished "
+                                 "chunk(s) out of {2} submitted".format(cancelled_count, engine.discarded_count,
+                                                                         engine.submitted_count))
+            self.results = {'accepted_samples': accepted_samples[:accepted_count],
+                            'distances': distances[:accepted_count], 'accepted_count': accepted_count,
+                            'trial_count': trial_count,
+                            'inferred_parameters': np.mean(accepted_samples[:accepted_count], axis=0),
+                            'cancelled_count': cancelled_count,
+                            'discarded_count': engine.discarded_count}
+            if isinstance(chunk_size, core.AdaptiveChunker):
+                self.results['chunk_report'] = chunk_size.report()
+            return self.results
 
 
         # else use multiprocessing mode
         else:
             while accepted_count < num_samples:
-                sim_dist_scaled = []
-                params = []
-                dists = []
                 if self.use_logger:
-                    self.logger.info("running in parallel mode")
-                params, dists = dask.compute(graph_dict["parameters"], graph_dict["distances"])
-                params = core._reshape_chunks(params)
-                dists = core._reshape_chunks(dists)
-                if normalize:
-                    for d in dists:
-                        sim_dist_scaled.append(self.scale_distance(d))
-
-                accepted_samples, distances, accepted_count = self._scale_reject(sim_dist_scaled, 
-                                                                                        dists, 
-                                                                                        accepted_samples, 
-                                                                                        distances,
-                                                                                        params,
-                                                                                        accepted_count, 
-                                                                                        normalize)
+                    self.logger.info("running in parallel mode using {0} executor".format(self.executor.name))
+                res = core.compute_chunked(self.prior_function, self.sim, self.summaries_function, dist_func,
+                                           batch_size, chunk_size, executor=self.executor, keep_trajectories=False)
+                params = core._reshape_chunks(res["parameters"])
+                dists = res["distances"]
+                dists = core._reshape_chunks(dists).reshape(len(params), -1)
+
+                accept = self._scale_reject(dists, params, normalize)
+                accepted_samples = self._append_rows(accepted_samples, params[accept], accepted_count, capacity)
+                distances = self._append_rows(distances, dists[accept], accepted_count, capacity)
+                accepted_count += int(np.count_nonzero(accept))
 
                 trial_count += batch_size
 
-            self.results = {'accepted_samples': accepted_samples, 'distances': distances, 'accepted_count': accepted_count,
-                        'trial_count': trial_count, 'inferred_parameters': np.mean(accepted_samples, axis=0)}
+            self.results = {'accepted_samples': accepted_samples[:accepted_count],
+                            'distances': distances[:accepted_count], 'accepted_count': accepted_count,
+                            'trial_count': trial_count,
+                            'inferred_parameters': np.mean(accepted_samples[:accepted_count], axis=0)}
+            if isinstance(chunk_size, core.AdaptiveChunker):
+                self.results['chunk_report'] = chunk_size.report()
             return self.results
 
-    def _scale_reject(self, sim_dist_scaled, dists, accepted_samples, 
-                      distances, params, accepted_count, normalize):
+    def _scale_reject(self, dists, params, normalize):
+        """
+        Accept/reject a chunk of trials in one vectorized pass
+        
+        Parameters
+        ----------
+        dists : ndarray
+            distances of the chunk, one entry per trial
+        params : ndarray
+            trial parameters of the chunk, one row per trial
+        normalize : bool
+            whether distances should be scaled in [0,1] before comparing against epsilon
+        
+        Returns
+        -------
+        ndarray
+            boolean mask of the accepted trials
+        """
+        sim_dist = dists.reshape(len(dists), -1)
         if normalize:
-                sim_dist_scaled = np.asarray(sim_dist_scaled)
-        else:
-            sim_dist_scaled = np.asarray(dists)
+            sim_dist = self.scale_distances(sim_dist)
 
         # Take the norm to combine the distances, if more than one summary is used
-        if sim_dist_scaled.shape[1] > 1:
-            combined_distance = [dask.delayed(np.linalg.norm)(scaled.reshape(1, scaled.size), axis=1)
-                                    for scaled in sim_dist_scaled]
-            result, = dask.compute(combined_distance)
+        if sim_dist.shape[1] > 1:
+            result = np.linalg.norm(sim_dist, axis=1)
         else:
-            result = sim_dist_scaled.ravel()
+            result = sim_dist.ravel()
 
         # Accept/Reject
-        for e, res in enumerate(result):
-            if self.use_logger:
-                self.logger.debug("ABC Rejection Sampling: trial parameter(s) = {}".format(params[e]))
-                self.logger.debug("ABC Rejection Sampling: trial distance(s) = {}".format(sim_dist_scaled[e]))
-            if res <= self.epsilon:
-                accepted_samples.append(params[e])
-                distances.append(dists[e])
-                accepted_count += 1
-                if self.use_logger:
-                    self.logger.info("ABC Rejection Sampling: accepted a new sample, "
-                                        "total accepted samples = {0}".format(accepted_count))
+        accept = result <= self.epsilon
+        if self.use_logger:
+            self.logger.debug("ABC Rejection Sampling: trial parameter(s) = {}".format(params))
+            self.logger.debug("ABC Rejection Sampling: trial distance(s) = {}".format(sim_dist))
+            if accept.any():
+                self.logger.info("ABC Rejection Sampling: accepted {0} new sample(s) out of {1} "
+                                 "trials".format(np.count_nonzero(accept), len(accept)))
         
-        return accepted_samples, distances, accepted_count
+        return accept
 
-    def infer(self, num_samples, batch_size, chunk_size=10, ensemble_size=1, normalize=True):
+    @staticmethod
+    def _append_rows(buffer, rows, count, capacity):
+        """
+        Writes rows into a preallocated buffer after its first 'count' filled rows. The buffer is
+        allocated with 'capacity' rows on first use and its capacity is doubled when it runs full.
+        
+        Returns
+        -------
+        ndarray
+            the (possibly reallocated) buffer
+        """
+        if buffer is None:
+            buffer = np.empty((max(capacity, len(rows)),) + rows.shape[1:], dtype=rows.dtype)
+        elif count + len(rows) > len(buffer):
+            grown = np.empty((max(2 * len(buffer), count + len(rows)),) + buffer.shape[1:], dtype=buffer.dtype)
+            grown[:count] = buffer[:count]
+            buffer = grown
+        buffer[count:count + len(rows)] = rows
+        return buffer
+
+    def infer(self, num_samples, batch_size, chunk_size=10, ensemble_size=1, normalize=True, max_in_flight=None):
         """
         Wrapper for rejection sampling. Performs ABC rejection sampling
         
@@ -315,14 +348,20 @@ class ABC(InferenceBase):
         num_samples : int
             The number of required accepted samples
         batch_size : int
-            The batch size of samples for performing rejection sampling
-        chunk_size : int
+            The batch size of samples for performing rejection sampling. In cluster mode samples
+            are not drawn in batches; the number of trials in flight is set by max_in_flight
+            and the chunk size instead, and batch_size only caps the 'auto' chunk size
+        chunk_size : int, str or sciope.core.core.AdaptiveChunker
             The partition size when splitting the fixed data. For avoiding many individual tasks
-            in dask if the data is large. Default 10.
+            in dask if the data is large. 'auto' or an AdaptiveChunker adapts the chunk size to the
+            measured simulation time. Default 10.
         ensemble_size : int
             In case we have an ensemble of responses
         normalize : bool
             Whether summary statistics should be normalized and epsilon be interpreted as a percentage
+        max_in_flight : int, optional
+            The maximum number of chunks in flight in cluster mode, by default twice the number
+            of worker threads
         
         Returns
         -------
@@ -332,7 +371,13 @@ class ABC(InferenceBase):
             'distances: Accepted distance values', 
             'accepted_count: Number of accepted samples',
             'trial_count: The number of total trials performed in order to converge',
-            'inferred_parameters': The mean of accepted parameter samples
+            'inferred_parameters': The mean of accepted parameter samples,
+            'chunk_report': The chunk sizes chosen by the AdaptiveChunker (adaptive chunk size only)
         """
 
-        return self.rejection_sampling(num_samples, batch_size, chunk_size, ensemble_size, normalize)
+        try:
+            return self.rejection_sampling(num_samples, batch_size, chunk_size, ensemble_size, normalize,
+                                           max_in_flight)
+        finally:
+            if self._owns_executor:
+                self.executor.shutdown()
@@ -0,0 +1,174 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Checkpointing of SMC-ABC runs and persistence of inference results
+"""
+
+# Imports
+from sciope.data.archive import Archive, save_arrays
+from sciope.core.core import AdaptiveChunker
+import numpy as np
+import os
+
+_SEP = '/'
+
+
+def _flatten(state, prefix=''):
+    flat = {}
+    for key, value in state.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + _SEP))
+        elif isinstance(value, (list, tuple)) and len(value) > 0 and isinstance(value[0], dict):
+            flat[name + _SEP + '#'] = np.asarray(len(value))
+            for i, item in enumerate(value):
+                flat.update(_flatten(item, name + _SEP + str(i) + _SEP))
+        elif value is not None:
+            flat[name] = np.asarray(value)
+    return flat
+
+
+def _unflatten(flat):
+    state = {}
+    for name, value in flat.items():
+        keys = name.split(_SEP)
+        node = state
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = value[()] if value.ndim == 0 else value
+    return _lists(state)
+
+
+def _lists(node):
+    if not isinstance(node, dict):
+        return node
+    if '#' in node:
+        return [_lists(node[str(i)]) for i in range(int(node['#']))]
+    return {key: _lists(value) for key, value in node.items()}
+
+
+def get_rng_state():
+    """
+    The state of the global numpy random number generator as a dict of arrays
+    """
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {'name': name, 'keys': keys, 'pos': pos, 'has_gauss': has_gauss,
+            'cached_gaussian': cached_gaussian}
+
+
+def set_rng_state(state):
+    """
+    Restore the global numpy random number generator from get_rng_state
+    """
+    np.random.set_state((str(state['name']), np.asarray(state['keys'], dtype=np.uint32),
+                         int(state['pos']), int(state['has_gauss']), float(state['cached_gaussian'])))
+
+
+def get_chunker_state(chunk_size):
+    """
+    The adapted state of an AdaptiveChunker as a dict of arrays, None for a fixed chunk size
+    """
+    if not isinstance(chunk_size, AdaptiveChunker):
+        return None
+    return {'chunk_size': chunk_size.chunk_size, 'time_per_point': chunk_size.time_per_point,
+            'chunk_sizes': np.asarray(chunk_size.chunk_sizes, dtype=int),
+            'durations': np.asarray(chunk_size.durations, dtype=float)}
+
+
+def set_chunker_state(chunk_size, state):
+    """
+    Restore an AdaptiveChunker from get_chunker_state, a fixed chunk size is left unchanged
+    """
+    if not isinstance(chunk_size, AdaptiveChunker) or state is None:
+        return
+    chunk_size.chunk_size = int(state['chunk_size'])
+    chunk_size.time_per_point = float(state['time_per_point']) if 'time_per_point' in state else None
+    chunk_size.chunk_sizes = [int(size) for size in np.atleast_1d(state['chunk_sizes'])]
+    chunk_size.durations = [float(duration) for duration in np.atleast_1d(state['durations'])]
+
+
+def save_checkpoint(path, state):
+    """
+    Save the state of a run to a compressed .npz file. The file is replaced
+    atomically, a crash while saving leaves the previous checkpoint intact.
+
+    Parameters
+    ----------
+    path : str
+        the checkpoint file
+    state : dict
+        arrays and scalars, possibly nested in dicts and lists of dicts (e.g. the
+        abc history). None values are not stored
+    """
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, **_flatten(state))
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Load the state of a run saved by save_checkpoint
+
+    Parameters
+    ----------
+    path : str
+        the checkpoint file
+
+    Returns
+    -------
+    dict
+        the saved state, scalars are returned as numpy scalars
+    """
+    with np.load(path, allow_pickle=False) as f:
+        return _unflatten({name: f[name] for name in f.files})
+
+
+def save_results(path, results):
+    """
+    Save the results dict of ABC.infer, SMCABC.infer or ReplenishmentSMCABC.infer to a chunked,
+    compressed archive, see sciope.data.archive
+
+    Parameters
+    ----------
+    path : str
+        the archive file
+    results : dict
+        arrays and scalars, possibly nested in dicts and lists of dicts (e.g. the rounds of SMC-ABC)
+    """
+    save_arrays(path, _flatten(results))
+
+
+def load_results(path, lazy=False):
+    """
+    Load results saved by save_results
+
+    Parameters
+    ----------
+    path : str
+        the archive file
+    lazy : bool, optional
+        return the arrays as sciope.data.archive.LazyArray, which only read the indexed rows,
+        by default False
+
+    Returns
+    -------
+    dict
+        the saved results, scalars are returned as numpy scalars
+    """
+    archive = Archive(path)
+    flat = {name: archive[name] if lazy or np.ndim(archive[name]) == 0 else np.asarray(archive[name])
+            for name in archive.keys()}
+    if not lazy:
+        archive.close()
+    return _unflatten(flat)
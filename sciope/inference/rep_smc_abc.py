@@ -19,7 +19,9 @@ Replenisment Sequential Monte-Carlo Approximate Bayesian Computation (SMC-ABC)
 from sciope.inference.abc_inference import ABC
 from sciope.inference.inference_base import InferenceBase
 from sciope.inference import abc_inference
+from sciope.inference import checkpoint as ckpt
 from sciope.core import core
+from sciope.core import executors
 from sciope.utilities.distancefunctions import euclidean as euc
 from sciope.utilities.summarystats import identity
 from sciope.utilities.housekeeping import sciope_logger as ml
@@ -45,6 +47,8 @@ class ReplenishmentSMCABC(InferenceBase):
     * distance_function         (function calculating deviation between simulated statistics and observed statistics)
     * summaries_divisor         (numpy array of maxima - used for normalizing summary statistic values)
     * use_logger    			(whether logging is enabled or disabled)
+    * executor                  (executor used for the initial population and the perturbations, see
+                                 sciope.core.executors, one created from a name is shut down after infer)
 
     Methods:
     * infer 					(perform parameter inference)
@@ -54,7 +58,7 @@ class ReplenishmentSMCABC(InferenceBase):
                  perturbation_kernel=None,
                  summaries_function=identity.Identity(),
                  distance_function=euc.EuclideanDistance(),
-                 summaries_divisor=None, use_logger=False):
+                 summaries_divisor=None, use_logger=False, executor=None):
         """Replenishment SMC-ABC implementation.
 
         Parameters
@@ -73,6 +77,9 @@ class ReplenishmentSMCABC(InferenceBase):
             distance function operating over summary statistics
         use_logger : bool
             enable/disable logging
+        executor : sciope.core.executors.ExecutorBase or str, optional
+            executor used for the initial population and the perturbations, one of 'serial',
+            'threads', 'processes' and 'dask'; by default dask
         """
 
         self.name = 'Replenisment-SMC-ABC'
@@ -82,6 +89,8 @@ class ReplenishmentSMCABC(InferenceBase):
         self.summaries_function = summaries_function
         self.distance_function = distance_function.compute
         self.summaries_divisor = summaries_divisor
+        self.executor = executors.get_executor(executor)
+        self._owns_executor = not isinstance(executor, executors.ExecutorBase)
         if perturbation_kernel is not None:
             self.perturbation_kernel = perturbation_kernel
         else:
@@ -99,7 +108,6 @@ class ReplenishmentSMCABC(InferenceBase):
         self.fixed_mean = stats_mean.compute()
         del stats_mean
 
-    @dask.delayed
     def _perturb_resample(self, param, current_distance, n_perturbations, tol):
         p_acc = 0
         n_successful_moves = 0
@@ -128,7 +136,13 @@ class ReplenishmentSMCABC(InferenceBase):
 
         return param, new_distance, p_acc, n_successful_moves
 
-    def infer(self, num_samples, alpha = 0.5, R_trial = 10, c = 0.01, p_min = 0.05, batch_size = 10, chunk_size = 1):
+    def _perturb_all(self, params, distances, n_perturbations, tol):
+        """ Perturb and resample each replenished sample, one executor task per sample """
+        perturb = lambda item: self._perturb_resample(item[0], item[1], n_perturbations, tol)
+        return self.executor.map(perturb, list(zip(params, distances)))
+
+    def infer(self, num_samples, alpha = 0.5, R_trial = 10, c = 0.01, p_min = 0.05, batch_size = 10, chunk_size = 1,
+              checkpoint = None, resume_from = None):
         """Performs SMC-ABC.
 
         Parameters
@@ -143,42 +157,83 @@ class ReplenishmentSMCABC(InferenceBase):
             Sensitivity for more perturbations
         p_min : float
             Termination condition as a probability of a successul perturbation
+        batch_size : int
+            The batch size of samples when drawing the initial population
+        chunk_size : int, str or sciope.core.core.AdaptiveChunker
+            The number of points in each task when drawing the initial population, 'auto' or
+            an AdaptiveChunker adapts it to the measured simulation time
+        checkpoint : str, optional
+            Path of a checkpoint file (.npz) written once the initial population is drawn (round 0)
+            and after each replenishment round, holding the population, distances, tolerance, kernel
+            covariance, adaptive chunk size, random state and counters
+        resume_from : str, optional
+            Path of a checkpoint file to continue a previous run from
 
         Returns
         -------
         dict
             Keys
             'accepted_samples: The accepted parameter values',
-            'distances: Accepted distance values'
+            'distances: Accepted distance values',
+            'chunk_report': The chunk sizes chosen by the AdaptiveChunker (adaptive chunk size only)
         """
 
         assert hasattr(self, "fixed_mean"), "Please call compute_fixed_mean before infer"
 
-        # Get the dask graph and add another distances task to it
-        graph_dict = core.get_graph_chunked(self.prior_function.draw, self.sim, self.summaries_function,
-                                    batch_size, chunk_size)
+        try:
+            return self._infer(num_samples, alpha, R_trial, c, p_min, batch_size, chunk_size, checkpoint,
+                               resume_from)
+        finally:
+            if self._owns_executor:
+                self.executor.shutdown()
+
+    def _infer(self, num_samples, alpha, R_trial, c, p_min, batch_size, chunk_size, checkpoint, resume_from):
+        """ Draw the initial population and run the replenishment rounds, see infer """
+
+        # Simulation, summaries and distances are fused into one task per chunk
         dist_func = lambda x: self.distance_function(self.fixed_mean, x)
-        graph_dict["distances"] = core.get_distance(dist_func, graph_dict["summarystats"], chunked = True)
+        chunk_size = core.get_chunk_size(chunk_size, batch_size)
 
         # Culling Cutoff
         n_cull = round(alpha * num_samples)
 
-        # Draw the initial population and compute distances
-        population, distances = dask.compute(graph_dict['parameters'], graph_dict['distances'])
-        population = core._reshape_chunks(population)
-        distances = core._reshape_chunks(distances)
-
-        while population.shape[0] < num_samples:
-            params, dists = dask.compute(graph_dict["parameters"], graph_dict["distances"])
-            params = core._reshape_chunks(params)
-            dists = core._reshape_chunks(dists)
-            population = np.vstack([population, params])
-            distances = np.vstack([distances, dists])
-
-        population = population[:num_samples]
-        distances = distances[:num_samples,0]
+        if resume_from is not None:
+            state = self._restore(resume_from, chunk_size)
+            population = state['population']
+            distances = state['distances']
+            n_rounds = int(state['round'])
+            N_total = int(state['n_successful_moves'])
+            terminate = bool(state['terminate'])
+            print("Resuming from round {}".format(n_rounds))
+            if self.use_logger:
+                self.logger.info("Resuming from round {0} using checkpoint {1}".format(n_rounds, resume_from))
+        else:
+            # Draw the initial population and compute distances
+            res = core.compute_chunked(self.prior_function.draw, self.sim, self.summaries_function, dist_func,
+                                       batch_size, chunk_size, executor = self.executor,
+                                       keep_trajectories = False)
+            population = core._reshape_chunks(res["parameters"])
+            distances = core._reshape_chunks(res["distances"]).reshape(len(population), -1)
+
+            while population.shape[0] < num_samples:
+                res = core.compute_chunked(self.prior_function.draw, self.sim, self.summaries_function, dist_func,
+                                           batch_size, chunk_size, executor = self.executor,
+                                           keep_trajectories = False)
+                params = core._reshape_chunks(res["parameters"])
+                dists = core._reshape_chunks(res["distances"]).reshape(len(params), -1)
+                population = np.vstack([population, params])
+                distances = np.vstack([distances, dists])
+
+            population = population[:num_samples]
+            distances = distances[:num_samples,0]
+            n_rounds = 0
+            N_total = 0
+            terminate = False
+            if checkpoint is not None:
+                # the initial population is often the most expensive part of a run
+                self._checkpoint(checkpoint, n_rounds, population, distances, None, None, N_total, terminate,
+                                 chunk_size)
 
-        terminate = False
         while not terminate:
 
             try:
@@ -202,10 +257,7 @@ class ReplenishmentSMCABC(InferenceBase):
 
                 # For each replenished value, perturb and resample a few time
                 # to get an idea of how easy it is to move to a lower distance
-                perturb_tasks = []
-                for i in range(n_cull, num_samples):
-                    perturb_tasks.append(self._perturb_resample(population[i,:], distances[i], R_trial, tol))
-                res, = dask.compute(perturb_tasks)
+                res = self._perturb_all(population[n_cull:], distances[n_cull:], R_trial, tol)
 
                 # Update the population with the perturbed population
                 updated_ps, updated_distances, update_p_accs, N_accs = list(zip(*res))
@@ -222,10 +274,7 @@ class ReplenishmentSMCABC(InferenceBase):
                 R = int(round(np.log(c) / np.log(1 - p_acc)))
 
                 # Perturb again with better estimate
-                perturb_tasks = []
-                for i in range(n_cull, num_samples):
-                    perturb_tasks.append(self._perturb_resample(population[i,:], distances[i], R - R_trial, tol))
-                res, = dask.compute(perturb_tasks)
+                res = self._perturb_all(population[n_cull:], distances[n_cull:], R - R_trial, tol)
 
                 updated_ps, updated_distances, update_p_accs, N_accs = list(zip(*res))
 
@@ -238,9 +287,42 @@ class ReplenishmentSMCABC(InferenceBase):
                 print("Tol : {}, R : {}, p_acc : {}".format(tol, R, p_acc))
                 if p_acc < p_min:
                     terminate = True
+
+                n_rounds += 1
+                N_total += N_acc
+                if checkpoint is not None:
+                    self._checkpoint(checkpoint, n_rounds, population, distances, tol, p_acc, N_total, terminate,
+                                     chunk_size)
             except KeyboardInterrupt:
-                return {'accepted_samples' : population, 'distances' : distances}
+                return self._results(population, distances, chunk_size)
             except:
                 raise
 
-        return {'accepted_samples' : population, 'distances' : distances}
+        return self._results(population, distances, chunk_size)
+
+    def _checkpoint(self, path, round, population, distances, tol, p_acc, n_successful_moves, terminate,
+                    chunk_size):
+        """ Save the state after the initial population (round 0) or a completed replenishment round """
+        state = {'round': round, 'terminate': bool(terminate), 'population': population,
+                 'distances': distances, 'tol': tol, 'p_acc': p_acc,
+                 'n_successful_moves': n_successful_moves, 'rng_state': ckpt.get_rng_state()}
+        if hasattr(self.perturbation_kernel, 'cov'):
+            state['kernel_cov'] = self.perturbation_kernel.cov
+        # an adaptive chunk size continues from its adapted size and history
+        state['chunker'] = ckpt.get_chunker_state(chunk_size)
+        ckpt.save_checkpoint(path, state)
+
+    def _restore(self, path, chunk_size):
+        """ Load a checkpoint and restore the kernel, adaptive chunk size and random state """
+        state = ckpt.load_checkpoint(path)
+        if 'kernel_cov' in state:
+            self.perturbation_kernel.cov = state['kernel_cov']
+        ckpt.set_chunker_state(chunk_size, state.get('chunker'))
+        ckpt.set_rng_state(state['rng_state'])
+        return state
+
+    def _results(self, population, distances, chunk_size):
+        results = {'accepted_samples' : population, 'distances' : distances}
+        if isinstance(chunk_size, core.AdaptiveChunker):
+            results['chunk_report'] = chunk_size.report()
+        return results
@@ -19,32 +19,215 @@ Sequential Monte-Carlo Approximate Bayesian Computation (SMC-ABC)
 from sciope.inference.abc_inference import ABC
 from sciope.inference.inference_base import InferenceBase
 from sciope.inference import abc_inference
+from sciope.inference import checkpoint as ckpt
 from sciope.core import core
+from sciope.core import executors
 from sciope.utilities.distancefunctions import euclidean as euc
 from sciope.utilities.summarystats import burstiness as bs
 from sciope.utilities.housekeeping import sciope_logger as ml
 from sciope.utilities.priors.prior_base import PriorBase
+from sciope.utilities.priors.uniform_prior import UniformPrior
+from sciope.utilities.priors.independent_prior import IndependentPrior
+from sciope.utilities.priors.product_prior import ProductPrior
 from sciope.utilities.epsilonselectors import RelativeEpsilonSelector
 from sciope.utilities.perturbationkernels.multivariate_normal import MultivariateNormalKernel
 
 import numpy as np
+from scipy.special import logsumexp
+from scipy.stats import norm, truncnorm, multivariate_normal
 import dask
 from dask.distributed import futures_of, as_completed, wait
 from dask import delayed
 
 
+def normalize_log_weights(log_weights):
+    """
+    Normalize importance weights given in log space
+
+    Parameters
+    ----------
+    log_weights : ndarray
+        unnormalized log-weights
+
+    Returns
+    -------
+    tuple
+        the normalized weights and the effective sample size 1 / sum(w^2)
+    """
+    log_weights = np.asarray(log_weights, dtype=float)
+    log_total = logsumexp(log_weights)
+    if not np.isfinite(log_total):
+        raise ValueError("All importance weights are zero or not finite")
+    log_weights = log_weights - log_total
+    ess = np.exp(-logsumexp(2 * log_weights))
+    return np.exp(log_weights), ess
+
+
+def systematic_resample(weights):
+    """
+    Systematic resampling
+
+    Parameters
+    ----------
+    weights : ndarray
+        normalized weights
+
+    Returns
+    -------
+    ndarray
+        indices of the resampled points, as many as weights
+    """
+    n = len(weights)
+    positions = (np.random.random() + np.arange(n)) / n
+    cumulative = np.cumsum(weights)
+    cumulative[-1] = 1.0
+    return np.searchsorted(cumulative, positions)
+
+
+def _support_box(prior):
+    """
+    The bounds (lb, ub) of the support of a prior if it is a box, possibly unbounded, otherwise None.
+    Covers UniformPrior (and QMCPrior), the independent priors and products of those.
+    """
+    if isinstance(prior, ProductPrior):
+        boxes = [_support_box(p) for p in prior.priors]
+        if any(box is None for box in boxes):
+            return None
+        return np.concatenate([box[0] for box in boxes]), np.concatenate([box[1] for box in boxes])
+    if isinstance(prior, IndependentPrior):
+        lb, ub = prior.distribution.support()
+        return np.broadcast_to(lb, prior.d).astype(float), np.broadcast_to(ub, prior.d).astype(float)
+    if isinstance(prior, UniformPrior):
+        return np.asarray(prior.lb, dtype=float), np.asarray(prior.ub, dtype=float)
+    return None
+
+
 class PerturbationPrior(PriorBase):
+    """
+    Proposal prior of a SMC-ABC round: a weighted draw from the population perturbed by the kernel,
+    truncated to the support of the reference prior. If the support is the whole space there is no
+    truncation. For a box support (UniformPrior, the independent priors and their products) and a kernel
+    with diagonal covariance the truncated normal is sampled directly. Otherwise all perturbations are
+    drawn as one batch and the rows outside the support are redrawn until all are inside, which is an
+    exact draw from the truncated kernel. Optionally, with gibbs_sweeps set, rows still outside a box
+    after max_rejection_rounds rounds (kernels with little mass in the box) are drawn by gibbs_sweeps
+    sweeps of a Gibbs sampler of the truncated normal, started at the center. That draw is only
+    approximate, while log_truncation and the importance weights assume an exact draw, so the weights
+    are biased when the fallback is used. It is off by default.
+    """
 
     def __init__(self, ref_prior, samples, normalized_weights, perturbation_kernel,
-                 use_logger=False):
+                 use_logger=False, n_mass_samples=256, max_rejection_rounds=10, gibbs_sweeps=None):
 
         self.name = 'Perturbation Prior'
         self.ref_prior = ref_prior
         self.samples = samples
         self.normalized_weights = normalized_weights
         self.perturbation_kernel = perturbation_kernel
+        self.n_mass_samples = n_mass_samples
+        self.max_rejection_rounds = max_rejection_rounds
+        self.gibbs_sweeps = gibbs_sweeps
+        self._box = _support_box(ref_prior)
         super(PerturbationPrior, self).__init__(self.name, use_logger)
 
+    def _unbounded(self):
+        """ Whether the support of the reference prior is the whole space """
+        return self._box is not None and np.isneginf(self._box[0]).all() and np.isposinf(self._box[1]).all()
+
+    def _box_cov(self):
+        """ The kernel covariance if the support is a box and the kernel is normal """
+        if self._box is None:
+            return None
+        cov = getattr(self.perturbation_kernel, 'cov', None)
+        if cov is None:
+            return None
+        return np.atleast_2d(np.asarray(cov, dtype=float))
+
+    @staticmethod
+    def _is_diagonal(cov):
+        return np.count_nonzero(cov - np.diag(np.diag(cov))) == 0
+
+    def _in_support(self, x):
+        return np.asarray(self.ref_prior.pdf(x)).reshape(-1) > 0
+
+    def _gibbs(self, s0, cov):
+        """ Gibbs sampler of the normal around each row of s0 truncated to the box, started at s0 """
+        lb, ub = self._box
+        precision = np.linalg.inv(cov)
+        sd = 1 / np.sqrt(np.diag(precision))
+        x = s0.copy()
+        for _ in range(self.gibbs_sweeps):
+            for i in range(len(lb)):
+                # conditional mean of x_i given the other coordinates
+                m = x[:, i] - (x - s0).dot(precision[i]) / precision[i, i]
+                x[:, i] = truncnorm.rvs((lb[i] - m) / sd[i], (ub[i] - m) / sd[i], loc=m, scale=sd[i])
+        return x
+
+    def _truncated_perturb(self, s0):
+        if self._unbounded():
+            return self.perturbation_kernel.perturb(s0)
+        cov = self._box_cov()
+        if cov is not None and self._is_diagonal(cov):
+            scale = np.sqrt(np.diag(cov))
+            a = (self._box[0] - s0) / scale
+            b = (self._box[1] - s0) / scale
+            return truncnorm.rvs(a, b, loc=s0, scale=scale)
+
+        s = self.perturbation_kernel.perturb(s0)
+        outside = ~self._in_support(s)
+        rounds = 1
+        while outside.any():
+            if self.gibbs_sweeps and cov is not None and rounds >= self.max_rejection_rounds:
+                s[outside] = self._gibbs(s0[outside], cov)
+                break
+            # redraw rows outside of the prior support in bulk
+            s[outside] = self.perturbation_kernel.perturb(s0[outside])
+            outside[outside] = ~self._in_support(s[outside])
+            rounds += 1
+        return s
+
+    def log_truncation(self):
+        """
+        Log-probability mass of the kernel inside the support of the reference prior, for each
+        point in the population. Used to correct the kernel density for the truncation in the
+        importance weights. If the support is the whole space the mass is 1. For a box support the mass
+        is computed from the normal distribution function, in closed form for a diagonal kernel and by
+        numerical integration (scipy.stats.multivariate_normal.cdf) otherwise. For other priors it is a
+        Monte-Carlo estimate using n_mass_samples perturbations per point.
+
+        Returns
+        -------
+        ndarray
+            of shape (len(samples),)
+        """
+        if self._unbounded():
+            return np.zeros(len(self.samples))
+        cov = self._box_cov()
+        if cov is not None:
+            lb, ub = self._box
+        if cov is not None and self._is_diagonal(cov):
+            scale = np.sqrt(np.diag(cov))
+            upper = norm.logcdf((ub - self.samples) / scale)
+            lower = norm.logcdf((lb - self.samples) / scale)
+            with np.errstate(divide='ignore'):
+                return np.sum(upper + np.log1p(-np.exp(lower - upper)), axis=1)
+
+        if cov is not None:
+            # resampled populations repeat points, integrate once per distinct point
+            centers, inverse = np.unique(np.asarray(self.samples, dtype=float), axis=0, return_inverse=True)
+            # relative accuracy of 0.1%, which is ample for importance weights and an order of magnitude
+            # faster than the default tolerances
+            mass = np.array([multivariate_normal.cdf(ub, mean=c, cov=cov, lower_limit=lb, abseps=1e-8, releps=1e-3)
+                             for c in centers])
+            return np.log(np.maximum(mass, np.finfo(float).tiny))[inverse.reshape(-1)]
+
+        n = len(self.samples)
+        inside = np.zeros(n)
+        for _ in range(self.n_mass_samples):
+            inside += self._in_support(self.perturbation_kernel.perturb(self.samples))
+        # at least one point of the support, the population itself lies inside it
+        return np.log(np.maximum(inside, 1) / self.n_mass_samples)
+
     def draw(self, n=1, chunk_size=1):
 
         assert n >= chunk_size
@@ -63,17 +246,8 @@ class PerturbationPrior(PriorBase):
     def _weighted_draw_perturb(self, m):
         idxs = np.random.choice(self.samples.shape[0], m,
                                 p=self.normalized_weights)
-        s0 = [self.samples[idx] for idx in idxs]
-        s = []
-        for z in s0:
-            accepted = False
-            while not accepted:
-                sz = self.perturbation_kernel.rvs(z)
-                if self.ref_prior.pdf(sz) > 0:
-                    accepted = True
-                    s.append(sz)
-
-        return np.asarray(s)
+        s0 = np.asarray(self.samples, dtype=float)[idxs]
+        return self._truncated_perturb(s0)
 
 
 class SMCABC(InferenceBase):
@@ -89,6 +263,8 @@ class SMCABC(InferenceBase):
     * distance_function         (function calculating deviation between simulated statistics and observed statistics)
     * summaries_divisor         (numpy array of maxima - used for normalizing summary statistic values)
     * use_logger    			(whether logging is enabled or disabled)
+    * executor                  (executor used when no dask cluster is used, see sciope.core.executors,
+                                 one created from a name is shared by all rounds and shut down after infer)
 
     Methods:
     * infer 					(perform parameter inference)
@@ -98,7 +274,7 @@ class SMCABC(InferenceBase):
                  perturbation_kernel=None,
                  summaries_function=bs.Burstiness().compute,
                  distance_function=euc.EuclideanDistance(),
-                 summaries_divisor=None, use_logger=False):
+                 summaries_divisor=None, use_logger=False, executor=None):
 
         self.name = 'SMC-ABC'
         super(SMCABC, self).__init__(self.name, data, sim, use_logger)
@@ -107,6 +283,9 @@ class SMCABC(InferenceBase):
         self.summaries_function = summaries_function
         self.distance_function = distance_function
         self.summaries_divisor = summaries_divisor
+        # resolved once and shared by the ABC instance of every round
+        self.executor = executors.get_executor(executor)
+        self._owns_executor = not isinstance(executor, executors.ExecutorBase)
         if perturbation_kernel is not None:
             self.perturbation_kernel = perturbation_kernel
         else:
@@ -120,7 +299,7 @@ class SMCABC(InferenceBase):
 
     def infer(self, num_samples, batch_size,
               eps_selector = RelativeEpsilonSelector(20), chunk_size=10,
-              ensemble_size = 1):
+              ensemble_size = 1, checkpoint = None, resume_from = None, ess_threshold = 0.5):
         """Performs SMC-ABC.
 
         Parameters
@@ -131,52 +310,91 @@ class SMCABC(InferenceBase):
             The batch size of samples for performing rejection sampling
         eps_selector : EpsilonSelector
             The epsilon selector to determine the sequence of epsilons
-        chunk_size : int
+        chunk_size : int, str or sciope.core.core.AdaptiveChunker
             The partition size when splitting the fixed data. For avoiding many individual tasks
-            in dask if the data is large. Default 10.
+            in dask if the data is large. With 'auto' or an AdaptiveChunker the chunk size is adapted
+            to the measured simulation time, carried over between generations. Default 10.
         ensemble_size : int
             In case we have an ensemble of responses
         normalize : bool
             Whether summary statistics should be normalized and epsilon be interpreted as a percentage
+        checkpoint : str, optional
+            Path of a checkpoint file (.npz) written after each round, holding the population,
+            weights, epsilon, kernel covariance, adaptive chunk size, random state and abc history
+        resume_from : str, optional
+            Path of a checkpoint file to continue a previous run from
+        ess_threshold : float
+            The population is resampled to equal weights when the effective sample size
+            falls below ess_threshold * num_samples. Default 0.5
 
         Returns
         -------
-        dict
-            Keys
+        list
+            One dict per round with keys
             'accepted_samples: The accepted parameter values',
             'distances: Accepted distance values',
             'accepted_count: Number of accepted samples',
             'trial_count: The number of total trials performed in order to converge',
-            'inferred_parameters': The mean of accepted parameter samples
+            'inferred_parameters': The mean of accepted parameter samples,
+            'ess': The effective sample size of the importance weights,
+            'resampled': Whether the population was resampled because of a low ess
         """
 
-        abc_history = []
-        t = num_samples
-        prior_function = self.prior_function
-
-        tol, relative, terminate = eps_selector.get_initial_epsilon()
-        print("Determining initial population using {}".format(tol))
+        try:
+            return self._infer(num_samples, batch_size, eps_selector, chunk_size, checkpoint, resume_from,
+                               ess_threshold)
+        finally:
+            if self._owns_executor:
+                self.executor.shutdown()
 
-        abc_instance = abc_inference.ABC(self.data, self.sim, prior_function,
-                                         epsilon = tol,
-                                         summaries_function = self.summaries_function,
-                                         distance_function = self.distance_function,
-                                         summaries_divisor = self.summaries_divisor,
-                                         use_logger = self.use_logger)
+    def _infer(self, num_samples, batch_size, eps_selector, chunk_size, checkpoint, resume_from, ess_threshold):
+        """ Run the initial population and the SMC rounds, see infer """
 
-        abc_instance.compute_fixed_mean(chunk_size = chunk_size)
-        abc_results = abc_instance.infer(num_samples = t,
-                                         batch_size = batch_size,
-                                         chunk_size = chunk_size,
-                                         normalize = relative)
-
-        population = np.vstack(abc_results['accepted_samples'])[:t]
-        normalized_weights = np.ones(t)/t
+        t = num_samples
+        chunk_size = core.get_chunk_size(chunk_size, batch_size)
+        prior_function = self.prior_function
 
-        abc_history.append(abc_results)
+        if resume_from is not None:
+            state = self._restore(resume_from, chunk_size)
+            abc_history = state['abc_history']
+            population = state['population']
+            normalized_weights = state['normalized_weights']
+            round = int(state['round'])
+            terminate = bool(state['terminate'])
+            print("Resuming from round {}".format(round))
+            if self.use_logger:
+                self.logger.info("Resuming from round {0} using checkpoint {1}".format(round, resume_from))
+        else:
+            abc_history = []
+            tol, relative, terminate = eps_selector.get_initial_epsilon()
+            print("Determining initial population using {}".format(tol))
+
+            abc_instance = abc_inference.ABC(self.data, self.sim, prior_function,
+                                             epsilon = tol,
+                                             summaries_function = self.summaries_function,
+                                             distance_function = self.distance_function,
+                                             summaries_divisor = self.summaries_divisor,
+                                             use_logger = self.use_logger,
+                                             executor = self.executor)
+
+            abc_instance.compute_fixed_mean(chunk_size = chunk_size)
+            abc_results = abc_instance.infer(num_samples = t,
+                                             batch_size = batch_size,
+                                             chunk_size = chunk_size,
+                                             normalize = relative)
+
+            population = np.vstack(abc_results['accepted_samples'])[:t]
+            normalized_weights = np.ones(t)/t
+            abc_results['ess'] = float(t)
+            abc_results['resampled'] = False
+
+            abc_history.append(abc_results)
+            round = 1
+            if checkpoint is not None:
+                self._checkpoint(checkpoint, round, population, normalized_weights, abc_history, terminate,
+                                 chunk_size)
 
         # SMC iterations
-        round = 1
         while not terminate:
 
             tol, relative, terminate = eps_selector.get_epsilon(round, abc_history)
@@ -193,6 +411,7 @@ class SMCABC(InferenceBase):
                                           population,
                                           normalized_weights,
                                           self.perturbation_kernel)
+            log_mass = new_prior.log_truncation()
 
             try:
                 # Run ABC on the next epsilon using the proposal prior
@@ -201,7 +420,8 @@ class SMCABC(InferenceBase):
                                     summaries_function = self.summaries_function,
                                     distance_function = self.distance_function,
                                     summaries_divisor = self.summaries_divisor,
-                                    use_logger = self.use_logger)
+                                    use_logger = self.use_logger,
+                                    executor = self.executor)
                 abc_instance.compute_fixed_mean(chunk_size = chunk_size)
                 abc_results = abc_instance.infer(num_samples = t,
                                                  batch_size = batch_size,
@@ -211,17 +431,33 @@ class SMCABC(InferenceBase):
                 # Compute importance weights for the new samples
                 new_samples = np.vstack(abc_results['accepted_samples'])[:t]
 
-                prior_weights = self.prior_function.pdf(new_samples)
-                kweights = self.perturbation_kernel.pdf(population, new_samples)
-
-                new_weights = prior_weights / np.sum(kweights * normalized_weights[:, np.newaxis], axis=0)
-                new_weights = new_weights / sum(new_weights)
+                # in log space, linear weights underflow for peaked kernels
+                log_prior = self.prior_function.pdf(new_samples, log = True)
+                # proposals are truncated to the prior support, normalize each kernel by its mass inside
+                log_kernel = self.perturbation_kernel.weighted_logpdf(population, new_samples,
+                                                                      normalized_weights * np.exp(-log_mass))
+                new_weights, ess = normalize_log_weights(log_prior - log_kernel)
 
                 population = new_samples
                 normalized_weights = new_weights
 
+                # Resample degenerate populations
+                resampled = bool(ess < ess_threshold * t)
+                if resampled:
+                    idxs = systematic_resample(normalized_weights)
+                    population = population[idxs]
+                    normalized_weights = np.ones(t)/t
+                abc_results['ess'] = ess
+                abc_results['resampled'] = resampled
+
+                if self.use_logger:
+                    self.logger.info("Effective sample size = {0}{1}".format(ess, ", resampled" if resampled else ""))
+
                 abc_history.append(abc_results)
                 round += 1
+                if checkpoint is not None:
+                    self._checkpoint(checkpoint, round, population, normalized_weights, abc_history, terminate,
+                                     chunk_size)
 
             except KeyboardInterrupt:
                 return abc_history
@@ -229,3 +465,23 @@ class SMCABC(InferenceBase):
                 raise
 
         return abc_history
+
+    def _checkpoint(self, path, round, population, normalized_weights, abc_history, terminate, chunk_size):
+        """ Save the state after a completed round """
+        state = {'round': round, 'terminate': bool(terminate), 'population': population,
+                 'normalized_weights': normalized_weights, 'abc_history': abc_history,
+                 'rng_state': ckpt.get_rng_state()}
+        if hasattr(self.perturbation_kernel, 'cov'):
+            state['kernel_cov'] = self.perturbation_kernel.cov
+        # an adaptive chunk size continues from its adapted size and history
+        state['chunker'] = ckpt.get_chunker_state(chunk_size)
+        ckpt.save_checkpoint(path, state)
+
+    def _restore(self, path, chunk_size):
+        """ Load a checkpoint and restore the kernel, adaptive chunk size and random state """
+        state = ckpt.load_checkpoint(path)
+        if 'kernel_cov' in state:
+            self.perturbation_kernel.cov = state['kernel_cov']
+        ckpt.set_chunker_state(chunk_size, state.get('chunker'))
+        ckpt.set_rng_state(state['rng_state'])
+        return state
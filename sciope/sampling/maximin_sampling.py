@@ -18,11 +18,10 @@ Ranks monte-carlo samples such that minimum distance between them is maximized
 
 # Imports
 from sciope.sampling.sampling_base import SamplingBase
-from scipy.spatial import distance_matrix
+from scipy.spatial import cKDTree
 from sciope.utilities.housekeeping import sciope_logger as ml
 import numpy as np
 from dask import delayed
-import dask.array as da
 
 
 # Class definition
@@ -30,16 +29,20 @@ class MaximinSampling(SamplingBase):
     """
     Algorithm:
     1. Generate MC candidate samples
-    2. Compute pairwise distance between existing samples and candidates
+    2. Compute the minimum distance between each candidate and the existing samples
     3. Select new samples that maximize the minimum distance
 
+    The minimum distances are found by nearest-neighbour queries on a KD-tree of the existing
+    samples. When several samples are selected, each candidate's minimum distance is updated
+    against the newly added sample only, instead of recomputing all pairwise distances.
+
     Key reference:
     Johnson, Mark E., Leslie M. Moore, and Donald Ylvisaker.
     "Minimax and maximin distance designs."
     Journal of statistical planning and inference 26.2 (1990): 131-148.
     """
 
-    def __init__(self, xmin, xmax, use_logger=False):
+    def __init__(self, xmin, xmax, use_logger=False, candidates_ratio=10):
         """
         Initialize the sampler.
         
@@ -51,9 +54,12 @@ class MaximinSampling(SamplingBase):
             Specifies the upper bound of the hypercube within which sampling is performed
         use_logger : bool, optional
             Controls whether logging is enabled or disabled, by default True
+        candidates_ratio : int, optional
+            number of MC candidates per sample in the resulting design, by default 10
         """
         name = 'MaximinSampling'
         super(MaximinSampling, self).__init__(name, xmin, xmax, use_logger)
+        self.candidates_ratio = candidates_ratio
         if self.use_logger:
             self.logger = ml.SciopeLogger().get_logger()
             self.logger.info("Maximin sequential sampler in {0} dimensions initialized".format(len(self.xmin)))
@@ -62,6 +68,10 @@ class MaximinSampling(SamplingBase):
     # ms = MaximinSampling([0,0], [1,1])
     # new_points = ms.select_point(X)
     
+    def _candidates(self, num_candidates, num_dimensions):
+        return np.random.uniform(low=np.asarray(self.xmin), high=np.asarray(self.xmax),
+                                 size=(num_candidates, num_dimensions))
+
     def select_point(self, x):
         """
         Get top ranked candidate according to maximin sampling to add to current samples x
@@ -75,35 +85,26 @@ class MaximinSampling(SamplingBase):
         -------
         dask.delayed
         """
-        # Set up stuff
-        num_samples = x.shape[0]
-        num_dimensions = x.shape[1]
-        candidates_ratio = 10
-        num_candidates = num_samples * candidates_ratio
+        x = np.asarray(x)
+        num_samples, num_dimensions = x.shape
 
         # Generate MC candidates
-        c = da.random.uniform(low=np.asarray(self.xmin), high=np.asarray(self.xmax),
-                              size=(num_candidates, num_dimensions))
+        c = self._candidates(num_samples * self.candidates_ratio, num_dimensions)
 
-        # Compute distances
+        # Minimum distance to the existing samples...
         # p = 1 implies Manhattan distance
-        dist = distance_matrix(c, x, p=1)
-
-        # Minimum distance...
-        ranking = dist.min(axis=1)
+        ranking, _ = cKDTree(x).query(c, p=1)
 
         # ... is maximized
-        idx = np.argsort(-ranking)
-
-        # ta-da!
         if self.use_logger:
             self.logger.info("Maximin sequential design: selected one new sample")
-        return c[idx[0], :]
+        return delayed(c[np.argmax(ranking)])
 
-    
     def select_points(self, x, n):
         """
-        Get 'n' top ranked candidates according to maximin sampling to add to current samples x
+        Get 'n' top ranked candidates according to maximin sampling to add to current samples x.
+        One pool of candidates is ranked against x once, and the minimum distances are then
+        updated incrementally as samples are selected, O(candidates) work per selected sample.
         
         Parameters
         ----------
@@ -114,15 +115,23 @@ class MaximinSampling(SamplingBase):
         
         Returns
         -------
-        dask.delayed
+        list
+            dask.delayed, one per selected sample
         """
-        x = da.from_array(x, chunks='auto')
-        c = []
-        for idx in range(0, n):
-            c_new = self.select_point(x)
-            x = da.vstack((x, c_new))
-            c.append(c_new.to_delayed()[0])
+        x = np.asarray(x)
+        num_samples, num_dimensions = x.shape
+        c = self._candidates((num_samples + n) * self.candidates_ratio, num_dimensions)
+
+        # p = 1 implies Manhattan distance
+        ranking, _ = cKDTree(x).query(c, p=1)
+
+        selected = []
+        for _ in range(n):
+            idx = np.argmax(ranking)
+            selected.append(c[idx])
+            # only the new sample can lower the minimum distances
+            np.minimum(ranking, np.abs(c - c[idx]).sum(axis=1), out=ranking)
 
         if self.use_logger:
             self.logger.info("Maximin sequential design: selected {0} new samples".format(n))
-        return c
+        return [delayed(point) for point in selected]
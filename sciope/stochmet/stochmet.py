@@ -26,8 +26,9 @@ from sciope.sampling.sampling_base import SamplingBase
 from sciope.utilities.priors.prior_base import PriorBase
 from sciope.visualize.interactive_scatter import interative_scatter
 from tsfresh.feature_extraction import MinimalFCParameters
-from sciope.data.dataset import DataSet
+from sciope.data.dataset import DataSet, _field
 from sciope.core import core
+from sciope.core import executors
 from sklearn.manifold import t_sne
 from sklearn.decomposition import PCA, KernelPCA
 from dask import persist, delayed, compute
@@ -194,18 +195,16 @@ class DataSetMET(DataSet):
     DataSet class. Container for keeping MET results. 
     """
 
-    def __init__(self):
+    user_labels = _field('user_labels')
+
+    def __init__(self, storage_dir=None):
         name = 'stochmet'
-        super(DataSetMET, self).__init__(name)
-        self.user_labels = None
+        super(DataSetMET, self).__init__(name, storage_dir)
 
     def add_points(self, inputs=None, targets=None, time_series=None, summary_stats=None, user_labels=None):
         super(DataSetMET, self).add_points(inputs, targets, time_series, summary_stats)
         if user_labels is not None:
-            if self.user_labels is not None:
-                self.user_labels = np.concatenate((self.user_labels, user_labels), axis=0)
-            else:
-                self.user_labels = user_labels
+            self._append('user_labels', user_labels)
 
 
 class StochMET():
@@ -224,7 +223,15 @@ class StochMET():
 
     default_batch_size : int, sets the default batch size (number of points computed) of the
                          parameter sweeps. Default is 10.
-    default_chunk_size : int, sets the default chunk size
+    default_chunk_size : int, sets the default chunk size. 'auto' or an AdaptiveChunker (see sciope.core.core)
+                         adapts the chunk size to the measured simulation time, its report() method gives
+                         the chosen chunk sizes.
+    executor : sciope.core.executors.ExecutorBase or str, optional. Executor used when no dask cluster
+               is used, one of 'serial', 'threads', 'processes' and 'dask'. Defaults to dask. An executor
+               created from a name is shut down after each call to compute, an executor instance is left
+               to the caller.
+    storage_dir : str, optional. Keep the data collection in memory-mapped files in this directory
+                  instead of in memory, for sweeps with more trajectories than fit in memory.
 
     Attributes
     ----------
@@ -240,7 +247,8 @@ class StochMET():
 
     """
 
-    def __init__(self, sim, sampler, summarystats, default_batch_size=100, default_chunk_size=1):
+    def __init__(self, sim, sampler, summarystats, default_batch_size=100, default_chunk_size=1, executor=None,
+                 storage_dir=None):
 
         assert callable(sim), "simulator must be a callable function"
 
@@ -257,9 +265,11 @@ class StochMET():
         self.simulator = sim
         self.sampling = sampler
         self.batch_size = default_batch_size
-        self.chunk_size = default_chunk_size
-        self.data = DataSetMET()
+        self.chunk_size = core.get_chunk_size(default_chunk_size, default_batch_size)
+        self.data = DataSetMET(storage_dir)
         self.summaries = summarystats
+        self.executor = executors.get_executor(executor)
+        self._owns_executor = not isinstance(executor, executors.ExecutorBase)
 
     def compute(self, n_points=None, chunk_size=None, predictor=None):
         """
@@ -268,115 +278,119 @@ class StochMET():
         Parameters
         ----------
         n_points : int, optional. The batch size of the sweep. Defaults to default_batch_size.
-        chunk_size : int, sets the chunk size
+        chunk_size : int, str or AdaptiveChunker, sets the chunk size. Defaults to default_chunk_size.
         predictor : function, optional. Use a model predictor based on the features as input as the 
                     final step of the workflow. The predictor function must take an array with the
                     same length as the joined feature output. 
                     TODO: currently only supports joined features    
 
         """
-        cluster_mode = core._cluster_mode()
+        cluster_mode = core._cluster_mode() and isinstance(self.executor, executors.DaskExecutor)
         if n_points is None:
             n_points = self.batch_size
         if chunk_size is None:
             chunk_size = self.chunk_size
-        
+        chunk_size = core.get_chunk_size(chunk_size, n_points)
+        if predictor is not None and not callable(predictor):
+            raise ValueError("The predictor must be a callable function")
+        self.data.reserve(self.data.get_size() + n_points)
+
+        if not cluster_mode:
+            try:
+                res = core.compute_chunked(self.sampling.draw,
+                                           self.simulator,
+                                           self.summaries.compute,
+                                           predictor,
+                                           batch_size=n_points,
+                                           chunk_size=chunk_size,
+                                           executor=self.executor)
+            finally:
+                if self._owns_executor:
+                    self.executor.shutdown()
+            for e, stats in enumerate(res["summarystats"]):
+                param = np.asarray(res["parameters"][e])
+                ts = np.asarray(res["trajectories"][e])
+                stats = np.asarray(stats)
+                pred = np.asarray(res["distances"][e]) if predictor is not None else None
+                self.data.add_points(inputs=param, time_series=ts,
+                                     summary_stats=stats, user_labels=np.ones(len(stats))*-1,
+                                     targets=pred)
+            return
+
+        # one task per chunk, trajectories are kept for the data collection
         graph_dict = core.get_graph_chunked(self.sampling.draw, 
                                             self.simulator,
                                             self.summaries.compute, 
                                             batch_size=n_points,
-                                            chunk_size=chunk_size)
-        pred = []
+                                            chunk_size=chunk_size,
+                                            dist_func=predictor,
+                                            fused=True)
+        if isinstance(chunk_size, core.AdaptiveChunker):
+            # shares keys with the results persisted below, chunks are only computed once
+            durations_res, = persist(graph_dict["durations"])
+
         if predictor is not None:
-            if callable(predictor):
-                pred = core.get_prediction(predictor, graph_dict["summarystats"])
-            else:
-                raise ValueError("The predictor must be a callable function")
+            pred = graph_dict["distances"]
             # persist at workers, will run in background
-            if cluster_mode:
-                params_res, processed_res, result_res, pred_res = persist(graph_dict["parameters"], 
-                                                                          graph_dict["trajectories"], 
-                                                                          graph_dict["summarystats"],
-                                                                          pred)
-                # convert to futures
-                futures = core.get_futures(result_res)
-                f_pred = core.get_futures(pred_res)
-                f_params = core.get_futures(params_res)
-                f_ts = core.get_futures(processed_res)
-
-                # keep track of indices...
-                f_dict = {f.key: idx for idx, f in enumerate(f_pred)}
-                # ..as we collect result on a "as completed" basis
-                for f, pred in as_completed(f_pred, with_results=True):
-                    idx = f_dict[f.key]
-                    # get the parameter point
-                    params = f_params[idx].result()
-                    # get the trajatories
-                    trajs = f_ts[idx].result()
-                    #get summary stats
-                    stats = futures[idx].result()
-                    # add to data collection
-                    param = np.asarray(params)
-                    traj = np.asarray(trajs)
-                    stats = np.asarray(stats)
-                    pred = np.asarray(pred)
-                    self.data.add_points(inputs=param, time_series=traj,
-                                        summary_stats=stats, user_labels=np.ones(len(stats))*-1,
-                                         targets=pred)
-            else:
-                params_res, processed_res, result_res, pred_res = compute(graph_dict["parameters"], 
-                                                                          graph_dict["trajectories"], 
-                                                                          graph_dict["summarystats"],
-                                                                          pred)
-                for e, pred in enumerate(pred_res):
-                    param = np.asarray(params_res[e])
-                    ts = np.asarray(processed_res[e])
-                    stats = np.asarray(result_res[e])
-                    pred = np.asarray(pred)
-                    self.data.add_points(inputs=param, time_series=ts,
-                                         summary_stats=stats, user_labels=np.ones(len(pred))*-1,
-                                         targets=pred)
-
+            params_res, processed_res, result_res, pred_res = persist(graph_dict["parameters"], 
+                                                                      graph_dict["trajectories"], 
+                                                                      graph_dict["summarystats"],
+                                                                      pred)
+            # convert to futures
+            futures = core.get_futures(result_res)
+            f_pred = core.get_futures(pred_res)
+            f_params = core.get_futures(params_res)
+            f_ts = core.get_futures(processed_res)
+
+            # keep track of indices...
+            f_dict = {f.key: idx for idx, f in enumerate(f_pred)}
+            # ..as we collect result on a "as completed" basis
+            for f, pred in as_completed(f_pred, with_results=True):
+                idx = f_dict[f.key]
+                # get the parameter point
+                params = f_params[idx].result()
+                # get the trajatories
+                trajs = f_ts[idx].result()
+                #get summary stats
+                stats = futures[idx].result()
+                # add to data collection
+                param = np.asarray(params)
+                traj = np.asarray(trajs)
+                stats = np.asarray(stats)
+                pred = np.asarray(pred)
+                self.data.add_points(inputs=param, time_series=traj,
+                                    summary_stats=stats, user_labels=np.ones(len(stats))*-1,
+                                     targets=pred)
 
         else:
-            # TODO: avoid redundancy...
-            if cluster_mode:
-                params_res, processed_res, result_res = persist(graph_dict["parameters"], 
-                                                                graph_dict["trajectories"], 
-                                                                graph_dict["summarystats"])
-
-                # convert to futures
-                futures = core.get_futures(result_res)
-                f_params = core.get_futures(params_res)
-                f_ts = core.get_futures(processed_res)
-
-                # keep track of indices...
-                f_dict = {f.key: idx for idx, f in enumerate(futures)}
-                # ..as we collect result on a "as completed" basis
-                for f, res in as_completed(futures, with_results=True):
-                    idx = f_dict[f.key]
-                    # get the parameter point
-                    params = f_params[idx].result()
-                    # get the trajatories
-                    trajs = f_ts[idx].result()
-                    # add to data collection
-                    param = np.asarray(params)
-                    traj = np.asarray(trajs)
-                    res = np.asarray(res)
-                    self.data.add_points(inputs=param, time_series=traj,
-                                        summary_stats=res, user_labels=np.ones(len(res))*-1)
-            else:
-                params_res, processed_res, result_res = compute(graph_dict["parameters"], 
-                                                                          graph_dict["trajectories"], 
-                                                                          graph_dict["summarystats"])
-                for e, res in enumerate(result_res):
-                    param = np.asarray(params_res[e])
-                    ts = np.asarray(processed_res[e])
-                    res = np.asarray(res)
-                    self.data.add_points(inputs=param, time_series=ts,
-                                         summary_stats=res, user_labels=np.ones(len(res))*-1)
-
-            
+            params_res, processed_res, result_res = persist(graph_dict["parameters"], 
+                                                            graph_dict["trajectories"], 
+                                                            graph_dict["summarystats"])
+
+            # convert to futures
+            futures = core.get_futures(result_res)
+            f_params = core.get_futures(params_res)
+            f_ts = core.get_futures(processed_res)
+
+            # keep track of indices...
+            f_dict = {f.key: idx for idx, f in enumerate(futures)}
+            # ..as we collect result on a "as completed" basis
+            for f, res in as_completed(futures, with_results=True):
+                idx = f_dict[f.key]
+                # get the parameter point
+                params = f_params[idx].result()
+                # get the trajatories
+                trajs = f_ts[idx].result()
+                # add to data collection
+                param = np.asarray(params)
+                traj = np.asarray(trajs)
+                res = np.asarray(res)
+                self.data.add_points(inputs=param, time_series=traj,
+                                    summary_stats=res, user_labels=np.ones(len(res))*-1)
+
+        if isinstance(chunk_size, core.AdaptiveChunker):
+            params, durations = compute(params_res, durations_res)
+            chunk_size.update(durations, [len(p) for p in params])
 
     def explore(self, dr_method='umap', scaling=None, kwargs={}):
         """
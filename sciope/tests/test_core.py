@@ -10,6 +10,7 @@ from sciope.utilities.distancefunctions import euclidean as euc
 from sciope.features.feature_extraction import generate_tsfresh_features
 from tsfresh.feature_extraction.settings import MinimalFCParameters
 from sciope.core import core
+from sciope.core import executors
 import pytest
 import gillespy2
 from gillespy2.solvers.numpy import NumPySSASolver
@@ -295,3 +296,148 @@ def test_param_sim_summ():
 
     assert dist_res.shape == (5, 2, 1, 16), "Core test failed, dimension mismatch"
 
+
+def test_run_chunk():
+    chunk = np.random.randn(3, 2)
+
+    res = core.run_chunk(chunk, simple_sim)
+    assert np.asarray(res).shape == (3, 2), "Core test failed, dimensions mismatch"
+
+    res = core.run_chunk(chunk, simple_sim, simple_summ)
+    assert np.asarray(res).shape == (3, 2), "Core test failed, dimensions mismatch"
+
+    res = core.run_chunk(chunk, lambda x: x, simple_summ, lambda x: np.linalg.norm(x))
+    expected = [np.linalg.norm(simple_summ(x)) for x in chunk]
+    assert np.allclose(res, expected), "Core test failed, fused distances mismatch"
+
+
+def test_compute_chunked_executors():
+    dist_func = lambda x: np.linalg.norm(x)
+    for executor in ['serial', 'threads', 'dask']:
+        res = core.compute_chunked(param_func=simple_sampler_chunked, sim_func=simple_sim, summaries_func=simple_summ,
+                                   dist_func=dist_func, batch_size=10, chunk_size=2, executor=executor)
+
+        assert len(res["parameters"]) == 5, "Core test failed, dimensions mismatch"
+        assert np.asarray(res["trajectories"]).shape == (5, 2, 2), "Core test failed, dimensions mismatch"
+        assert np.asarray(res["summarystats"]).shape == (5, 2, 2), "Core test failed, dimensions mismatch"
+        assert np.asarray(res["distances"]).shape == (5, 2), "Core test failed, dimensions mismatch"
+
+        res = core.compute_chunked(param_func=simple_sampler_chunked, sim_func=simple_sim, summaries_func=simple_summ,
+                                   dist_func=dist_func, batch_size=10, chunk_size=2, executor=executor,
+                                   keep_trajectories=False)
+        assert res["trajectories"] is None, "Core test failed, expected None"
+        assert np.asarray(res["distances"]).shape == (5, 2), "Core test failed, dimensions mismatch"
+
+    with pytest.raises(ValueError):
+        executors.get_executor('unknown')
+
+
+def _random_draw(i):
+    import time
+    time.sleep(0.05)
+    return os.getpid(), np.random.rand()
+
+
+def slow_sim(x):
+    import time
+    time.sleep(1)
+    return simple_sim(x)
+
+
+def test_submission_engine():
+    dist_func = lambda x: np.linalg.norm(x)
+    with Client(processes=False, n_workers=1, threads_per_worker=1) as client:
+        engine = core.SubmissionEngine(simple_sampler_chunked, simple_sim, simple_summ, dist_func,
+                                       chunk_size=2, max_in_flight=3)
+        # the window limits the number of chunks in flight
+        assert engine.submit(10) == 3, "Core test failed, window limit exceeded"
+        assert engine.submit(1) == 0 and engine.in_flight == 3, "Core test failed, window limit exceeded"
+        assert engine.n_needed(100, 0.5) == 0, "Core test failed, expected a full window"
+
+        params, dists = next(iter(engine))
+        assert np.asarray(params).shape == (2, 2), "Core test failed, dimensions mismatch"
+        assert len(dists) == 2 and engine.in_flight == 2, "Core test failed, expected a consumed chunk"
+
+        # the acceptance rate decides how many new chunks are needed
+        assert engine.n_needed(0, 0.5) == 0, "Core test failed, no chunks needed"
+        assert engine.n_needed(100, 0.5) == 1, "Core test failed, expected the free room in the window"
+        assert engine.n_needed(100, 0.0) == 1, "Core test failed, expected the free room in the window"
+        # 4 points in flight at rate 0.5 are expected to give the 2 remaining samples
+        assert engine.n_needed(2, 0.5) == 0, "Core test failed, chunks in flight are enough"
+        engine.cancel()
+        # every chunk left in flight is either cancelled or discarded unused
+        assert engine.cancelled_count + engine.discarded_count == 2, "Core test failed, wasted chunks not counted"
+
+        # cancel leaves no pending futures
+        engine = core.SubmissionEngine(simple_sampler_chunked, slow_sim, simple_summ, dist_func,
+                                       chunk_size=2, max_in_flight=3)
+        engine.submit(3)
+        futures = [f for pending in engine._pending.values() for f in pending[:2]]
+        assert engine.cancel() > 0, "Core test failed, expected unfinished chunks"
+        assert engine.in_flight == 0 and list(engine) == [], "Core test failed, expected no chunks in flight"
+        assert all(f.status in ('cancelled', 'finished') for f in futures), "Core test failed, pending futures"
+
+
+def test_process_executor_seeding():
+    executor = executors.get_executor(executors.ProcessExecutor(max_workers=2))
+    try:
+        res = executor.map(_random_draw, range(8))
+    finally:
+        executor.shutdown()
+    pids = set(pid for pid, _ in res)
+    draws = [x for _, x in res]
+    assert len(pids) == 2, "Core test failed, expected two worker processes"
+    assert len(set(draws)) == len(draws), "Core test failed, workers share the random state"
+
+
+def test_executor_context_manager():
+    with executors.ThreadExecutor(max_workers=2) as executor:
+        assert executor.map(lambda x: x + 1, range(4)) == [1, 2, 3, 4], "Core test failed, map mismatch"
+        assert executor._pool is not None, "Core test failed, expected a running pool"
+    assert executor._pool is None, "Core test failed, pool not shut down on exit"
+
+
+def test_fused_graph():
+    dist_func = lambda x: np.linalg.norm(x)
+    graph_dict = core.get_graph_chunked(param_func=simple_sampler_chunked, sim_func=simple_sim,
+                                        summaries_func=simple_summ, batch_size=10, chunk_size=2,
+                                        dist_func=dist_func, fused=True)
+
+    assert len(graph_dict["distances"]) == 5, "Core test failed, dimension mismatch"
+
+    params, summ, dists = dask.compute(graph_dict["parameters"], graph_dict["summarystats"],
+                                       graph_dict["distances"])
+    expected = np.linalg.norm(np.asarray(summ), axis=2)
+
+    assert np.asarray(summ).shape == (5, 2, 2), "Core test failed, dimension mismatch"
+    assert np.allclose(dists, expected), "Core test failed, fused distances mismatch"
+
+
+def test_adaptive_chunker():
+    chunker = core.AdaptiveChunker(chunk_size=4, target_duration=1.0, max_chunk_size=64)
+
+    # 0.1s per point, chunk size grows at most by max_factor towards 10 points per chunk
+    assert chunker.update([0.4, 0.4], [4, 4]) == 8, "Core test failed, chunk size not adapted"
+    assert chunker.update([0.8], [8]) == 10, "Core test failed, chunk size not adapted"
+
+    # simulations get more expensive, chunk size shrinks
+    chunker.update([10.0], [10])
+    assert chunker.chunk_size < 10, "Core test failed, chunk size not adapted"
+
+    report = chunker.report()
+    assert list(report["chunk_sizes"]) == [4, 4, 8, 10], "Core test failed, report mismatch"
+    assert len(report["durations"]) == 4, "Core test failed, report mismatch"
+
+    assert isinstance(core.get_chunk_size('auto'), core.AdaptiveChunker), "Core test failed, expected chunker"
+    assert core.get_chunk_size(chunker) is chunker, "Core test failed, expected same chunker"
+    assert core.get_chunk_size(5) == 5, "Core test failed, expected fixed chunk size"
+    # 'auto' is capped at the batch size, or a default cap
+    assert core.get_chunk_size('auto', 10).max_chunk_size == 10, "Core test failed, expected batch size cap"
+    assert core.get_chunk_size('auto').max_chunk_size == core.AUTO_MAX_CHUNK_SIZE, "Core test failed, expected cap"
+
+    chunker = core.AdaptiveChunker(chunk_size=2, target_duration=1.0)
+    res = core.compute_chunked(param_func=simple_sampler_chunked, sim_func=simple_sim, summaries_func=simple_summ,
+                               batch_size=10, chunk_size=chunker, executor='serial')
+    assert len(res["parameters"]) == 5, "Core test failed, dimensions mismatch"
+    assert len(chunker.report()["chunk_sizes"]) == 5, "Core test failed, chunks not recorded"
+    assert chunker.chunk_size == 4, "Core test failed, chunk size not adapted"
@@ -0,0 +1,188 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Test suite for the dataset container
+"""
+from sciope.data.dataset import DataSet
+import numpy as np
+import os
+import pytest
+
+
+def test_dataset_add_points():
+    data = DataSet('test')
+    assert data.x is None and data.get_size() == 0, "DataSet test error, expected empty dataset"
+
+    x = [np.random.rand(3, 2) for _ in range(20)]
+    ts = [np.random.rand(3, 1, 2, 5) for _ in range(20)]
+    for xi, tsi in zip(x, ts):
+        data.add_points(inputs=xi, time_series=tsi, summary_stats=xi[:, None, :])
+    assert data.get_size() == 60, "DataSet test error, size mismatch"
+    assert np.array_equal(data.x, np.concatenate(x)), "DataSet test error, inputs mismatch"
+    assert np.array_equal(data.ts, np.concatenate(ts)), "DataSet test error, time series mismatch"
+    assert data.s.shape == (60, 1, 2), "DataSet test error, summary statistics shape mismatch"
+
+    with pytest.raises(AssertionError):
+        data.add_points(inputs=np.random.rand(3, 4))
+    with pytest.raises(ValueError):
+        data.add_points(time_series=np.random.rand(3, 1, 2, 6))
+
+
+def test_dataset_reserve():
+    data = DataSet('test')
+    data.reserve(100)
+    data.add_points(inputs=np.ones((10, 2)), targets=-np.ones((10, 1)))
+    buffer = data._buffers['x']._data
+    assert len(buffer) == 100, "DataSet test error, expected the reserved capacity"
+    for _ in range(9):
+        data.add_points(inputs=np.ones((10, 2)), targets=-np.ones((10, 1)))
+    assert data._buffers['x']._data is buffer, "DataSet test error, expected a single allocation"
+    assert data.x.shape == (100, 2) and data.y.shape == (100, 1), "DataSet test error, shape mismatch"
+
+    # the views share memory with the buffers
+    data.y[:5] = 1
+    assert data.y[:5].sum() == 5, "DataSet test error, expected writable views"
+
+    data.add_points(inputs=np.ones((1, 2)))
+    assert len(data._buffers['x']._data) == 200, "DataSet test error, expected doubling capacity"
+
+
+def test_dataset_memmap(tmp_path):
+    data = DataSet('test', storage_dir=str(tmp_path))
+    data_ref = DataSet('reference')
+    for _ in range(10):
+        x = np.random.rand(7, 3)
+        ts = np.random.rand(7, 1, 2, 50)
+        data.add_points(inputs=x, time_series=ts, summary_stats=x[:, None, :])
+        data_ref.add_points(inputs=x, time_series=ts, summary_stats=x[:, None, :])
+    first = data.ts[:7]
+
+    data.reserve(1000)
+    data.add_points(inputs=np.random.rand(7, 3), time_series=np.random.rand(7, 1, 2, 50))
+    data.flush()
+    assert isinstance(data.ts, np.memmap), "DataSet test error, expected memory-mapped time series"
+    assert np.array_equal(data.ts[:70], data_ref.ts), "DataSet test error, time series mismatch"
+    assert np.array_equal(data.s, data_ref.s), "DataSet test error, summary statistics mismatch"
+    assert np.array_equal(first, data_ref.ts[:7]), "DataSet test error, views invalidated by growth"
+    assert os.path.getsize(os.path.join(str(tmp_path), 'ts.dat')) == 1000 * 2 * 50 * 8, \
+        "DataSet test error, expected the time series on disk"
+
+
+def test_dataset_save_load(tmp_path):
+    path = os.path.join(str(tmp_path), 'sweep.zip')
+    data = DataSet('sweep')
+    data.configurations['listOfParameters'] = ['k1', 'k2']
+    x = np.random.rand(50, 2)
+    ts = np.random.rand(50, 1, 2, 20)
+    data.add_points(inputs=x[:30], time_series=ts[:30], summary_stats=x[:30, None, :])
+    data.save(path)
+    data.add_points(inputs=x[30:], time_series=ts[30:], summary_stats=x[30:, None, :])
+    data.save(path, append=True)
+
+    loaded = DataSet('empty')
+    loaded.load(path)
+    assert loaded.name == 'sweep' and loaded.get_size() == 50, "DataSet test error, size mismatch"
+    assert loaded.configurations['listOfParameters'] == ['k1', 'k2'], "DataSet test error, configurations mismatch"
+    assert loaded.ts.shape == (50, 1, 2, 20), "DataSet test error, time series shape mismatch"
+    # lazy, partial reads
+    assert np.array_equal(loaded.ts[25:35, 0, 1], ts[25:35, 0, 1]), "DataSet test error, partial read mismatch"
+    assert np.array_equal(loaded.x[[3, 40]], x[[3, 40]]), "DataSet test error, fancy indexing mismatch"
+    assert np.array_equal(np.asarray(loaded.s), x[:, None, :]), "DataSet test error, summary statistics mismatch"
+
+    # small chunks, reads span several chunks
+    from sciope.data.archive import Archive, save_arrays
+    path = os.path.join(str(tmp_path), 'chunked.zip')
+    save_arrays(path, {'ts': ts}, chunk_rows=7)
+    with Archive(path) as archive:
+        assert np.array_equal(archive['ts'][5:40:3], ts[5:40:3]), "Archive test error, multi-chunk read mismatch"
+        assert np.array_equal(archive['ts'][-1], ts[-1]), "Archive test error, negative index mismatch"
+
+    # zero-row arrays keep their shape and dtype, appending to a 0-d field replaces it
+    path = os.path.join(str(tmp_path), 'empty.zip')
+    save_arrays(path, {'x': np.zeros((0, 3), dtype=np.int32), 'n': 1})
+    save_arrays(path, {'n': 2}, append=True)
+    with Archive(path) as archive:
+        assert archive['x'].shape == (0, 3), "Archive test error, empty array dropped"
+        assert archive['x'].dtype == np.int32, "Archive test error, empty array dtype mismatch"
+        assert np.asarray(archive['x']).shape == (0, 3), "Archive test error, empty array read mismatch"
+        assert archive['n'] == 2, "Archive test error, appended scalar ignored"
+    save_arrays(path, {'x': np.ones((2, 3), dtype=np.int32)}, append=True)
+    with Archive(path) as archive:
+        assert np.array_equal(archive['x'][:], np.ones((2, 3))), "Archive test error, append after empty mismatch"
+
+    loaded.add_points(inputs=x[:1])
+    assert loaded.x.shape == (51, 2), "DataSet test error, appending to a loaded dataset"
+
+
+def test_dataset_outliers():
+    from scipy.stats import zscore
+    from scipy.stats.mstats import mquantiles
+
+    data = DataSet('test')
+    s = np.random.randn(300, 6)
+    s[100, 2] = 50.0
+    s[250, 4] = -40.0
+    data.outlier_detection = True
+    for i in range(0, 300, 30):
+        data.add_points(summary_stats=s[i:i + 30])
+    assert data._moments.count == 300, "DataSet test error, expected incremental statistics"
+
+    # the streaming statistics match the statistics of the whole dataset
+    expected = np.unique(np.argwhere(np.abs(zscore(s, axis=0)) > 3)[:, 1])
+    assert np.array_equal(data.process_outliers(), expected), "DataSet test error, zscore outliers mismatch"
+    quants = mquantiles(s)
+    iqr = quants[2] - quants[0]
+    expected = np.unique(np.argwhere((s < quants[0] - 1.5 * iqr) | (s > quants[2] + 1.5 * iqr))[:, 1])
+    assert np.array_equal(data.process_outliers(mode='iqr'), expected), "DataSet test error, iqr outliers mismatch"
+
+    # assigning the summary statistics restarts the statistics
+    data.s = s[:10]
+    data.process_outliers()
+    assert data._moments.count == 10, "DataSet test error, expected statistics of the new summary statistics"
+
+
+def test_streaming_merge():
+    from sciope.data.streaming import RunningMoments, QuantileSketch
+
+    x = np.random.randn(10000, 3)
+    moments = [RunningMoments() for _ in range(4)]
+    sketches = [QuantileSketch(size=256) for _ in range(4)]
+    for i, chunk in enumerate(np.array_split(x, 20)):
+        moments[i % 4].update(chunk)
+        sketches[i % 4].update(chunk)
+    for other_moments, other_sketch in zip(moments[1:], sketches[1:]):
+        moments[0].merge(other_moments)
+        sketches[0].merge(other_sketch)
+
+    assert np.allclose(moments[0].mean, x.mean(axis=0)), "Streaming test error, mean mismatch"
+    assert np.allclose(moments[0].std, x.std(axis=0)), "Streaming test error, std mismatch"
+    assert np.array_equal(moments[0].max, x.max(axis=0)), "Streaming test error, max mismatch"
+    assert np.isclose(sketches[0].count, x.size), "Streaming test error, sketch weight mismatch"
+    assert np.allclose(sketches[0].quantiles(), np.percentile(x, [25, 50, 75]), atol=0.05), \
+        "Streaming test error, quantiles mismatch"
+
+
+def test_quantile_sketch_error():
+    from sciope.data.streaming import QuantileSketch
+
+    n, size = 10 ** 6, 256
+    x = np.random.randn(n)
+    sketch = QuantileSketch(size=size)
+    for chunk in np.array_split(x, 1000):
+        sketch.update(chunk)
+    prob = np.linspace(0.01, 0.99, 99)
+    rank = np.searchsorted(np.sort(x), sketch.quantiles(prob)) / n
+    bound = (1 + np.log2(n / size)) / size
+    assert sketch.count == n, "Streaming test error, sketch weight mismatch"
+    assert np.abs(rank - prob).max() <= bound, "Streaming test error, rank error above the documented bound"
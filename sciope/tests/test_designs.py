@@ -17,7 +17,9 @@ Test suite for initial designs
 from sciope.designs import latin_hypercube_sampling as lhs
 from sciope.designs import random_sampling as rs
 from sciope.designs import factorial_design as fd
+from sciope.core import executors
 import numpy as np
+from scipy.spatial.distance import pdist
 from distributed import Client, LocalCluster
 import pytest
 
@@ -92,6 +94,44 @@ def test_lhs_functional():
     
 
 
+
+def test_lhs_large():
+    lb = np.zeros(3)
+    ub = np.ones(3)
+    num_points = 10 ** 5
+    lhs_points = lhs.LatinHypercube(lb, ub).generate(num_points).compute()
+    assert lhs_points.shape == (num_points, 3), "LatinHypercube test failed, dimensions mismatch"
+    # one point in each of the num_points intervals of every dimension
+    for column in lhs_points.T:
+        assert len(np.unique(column)) == num_points, "LatinHypercube test failed, not a Latin hypercube"
+    assert lhs_points.min() == 0 and lhs_points.max() == 1, "LatinHypercube test failed, scaling mismatch"
+
+
+def test_lhs_search():
+    lb = np.zeros(4)
+    ub = np.ones(4)
+    lhs_obj = lhs.LatinHypercube(lb, ub, use_logger=False)
+    lhs_points, score = lhs_obj.search(50, n_candidates=8, executor='threads')
+    assert lhs_points.shape == (50, 4), "LatinHypercube search test failed, dimensions mismatch"
+    assert np.isclose(score, np.min(pdist(lhs_points))), "LatinHypercube search test failed, score mismatch"
+
+    # the best candidate is at least as good as each deterministic one
+    for ns in range(1, 5):
+        _, candidate_score = lhs_obj._candidate(50, lhs_obj._seed(ns))
+        assert score >= candidate_score, "LatinHypercube search test failed, not the best candidate"
+
+    # the search is reachable through generate and draw
+    searched = lhs_obj.generate(50, n_candidates=8, executor='threads').compute()
+    assert searched.shape == (50, 4), "LatinHypercube search test failed, dimensions mismatch"
+    samples = lhs_obj.draw(10, n=50, n_candidates=8, executor='serial')
+    assert len(samples) == 10, "LatinHypercube search test failed, dimensions mismatch"
+
+    # a pool created from a name is shut down, an executor instance is left to the caller
+    with executors.ThreadExecutor() as executor:
+        lhs_obj.search(50, n_candidates=4, executor=executor)
+        assert executor._pool is not None, "LatinHypercube search test failed, caller's executor shut down"
+
+
 def test_random_functional():
     lb = np.asarray([1, 1, 1])
     ub = np.asarray([9, 9, 9])
@@ -164,9 +204,39 @@ def test_factorial_functional():
     samples = fd_obj.draw(n_samples=5, chunk_size=2)
     assert len(samples) == 3, "LatinHypercube sampling test failed, dimensions mismatch"
     assert len(fd_obj.random_idx) == 22, "LatinHypercube sampling test failed, dimensions mismatch"
-    
 
 
+def test_design_draw_without_replacement():
+    lb = np.asarray([1, 1, 1])
+    ub = np.asarray([9, 9, 9])
+    fd_obj = fd.FactorialDesign(3, lb, ub, use_logger=False)
+    fd_points = fd_obj.generate().compute()
+
+    samples = fd_obj.draw(n_samples=20, chunk_size=4) + fd_obj.draw(n_samples=20, chunk_size=4)
+    assert [len(d.compute()) for d in samples] == [4] * 5 + [4, 3], "FactorialDesign draw test failed, chunks"
+    drawn = np.vstack([d.compute() for d in samples])
+    # every point is drawn exactly once
+    assert np.array_equal(np.unique(drawn, axis=0), np.unique(fd_points, axis=0)), \
+        "FactorialDesign draw test failed, points drawn more than once"
+    assert np.array_equal(drawn, fd_points[np.asarray(fd_obj._perm)]), "FactorialDesign draw test failed, draw order"
+
+
+
+def test_factorial_lazy():
+    # 10^8 points, never materialized
+    fd_obj = fd.FactorialDesign(10, np.zeros(8), np.ones(8), use_logger=False)
+    assert fd_obj.generate().shape == (10 ** 8, 8), "FactorialDesign test failed, dimensions mismatch"
+    point = fd_obj.index_to_point(12345678)
+    assert np.allclose(point, [[2, 1, 3, 4, 5, 6, 7, 8]] / np.float64(9)), "FactorialDesign test failed, decoding"
+
+    samples = fd_obj.draw(n_samples=1000, chunk_size=100)
+    assert len(samples) == 10 and len(fd_obj.random_idx) == 10 ** 8 - 1000, \
+        "FactorialDesign draw test failed, dimensions mismatch"
+    drawn = np.vstack([d.compute() for d in samples])
+    assert len(np.unique(drawn, axis=0)) == 1000, "FactorialDesign draw test failed, points drawn more than once"
+    assert np.allclose(drawn[:3], fd_obj.index_to_point(np.asarray(fd_obj._perm[:3]))), \
+        "FactorialDesign draw test failed, draw order"
+
 def test_lhs_functional_with_logging():
     lb = np.asarray([1, 1, 1])
     ub = np.asarray([9, 9, 9])
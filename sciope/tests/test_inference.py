@@ -1,7 +1,22 @@
 import numpy as np
+import os
+import dask
+from scipy.stats import norm
 from sciope.features import feature_extraction as fe
 from sciope.utilities.priors import uniform_prior
+from sciope.utilities.priors.normal_prior import NormalPrior
+from sciope.utilities.priors.log_uniform_prior import LogUniformPrior
+from sciope.utilities.priors.gamma_prior import GammaPrior
+from sciope.utilities.priors.product_prior import ProductPrior
 from sciope.inference.abc_inference import ABC
+from sciope.inference.rep_smc_abc import ReplenishmentSMCABC
+from sciope.inference.smc_abc import SMCABC, PerturbationPrior, normalize_log_weights, systematic_resample
+from sciope.utilities.perturbationkernels.multivariate_normal import MultivariateNormalKernel
+from sciope.inference import checkpoint
+from sciope.core import executors
+from sciope.core.core import AdaptiveChunker
+from sciope.utilities.epsilonselectors import RelativeEpsilonSelector
+from sciope.utilities.summarystats.burstiness import Burstiness
 from sciope.utilities.distancefunctions import naive_squared
 from tsfresh.feature_extraction.settings import MinimalFCParameters
 from sklearn.metrics import mean_absolute_error
@@ -122,6 +137,227 @@ def test_abc_functional():
     assert abc.results['trial_count'] > 0 and abc.results[
         'trial_count'] < 300, "ABC inference test failed, trial count out of bounds"
     assert mae_inference < 0.5, "ABC inference test failed, error too high"
+    assert abc.results['cancelled_count'] >= 0, "ABC inference test failed, expected cancelled chunk count"
+    assert abc.results['discarded_count'] >= 0, "ABC inference test failed, expected discarded chunk count"
 
     c.close()
 
+
+
+def test_abc_scale_distances():
+    abc = ABC(fixed_data, sim=simulator2, prior_function=uni_prior, summaries_function=summ_func, distance_function=ns)
+    dists = np.random.rand(20, 3)
+    dists[:, 2] = 0
+
+    # chunked scaling should equal scaling one trial at a time
+    scaled = np.vstack([abc.scale_distances(dists[:10]), abc.scale_distances(dists[10:])])
+    expected = dists / np.maximum.accumulate(dists, axis=0)
+    expected[:, 2] = 0
+    assert np.allclose(scaled, expected), "ABC scale_distances test failed, scaled value mismatch"
+    assert np.allclose(abc.distance_maxima, dists.max(axis=0)), "ABC scale_distances test failed, maxima mismatch"
+
+    # instances should not share normalization state
+    other = ABC(fixed_data, sim=simulator2, prior_function=uni_prior, summaries_function=summ_func,
+                distance_function=ns)
+    assert other.distance_maxima is None, "ABC scale_distances test failed, state shared between instances"
+    assert np.allclose(other.scale_distance(dists[-1]), [1, 1, 0]), "ABC scale_distance test failed, " \
+                                                                   "scaled value mismatch"
+
+
+def test_smc_abc_checkpoint(tmp_path):
+    path = str(tmp_path / "smc.npz")
+    def poisson_simulator(params):
+        return (np.random.poisson(10 * params[0], size=(1, 2, 20)) + 1).astype(float)
+
+    def crashing_simulator(params):
+        # the worker dies once the first round has been checkpointed
+        if os.path.exists(path):
+            raise RuntimeError("simulator crashed")
+        return poisson_simulator(params)
+
+    data = np.asarray([poisson_simulator(np.ones(2))[0] for _ in range(10)])
+    prior = uniform_prior.UniformPrior(np.array([0.5, 0.5]), np.array([2.0, 2.0]))
+    summaries = Burstiness().compute
+
+    smc = SMCABC(data, crashing_simulator, prior, summaries_function=summaries, executor='serial')
+    with pytest.raises(RuntimeError):
+        smc.infer(num_samples=20, batch_size=20, chunk_size=5, checkpoint=path,
+                  eps_selector=RelativeEpsilonSelector(50, max_rounds=3))
+
+    state = checkpoint.load_checkpoint(path)
+    assert state['round'] == 1, "SMC-ABC checkpoint test failed, round mismatch"
+    assert state['population'].shape == (20, 2), "SMC-ABC checkpoint test failed, dimension mismatch"
+    assert len(state['abc_history']) == 1, "SMC-ABC checkpoint test failed, history mismatch"
+
+    smc = SMCABC(data, poisson_simulator, prior, summaries_function=summaries, executor='serial')
+    history = smc.infer(num_samples=20, batch_size=20, chunk_size=5, resume_from=path,
+                        eps_selector=RelativeEpsilonSelector(50, max_rounds=3))
+    assert len(history) == 3, "SMC-ABC checkpoint test failed, expected resumed rounds"
+    assert all(0 < h['ess'] <= 20 + 1e-8 for h in history), "SMC-ABC checkpoint test failed, ess out of bounds"
+    assert np.allclose(history[0]['accepted_samples'], state['abc_history'][0]['accepted_samples']), \
+        "SMC-ABC checkpoint test failed, history not restored"
+
+
+def test_rep_smc_abc_checkpoint(tmp_path):
+    path = str(tmp_path / "rep_smc.npz")
+    def poisson_simulator(params):
+        return (np.random.poisson(10 * params[0], size=(1, 2, 20)) + 1).astype(float)
+
+    def crashing_simulator(params):
+        # the simulator fails once the initial population has been checkpointed
+        if os.path.exists(path):
+            raise RuntimeError("simulator crashed")
+        return poisson_simulator(params)
+
+    data = np.asarray([poisson_simulator(np.ones(2))[0] for _ in range(10)])
+    prior = uniform_prior.UniformPrior(np.array([0.5, 0.5]), np.array([2.0, 2.0]))
+    summaries = Burstiness().compute
+
+    rep_smc = ReplenishmentSMCABC(data, crashing_simulator, prior, summaries_function=summaries)
+    rep_smc.compute_fixed_mean(chunk_size=5)
+    with pytest.raises(RuntimeError):
+        rep_smc.infer(num_samples=20, batch_size=20, chunk_size=5, checkpoint=path)
+
+    state = checkpoint.load_checkpoint(path)
+    assert state['round'] == 0, "Replenishment SMC-ABC checkpoint test failed, round mismatch"
+    assert state['population'].shape == (20, 2), "Replenishment SMC-ABC checkpoint test failed, dimension mismatch"
+    assert 'tol' not in state, "Replenishment SMC-ABC checkpoint test failed, unexpected tolerance"
+
+    rep_smc = ReplenishmentSMCABC(data, poisson_simulator, prior, summaries_function=summaries)
+    rep_smc.compute_fixed_mean(chunk_size=5)
+    res = rep_smc.infer(num_samples=20, batch_size=20, chunk_size=5, p_min=0.5, resume_from=path)
+    assert res['accepted_samples'].shape == (20, 2), "Replenishment SMC-ABC checkpoint test failed, " \
+                                                     "dimension mismatch"
+
+    # an adaptive chunk size is restored with its adapted size and history
+    chunker = AdaptiveChunker(chunk_size=4)
+    rep_smc = ReplenishmentSMCABC(data, poisson_simulator, prior, summaries_function=summaries)
+    rep_smc.compute_fixed_mean(chunk_size=5)
+    rep_smc.infer(num_samples=20, batch_size=20, chunk_size=chunker, p_min=1.0, checkpoint=path)
+    resumed = AdaptiveChunker(chunk_size=4)
+    rep_smc._restore(path, resumed)
+    assert resumed.chunk_size == chunker.chunk_size, "Replenishment SMC-ABC checkpoint test failed, chunk size"
+    assert resumed.time_per_point == chunker.time_per_point, "Replenishment SMC-ABC checkpoint test failed, " \
+                                                             "time per point"
+    assert np.array_equal(resumed.report()['durations'], chunker.report()['durations']), \
+        "Replenishment SMC-ABC checkpoint test failed, chunk history"
+
+
+def test_smc_abc_executor_lifecycle():
+    def poisson_simulator(params):
+        return (np.random.poisson(10 * params[0], size=(1, 2, 20)) + 1).astype(float)
+
+    data = np.asarray([poisson_simulator(np.ones(2))[0] for _ in range(10)])
+    prior = uniform_prior.UniformPrior(np.array([0.5, 0.5]), np.array([2.0, 2.0]))
+    summaries = Burstiness().compute
+
+    # an executor created from a name is shared by all rounds and shut down after infer
+    smc = SMCABC(data, poisson_simulator, prior, summaries_function=summaries, executor='threads')
+    executor = smc.executor
+    smc.infer(num_samples=20, batch_size=20, chunk_size=5, eps_selector=RelativeEpsilonSelector(50, max_rounds=2))
+    assert smc.executor is executor and executor._pool is None, "SMC-ABC executor test failed, pool leaked"
+
+    rep_smc = ReplenishmentSMCABC(data, poisson_simulator, prior, summaries_function=summaries, executor='threads')
+    rep_smc.compute_fixed_mean(chunk_size=5)
+    res = rep_smc.infer(num_samples=20, batch_size=20, chunk_size=5, p_min=0.5)
+    assert res['accepted_samples'].shape == (20, 2), "Replenishment SMC-ABC executor test failed, dimension mismatch"
+    assert rep_smc.executor._pool is None, "Replenishment SMC-ABC executor test failed, pool leaked"
+
+    # an executor instance is left to the caller
+    with executors.ThreadExecutor() as executor:
+        smc = SMCABC(data, poisson_simulator, prior, summaries_function=summaries, executor=executor)
+        smc.infer(num_samples=20, batch_size=20, chunk_size=5,
+                  eps_selector=RelativeEpsilonSelector(50, max_rounds=2))
+        assert executor._pool is not None, "SMC-ABC executor test failed, caller's executor shut down"
+
+
+def test_smc_abc_log_weights():
+    # linear weights of this magnitude underflow to zero
+    log_weights = np.array([-1000.0, -1000.0, -1001.0, -2000.0])
+    weights, ess = normalize_log_weights(log_weights)
+    expected = np.exp(log_weights - log_weights.max())
+    expected = expected / expected.sum()
+    assert np.allclose(weights, expected), "SMC-ABC log weights test failed, weight mismatch"
+    assert np.isclose(ess, 1 / np.sum(expected ** 2)), "SMC-ABC log weights test failed, ess mismatch"
+
+    with pytest.raises(ValueError):
+        normalize_log_weights(np.full(3, -np.inf))
+
+    idxs = systematic_resample(np.array([0.5, 0.5, 0.0, 0.0]))
+    assert len(idxs) == 4 and set(idxs) == {0, 1}, "SMC-ABC log weights test failed, resampling mismatch"
+
+
+def test_perturbation_prior_truncation():
+    prior = uniform_prior.UniformPrior(np.zeros(2), np.ones(2))
+    # population close to the prior boundary
+    population = np.random.rand(20, 2) * 0.1
+    weights = np.ones(20) / 20
+
+    for cov in [np.diag([0.5, 0.2]), np.array([[0.5, 0.3], [0.3, 0.4]])]:
+        kernel = MultivariateNormalKernel(2, cov=cov)
+        proposal = PerturbationPrior(prior, population, weights, kernel)
+        samples = np.vstack(dask.compute(proposal.draw(100, chunk_size=50))[0])
+        assert samples.shape == (100, 2), "PerturbationPrior test failed, dimension mismatch"
+        assert np.all(prior.pdf(samples) > 0), "PerturbationPrior test failed, sample outside the prior support"
+
+        mass = np.exp(proposal.log_truncation())
+        assert np.all((mass > 0) & (mass < 1)), "PerturbationPrior test failed, truncation mass out of bounds"
+
+    # the diagonal case is exact
+    expected = np.diff(norm.cdf((np.array([[0.0], [1.0]]) - population[0]) / np.sqrt([0.5, 0.2])), axis=0).prod()
+    kernel = MultivariateNormalKernel(2, cov=np.diag([0.5, 0.2]))
+    proposal = PerturbationPrior(prior, population, weights, kernel)
+    assert np.isclose(np.exp(proposal.log_truncation()[0]), expected), "PerturbationPrior test failed, " \
+                                                                       "truncation mass mismatch"
+
+    # the full covariance case is integrated numerically
+    cov = np.array([[0.5, 0.3], [0.3, 0.4]])
+    kernel = MultivariateNormalKernel(2, cov=cov)
+    proposal = PerturbationPrior(prior, population, weights, kernel)
+    x = population[0] + np.random.multivariate_normal(np.zeros(2), cov, 100000)
+    expected = np.mean(prior.pdf(x) > 0)
+    assert np.isclose(np.exp(proposal.log_truncation()[0]), expected, atol=0.01), "PerturbationPrior test failed, " \
+                                                                                 "truncation mass mismatch"
+
+    # kernels with little mass in the box can opt in to an approximate Gibbs sampling fallback
+    kernel = MultivariateNormalKernel(2, cov=100 * cov)
+    proposal = PerturbationPrior(prior, population, weights, kernel, max_rejection_rounds=1, gibbs_sweeps=10)
+    samples = proposal._truncated_perturb(population)
+    assert np.all(prior.pdf(samples) > 0), "PerturbationPrior test failed, sample outside the prior support"
+    # by default rows are redrawn until they are inside, an exact draw
+    proposal = PerturbationPrior(prior, population, weights, kernel, max_rejection_rounds=1)
+    samples = proposal._truncated_perturb(population)
+    assert np.all(prior.pdf(samples) > 0), "PerturbationPrior test failed, sample outside the prior support"
+
+    # full support has no truncation, and the mass does not touch the random state
+    kernel = MultivariateNormalKernel(2, cov=np.diag([0.5, 0.2]))
+    state = np.random.get_state()
+    proposal = PerturbationPrior(NormalPrior(0, 1), population, weights, kernel)
+    assert np.array_equal(proposal.log_truncation(), np.zeros(20)), "PerturbationPrior test failed, " \
+                                                                   "expected no truncation"
+    assert np.array_equal(np.random.get_state()[1], state[1]), "PerturbationPrior test failed, random state changed"
+
+    # bounded independent priors and their products use the closed form
+    bounded = ProductPrior([LogUniformPrior(0.05, 1.0), GammaPrior(2.0)])
+    proposal = PerturbationPrior(bounded, population + 0.1, weights, kernel)
+    expected = np.diff(norm.cdf((np.array([[0.05, 0.0], [1.0, np.inf]]) - population[0] - 0.1) /
+                                np.sqrt([0.5, 0.2])), axis=0).prod()
+    assert np.isclose(np.exp(proposal.log_truncation()[0]), expected), "PerturbationPrior test failed, " \
+                                                                       "truncation mass mismatch"
+    samples = proposal._truncated_perturb(population + 0.1)
+    assert np.all(bounded.pdf(samples) > 0), "PerturbationPrior test failed, sample outside the prior support"
+
+
+def test_save_load_results(tmp_path):
+    path = os.path.join(str(tmp_path), 'results.zip')
+    results = [{'accepted_samples': np.random.rand(10, 3), 'distances': np.random.rand(10, 1),
+                'accepted_count': 10, 'trial_count': 25, 'ess': 7.5} for _ in range(3)]
+    checkpoint.save_results(path, {'rounds': results})
+    loaded = checkpoint.load_results(path)['rounds']
+    assert len(loaded) == 3, "save_results test error, expected 3 rounds"
+    for res, res_loaded in zip(results, loaded):
+        assert np.array_equal(res['accepted_samples'], res_loaded['accepted_samples'])
+        assert res['trial_count'] == res_loaded['trial_count'] and res['ess'] == res_loaded['ess']
+    lazy = checkpoint.load_results(path, lazy=True)['rounds'][1]['accepted_samples']
+    assert np.array_equal(lazy[2:4], results[1]['accepted_samples'][2:4])
+
@@ -16,6 +16,7 @@ Test suite for sampling algorithms
 """
 from sciope.designs import latin_hypercube_sampling as lhs
 from sciope.sampling import maximin_sampling as ms
+from scipy.spatial import distance_matrix
 import numpy as np
 import dask
 import pytest
@@ -62,4 +63,26 @@ def test_maximin_functional_with_logging():
     ms_points = np.asarray(ms_points)
 
     assert ms_points.shape[0] == n_new_points, "MaximinSampling test error, dimensions mismatch"
-    assert ms_points.shape[1] == n_dims, "MaximinSampling test error, dimensions mismatch"
\ No newline at end of file
+    assert ms_points.shape[1] == n_dims, "MaximinSampling test error, dimensions mismatch"
+
+
+def test_maximin_incremental():
+    lb = np.asarray([0, 0, 0])
+    ub = np.asarray([1, 1, 1])
+    x = np.random.rand(30, 3)
+    ms_obj = ms.MaximinSampling(lb, ub, use_logger=False)
+    np.random.seed(7)
+    ms_points = np.asarray(dask.compute(ms_obj.select_points(x, 5))[0])
+
+    # greedy selection with full distance matrices over the same candidates
+    np.random.seed(7)
+    c = ms_obj._candidates(35 * 10, 3)
+    design = x
+    for i in range(5):
+        best = c[np.argmax(distance_matrix(c, design, p=1).min(axis=1))]
+        assert np.allclose(ms_points[i], best), "MaximinSampling test error, incremental selection mismatch"
+        design = np.vstack((design, best))
+
+    # scales to large existing designs
+    ms_points = ms_obj.select_points(np.random.rand(20000, 3), 100)
+    assert len(ms_points) == 100, "MaximinSampling test error, dimensions mismatch"
@@ -16,13 +16,25 @@ Test suite for utilities - distance functions, prior functions and summary stati
 """
 from sciope.utilities.distancefunctions import euclidean, manhattan, naive_squared
 from sciope.utilities.priors import uniform_prior
+from sciope.utilities.priors.log_uniform_prior import LogUniformPrior
+from sciope.utilities.priors.normal_prior import NormalPrior, TruncatedNormalPrior
+from sciope.utilities.priors.log_normal_prior import LogNormalPrior
+from sciope.utilities.priors.gamma_prior import GammaPrior
+from sciope.utilities.priors.product_prior import ProductPrior
+from sciope.utilities.priors.qmc_prior import QMCPrior
+from scipy import stats
 from sciope.utilities.summarystats import auto_tsfresh
+from sciope.utilities.summarystats.burstiness import Burstiness
+from sciope.utilities.housekeeping import simulation_cache
+from sciope.utilities.perturbationkernels.multivariate_normal import MultivariateNormalKernel
+from scipy.stats import multivariate_normal
 from sciope.core import core
 from dask.distributed import Client
 import numpy as np
 from scipy.spatial.distance import cityblock
 import dask
 import pytest
+import os
 
 
 def test_distance_functions():
@@ -103,6 +115,84 @@ def test_uniform_prior():
     c.close()
 
 
+def test_uniform_prior_pdf():
+    lb = np.asarray([1, 1])
+    ub = np.asarray([5, 3])
+    prior_func = uniform_prior.UniformPrior(lb, ub)
+    x = np.array([[2.0, 2.0], [0.0, 2.0], [4.0, 2.5], [2.0, 3.5]])
+
+    assert np.allclose(prior_func.pdf(x), [0.125, 0, 0.125, 0]), "UniformPrior pdf test error, value mismatch"
+    log_pdf = prior_func.pdf(x, log=True)
+    assert np.allclose(log_pdf[[0, 2]], np.log(0.125)) and np.all(np.isneginf(log_pdf[[1, 3]])), \
+        "UniformPrior pdf test error, log value mismatch"
+    assert prior_func.pdf(x[0]) == 0.125 and prior_func.pdf(x[1]) == 0, "UniformPrior pdf test error, " \
+                                                                          "single point mismatch"
+
+    out = np.empty(len(x))
+    res = prior_func.pdf(x, out=out)
+    assert res is out and np.allclose(out, [0.125, 0, 0.125, 0]), "UniformPrior pdf test error, out buffer"
+
+
+def test_priors():
+    priors = [(LogUniformPrior([0.01, 1], [1, 100]), stats.loguniform([0.01, 1], [1, 100])),
+              (NormalPrior([0, 1], [1, 2]), stats.norm([0, 1], [1, 2])),
+              (TruncatedNormalPrior(0, 1, [-1, 0], [1, np.inf]), stats.truncnorm([-1, 0], [1, np.inf])),
+              (LogNormalPrior([0, 1], 0.5), stats.lognorm(0.5, scale=np.exp([0, 1]))),
+              (GammaPrior([2, 3], [1, 0.5]), stats.gamma([2, 3], scale=[1, 0.5]))]
+
+    for prior_func, dist in priors:
+        assert prior_func.get_dimension() == 2, "Prior test error, dimension mismatch"
+        samples = prior_func.draw(5, chunk_size=2)
+        assert len(samples) == 3, "Prior test error, expected chunk count mismatch"
+        samples = core._reshape_chunks(dask.compute(samples)[0])
+        assert samples.shape == (5, 2), "Prior test error, expected sample count mismatch"
+        assert np.all(prior_func.pdf(samples) > 0), "Prior test error, drawn samples out of support"
+
+        expected = dist.logpdf(samples).sum(axis=1)
+        assert np.allclose(prior_func.pdf(samples, log=True), expected), "Prior test error, log pdf mismatch"
+        assert np.allclose(prior_func.pdf(samples), np.exp(expected)), "Prior test error, pdf mismatch"
+        assert np.isclose(prior_func.pdf(samples[0], log=True), expected[0]), "Prior test error, single point"
+
+    prior_func = ProductPrior([uniform_prior.UniformPrior(np.array([0.0]), np.array([1.0])),
+                               GammaPrior([2, 3], [1, 0.5])])
+    assert prior_func.get_dimension() == 3, "ProductPrior test error, dimension mismatch"
+    samples = core._reshape_chunks(dask.compute(prior_func.draw(4, chunk_size=2))[0])
+    assert samples.shape == (4, 3), "ProductPrior test error, expected sample count mismatch"
+    expected = stats.gamma([2, 3], scale=[1, 0.5]).logpdf(samples[:, 1:]).sum(axis=1)
+    assert np.allclose(prior_func.pdf(samples, log=True), expected), "ProductPrior test error, log pdf mismatch"
+    samples[0, 0] = 2.0
+    out = np.empty(4)
+    assert prior_func.pdf(samples, out=out) is out and out[0] == 0, "ProductPrior test error, expected zero pdf"
+
+
+def test_qmc_prior():
+    lb, ub = np.array([0.0, 1.0]), np.array([1.0, 3.0])
+    for method in ['sobol', 'halton']:
+        prior_func = QMCPrior(lb, ub, method=method, seed=42)
+        first = core._reshape_chunks(dask.compute(prior_func.draw(6, chunk_size=4))[0])
+        second = core._reshape_chunks(dask.compute(prior_func.draw(10, chunk_size=3))[0])
+        assert prior_func.n_drawn == 16, "QMCPrior test error, drawn count mismatch"
+        assert np.all(prior_func.pdf(second) > 0), "QMCPrior test error, drawn samples out of support"
+
+        # resuming must continue the sequence drawn in one go
+        expected = QMCPrior(lb, ub, method=method, seed=42).rvs(16)
+        assert np.allclose(np.vstack([first, second]), expected), "QMCPrior test error, sequence mismatch"
+        if method == 'sobol':
+            # the first 16 Sobol points are stratified in each dimension
+            strata = np.sort(((expected[:, 0] - lb[0]) * 16).astype(int))
+            assert np.all(strata == np.arange(16)), "QMCPrior test error, Sobol points not stratified"
+
+        prior_func.reset()
+        assert np.allclose(prior_func.rvs(4), expected[:4]), "QMCPrior test error, reset mismatch"
+
+        # tasks generating several chunks each
+        blocked = QMCPrior(lb, ub, method=method, seed=42, block_size=5)
+        chunks = blocked.draw(16, chunk_size=2)
+        assert len(chunks) == 8, "QMCPrior test error, chunk count mismatch"
+        assert np.allclose(np.vstack(dask.compute(chunks)[0]), expected), "QMCPrior test error, blocked sequence " \
+                                                                          "mismatch"
+
+
 def test_distance_functions_with_logging():
     vec_length = 5
     v1 = np.random.rand(1, vec_length)
@@ -216,3 +306,162 @@ def test_summarystats_auto_tsfresh():
     with pytest.raises(AssertionError) as excinfo:
         stats = at.compute(samples)
     assert "required input shape is (n_points, n_species, n_timepoints)" in str(excinfo.value)
+
+
+def test_summarystats_burstiness():
+    data = np.random.rand(50, 3, 101) * 10
+
+    def reference(y, improvement):
+        # the burstiness of a single trajectory
+        r = np.std(y) / np.mean(y)
+        if not improvement:
+            return (r - 1) / (r + 1)
+        n = len(y)
+        return (np.sqrt(n + 1) * r - np.sqrt(n - 1)) / ((np.sqrt(n + 1) - 2) * r + np.sqrt(n - 1))
+
+    for improvement in [False, True]:
+        # per species, as the loop implementation
+        expected = np.array([[reference(data[i, j], improvement) for i in range(50)] for j in range(3)]).T
+        res = Burstiness(improvement=improvement).compute(data)
+        assert np.array_equal(res, expected), "Burstiness test error, expected value mismatch"
+
+        res_mean = Burstiness(mean_trajectories=True, improvement=improvement).compute(data)
+        assert np.array_equal(res_mean, np.mean(expected, axis=0)), "Burstiness test error, mean value mismatch"
+
+    out = np.empty((50, 3), dtype=np.float32)
+    res = Burstiness(dtype=np.float32).compute(data, out=out)
+    assert res is out and np.allclose(res, Burstiness().compute(data), atol=1e-5), \
+        "Burstiness test error, float32 value mismatch"
+
+
+def _baseline_burstiness(data, mean_trajectories=False, improvement=False):
+    """ The loop implementation of Burstiness.compute before it was vectorized """
+    data_arr = np.array(data)
+    assert len(data_arr.shape) == 3, "required input shape is (n_points, n_species, n_timepoints)"
+    res = []
+    for i in range(data_arr.shape[1]):
+        trajs = []
+        for y in data_arr[:, i, :].reshape((data_arr.shape[0], data_arr.shape[2])):
+            r = np.std(y) / np.mean(y)
+            if not improvement:
+                trajs.append((r - 1) / (r + 1))
+            else:
+                n = len(y)
+                trajs.append((np.sqrt(n + 1) * r - np.sqrt(n - 1)) / ((np.sqrt(n + 1) - 2) * r + np.sqrt(n - 1)))
+        res.append(np.reshape(np.array(trajs), (-1, 1)).ravel())
+    res = np.asarray(res).transpose()
+    if mean_trajectories:
+        res = np.asarray(np.mean(res, axis=0))
+    return res
+
+
+def test_summarystats_burstiness_baseline():
+    # one species, a single point, and non-square shapes, as nested lists and arrays
+    inputs = [np.random.rand(20, 1, 30) * 5, np.random.rand(1, 4, 7) * 5, np.random.rand(9, 2, 3) * 5,
+              (np.random.rand(6, 3, 11) * 5).tolist()]
+    for data in inputs:
+        for mean_trajectories in [False, True]:
+            for improvement in [False, True]:
+                expected = _baseline_burstiness(data, mean_trajectories, improvement)
+                bs = Burstiness(mean_trajectories=mean_trajectories, improvement=improvement)
+                res = bs.compute(data)
+                assert res.shape == expected.shape, "Burstiness test error, shape differs from the baseline"
+                assert res.dtype == expected.dtype, "Burstiness test error, dtype differs from the baseline"
+                assert np.allclose(res, expected, rtol=1e-12), "Burstiness test error, value differs from the baseline"
+
+                # the per-species intermediate keeps its N x 1 shape
+                species = np.asarray(data)[:, 0, :]
+                assert bs._compute(species).shape == (species.shape[0], 1), \
+                    "Burstiness test error, intermediate shape differs from the baseline"
+
+                res32 = Burstiness(mean_trajectories=mean_trajectories, improvement=improvement,
+                                   dtype=np.float32).compute(data)
+                assert res32.shape == expected.shape and res32.dtype == np.float32, \
+                    "Burstiness test error, float32 shape mismatch"
+                assert np.allclose(res32, expected, atol=1e-4), "Burstiness test error, float32 value mismatch"
+
+                out = np.empty(expected.shape)
+                assert bs.compute(data, out=out) is out and np.allclose(out, expected, rtol=1e-12), \
+                    "Burstiness test error, out value mismatch"
+
+    # ragged input is rejected, as by the baseline
+    ragged = [[[1.0, 2.0, 3.0]], [[1.0, 2.0]]]
+    for compute in [_baseline_burstiness, Burstiness().compute]:
+        with pytest.raises((AssertionError, ValueError)):
+            compute(ragged)
+
+
+def test_simulation_cache(tmp_path):
+    calls = []
+
+    def sim(x):
+        calls.append(x)
+        return np.random.rand(1, 2, 10)
+
+    cache = simulation_cache.SimulationCache(sim, cache_dir=str(tmp_path), sim_id="test")
+    p = np.array([1.0, 2.0])
+    res = cache(p)
+    assert np.array_equal(cache(p.copy()), res), "SimulationCache test failed, expected cached result"
+    assert len(calls) == 1 and cache.hits == 1 and cache.misses == 1, "SimulationCache test failed, cache miss"
+
+    # the seed and the simulator are part of the key
+    other_seed = simulation_cache.SimulationCache(sim, cache_dir=str(tmp_path), sim_id="test", seed=1)
+    other_seed(p)
+    assert len(calls) == 2, "SimulationCache test failed, expected cache miss for new seed"
+
+    # shared between instances using the same directory
+    shared = simulation_cache.SimulationCache(sim, cache_dir=str(tmp_path), sim_id="test")
+    assert np.array_equal(shared(p), res), "SimulationCache test failed, expected shared result"
+
+    # least recently used results are evicted
+    item_size = cache.size() // 2
+    small = simulation_cache.SimulationCache(sim, cache_dir=str(tmp_path), sim_id="test", max_size=3 * item_size)
+    small(p)
+    for i in range(5):
+        small(np.array([float(i), 0.0]))
+    assert small.size() <= 3 * item_size, "SimulationCache test failed, cache not bounded"
+    small(p)
+    assert len(calls) == 8, "SimulationCache test failed, expected evicted result"
+    # a full cache is reduced to the low-water mark, 2 of 3 results
+    assert small.size() == 2 * item_size, "SimulationCache test failed, expected low-water eviction"
+
+    small.clear()
+    assert small.size() == 0, "SimulationCache test failed, cache not cleared"
+
+
+def test_simulation_cache_default_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    cache = simulation_cache.SimulationCache(lambda x: x, sim_id="test")
+    assert cache.cache_dir.startswith(str(tmp_path)), "SimulationCache test failed, unexpected default directory"
+    if hasattr(os, 'getuid'):
+        assert os.stat(cache.cache_dir).st_mode & 0o077 == 0, "SimulationCache test failed, directory not private"
+        # a directory others can write to is refused
+        os.chmod(cache.cache_dir, 0o777)
+        with pytest.raises(ValueError):
+            simulation_cache.SimulationCache(lambda x: x, sim_id="test")
+
+
+def test_multivariate_normal_kernel():
+    d = 3
+    a = np.random.randn(d, d)
+    cov = a.dot(a.T) + np.eye(d)
+    x0 = np.random.randn(50, d)
+    x = np.random.randn(40, d)
+    weights = np.random.rand(50)
+    weights = weights / weights.sum()
+
+    # small blocks to exercise the blocked evaluation
+    kernel = MultivariateNormalKernel(d, cov=cov, block_size=100)
+    expected = np.vstack([multivariate_normal.pdf(x, x0[i], cov) for i in range(len(x0))])
+    assert np.allclose(kernel.pdf(x0, x), expected), "MultivariateNormalKernel test failed, pdf mismatch"
+    assert np.allclose(kernel.pdf(x0, x, log=True), np.log(expected)), "MultivariateNormalKernel test failed, " \
+                                                                       "log pdf mismatch"
+    assert np.allclose(np.exp(kernel.weighted_logpdf(x0, x, weights)), weights.dot(expected)), \
+        "MultivariateNormalKernel test failed, weighted log pdf mismatch"
+    assert kernel.rvs(x0[0]).shape == (d,), "MultivariateNormalKernel test failed, dimension mismatch"
+
+    # the factorization follows the adapted covariance
+    kernel = MultivariateNormalKernel(d, adapt=True)
+    kernel.adapt(x0)
+    expected = multivariate_normal.pdf(x, x0[0], (2.4 / d) * np.cov(x0, rowvar=False))
+    assert np.allclose(kernel.pdf(x0[:1], x)[0], expected), "MultivariateNormalKernel test failed, adapt mismatch"
@@ -0,0 +1,220 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+On-disk cache of simulation results
+"""
+
+# Imports
+from sciope.utilities.housekeeping import sciope_logger as ml
+import numpy as np
+import cloudpickle
+import hashlib
+import pickle
+import stat
+import os
+
+
+def _default_cache_dir():
+    """
+    A cache directory private to the current user, under $XDG_CACHE_HOME or ~/.cache. Cached
+    results are unpickled, so a directory others can write to would let them run code as this user
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(root, 'sciope', 'sim_cache')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise ValueError("The simulation cache directory {0} must be a directory owned by the current user "
+                             "and not accessible to others (mode 0700)".format(path))
+    return path
+
+
+class SimulationCache(object):
+    """
+    Content-addressed cache wrapped around a simulator function. Results are
+    stored on disk, one file per parameter point, keyed by a hash of the
+    parameter values, the seed and the simulator identity. The cache directory
+    can be shared between processes and workers on one node, files are written
+    atomically and the least recently used files are evicted when the cache
+    grows larger than max_size bytes, down to low_water * max_size bytes so that
+    a full cache does not evict on every new result.
+
+    The wrapped simulator is used as a drop-in replacement, e.g.
+    ABC(data, SimulationCache(sim, cache_dir), prior) or StochMET(SimulationCache(sim), ...).
+    Note that a cached stochastic simulator returns the same realization every
+    time a parameter point is repeated, use a different seed to get new ones.
+
+    Parameters
+    ----------
+    sim : callable
+        the simulator function which takes a parameter point as argument
+    cache_dir : str, optional
+        the cache directory, by default 'sciope/sim_cache' in the user's cache directory
+        ($XDG_CACHE_HOME or ~/.cache), created with mode 0700. Results are read with pickle,
+        only use directories that no one else can write to
+    max_size : int, optional
+        the maximum total size of the cached results in bytes, by default 1 GB
+    low_water : float, optional
+        fraction of max_size the cache is reduced to when it is full, by default 0.9
+    seed : int, optional
+        the seed of the random number stream used by the simulator (e.g. given in
+        the gillespy2 run settings), part of the key. By default None
+    sim_id : str, optional
+        identity of the simulator, by default a hash of the pickled simulator
+    use_logger : bool, optional
+        enable/disable logging, by default False
+    """
+
+    def __init__(self, sim, cache_dir=None, max_size=2 ** 30, low_water=0.9, seed=None, sim_id=None,
+                 use_logger=False):
+        assert callable(sim), "simulator must be a callable function"
+        assert 0 <= low_water <= 1, "low_water must be a fraction of max_size"
+        if cache_dir is None:
+            cache_dir = _default_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        if sim_id is None:
+            sim_id = self._sim_identity(sim)
+
+        self.sim = sim
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.low_water = low_water
+        self.seed = seed
+        self.sim_id = sim_id
+        self.use_logger = use_logger
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    @staticmethod
+    def _sim_identity(sim):
+        try:
+            return hashlib.sha256(cloudpickle.dumps(sim)).hexdigest()
+        except Exception:
+            return "{0}.{1}".format(getattr(sim, "__module__", ""), getattr(sim, "__qualname__", repr(sim)))
+
+    def key(self, params):
+        """
+        The cache key of a parameter point
+
+        Parameters
+        ----------
+        params : array-like
+            the parameter point
+
+        Returns
+        -------
+        str
+            hex digest of the parameter bytes, seed and simulator identity
+        """
+        params = np.ascontiguousarray(params, dtype=np.float64)
+        h = hashlib.sha256()
+        h.update(self.sim_id.encode())
+        h.update(repr(self.seed).encode())
+        h.update(repr(params.shape).encode())
+        h.update(params.tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def __call__(self, params):
+        path = self._path(self.key(params))
+        try:
+            with open(path, 'rb') as f:
+                res = pickle.load(f)
+            # mark as recently used
+            os.utime(path)
+            self.hits += 1
+            return res
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # not cached, evicted by another process or partially written
+            pass
+
+        self.misses += 1
+        res = self.sim(params)
+        self._store(path, res)
+        return res
+
+    def _store(self, path, res):
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(res, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_size:
+            self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        """
+        The total size of the cached results in bytes, including results written by other processes
+
+        Returns
+        -------
+        int
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """ Remove the least recently used results until the cache fits in low_water * max_size """
+        entries = sorted(self._entries())
+        size = sum(s for _, s, _ in entries)
+        target = self.low_water * self.max_size
+        n_evicted = 0
+        for _, s, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already evicted by another process
+                pass
+            size -= s
+            n_evicted += 1
+        self._size = size
+        if self.use_logger:
+            ml.SciopeLogger().get_logger().info("SimulationCache: evicted {0} result(s)".format(n_evicted))
+
+    def clear(self):
+        """
+        Remove all cached results
+        """
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = 0
+
+    def __getstate__(self):
+        # the size estimate is per process, workers rescan the directory
+        state = self.__dict__.copy()
+        state['_size'] = None
+        return state
@@ -18,6 +18,8 @@ Sequential Monte-Carlo Approximate Bayesian Computation (SMC-ABC)
 
 # Imports
 from abc import ABCMeta, abstractmethod
+from scipy.special import logsumexp
+import numpy as np
 
 
 class PerturbationKernelBase(object):
@@ -37,3 +39,17 @@ class PerturbationKernelBase(object):
     @abstractmethod
     def rvs(self, x0, num_points=1):
         pass
+
+    def perturb(self, x0):
+        """
+        Draw one perturbation around each row of x0
+        """
+        return np.vstack([self.rvs(x) for x in np.asarray(x0)])
+
+    def weighted_logpdf(self, x0, x, weights):
+        """
+        Log-density of x under the mixture of kernels centered at x0 with the given weights
+        """
+        with np.errstate(divide='ignore'):
+            log_w = np.log(np.asarray(weights, dtype=float))
+        return logsumexp(self.pdf(x0, x, log=True) + log_w[:, np.newaxis], axis=0)
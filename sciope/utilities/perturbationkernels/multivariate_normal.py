@@ -17,17 +17,25 @@ Sequential Monte-Carlo Approximate Bayesian Computation (SMC-ABC)
 """
 
 from sciope.utilities.perturbationkernels.kernel_base import PerturbationKernelBase
-from scipy.stats import multivariate_normal
+from scipy.linalg import solve_triangular
+from scipy.special import logsumexp
 import numpy as np
 
 class MultivariateNormalKernel(PerturbationKernelBase):
+    """
+    Multivariate normal perturbation kernel. The Cholesky factor of the
+    covariance is computed once whenever cov is set (e.g. by adapt), and
+    densities between all pairs of points are evaluated in blocks of at most
+    block_size pairs using matrix products on the whitened points.
+    """
 
-    def __init__(self, d, cov = None, use_logger = False, adapt = False):
+    def __init__(self, d, cov = None, use_logger = False, adapt = False, block_size = 2**22):
 
         self.name = 'MultivariateNormalKernel'
         self.use_logger = use_logger
         self.d = d
         self._adapt = adapt
+        self.block_size = block_size
         if cov is not None:
             self.cov = cov
         else:
@@ -35,19 +43,116 @@ class MultivariateNormalKernel(PerturbationKernelBase):
 
         super(MultivariateNormalKernel, self).__init__(self.name, use_logger)
 
+    @property
+    def cov(self):
+        return self._cov
+
+    @cov.setter
+    def cov(self, cov):
+        cov = np.atleast_2d(np.asarray(cov, dtype=float))
+        self._chol = np.linalg.cholesky(cov)
+        self._log_norm = -0.5 * cov.shape[0] * np.log(2 * np.pi) - np.sum(np.log(np.diag(self._chol)))
+        self._cov = cov
+
+    def _whiten(self, x):
+        """ Map points to coordinates where the kernel is a standard normal """
+        x = np.asarray(x, dtype=float).reshape(-1, self._cov.shape[0])
+        return solve_triangular(self._chol, x.T, lower=True).T
+
+    def _logpdf_blocks(self, x0, x):
+        """ Yield (row slice, log-densities of x for the rows of x0 in the slice) """
+        z0 = self._whiten(x0)
+        z = self._whiten(x)
+        sq = np.einsum('ij,ij->i', z, z)
+        step = max(1, self.block_size // max(1, len(z)))
+        for start in range(0, len(z0), step):
+            z0_block = z0[start:start + step]
+            sq0 = np.einsum('ij,ij->i', z0_block, z0_block)
+            maha = sq0[:, np.newaxis] + sq[np.newaxis, :] - 2 * z0_block.dot(z.T)
+            np.maximum(maha, 0, out=maha)
+            yield slice(start, start + len(z0_block)), self._log_norm - 0.5 * maha
+
     def pdf(self, x0, x, log = False):
-        pdfs = []
-        for i in range(np.asarray(x0).shape[0]):
-            if log:
-                pdfs.append(multivariate_normal.logpdf(x, x0[i], self.cov))
-            else:
-                pdfs.append(multivariate_normal.pdf(x, x0[i], self.cov))
-        return np.vstack(pdfs)
+        """
+        Kernel densities of the points x around each center in x0
+
+        Parameters
+        ----------
+        x0 : ndarray
+            the kernel centers, one row per point
+        x : ndarray
+            the evaluation points, one row per point
+        log : bool, optional
+            return log-densities, by default False
+
+        Returns
+        -------
+        ndarray
+            of shape (len(x0), len(x))
+        """
+        x0 = np.asarray(x0, dtype=float).reshape(-1, self._cov.shape[0])
+        n = len(np.asarray(x, dtype=float).reshape(-1, self._cov.shape[0]))
+        res = np.empty((len(x0), n))
+        for rows, logpdf in self._logpdf_blocks(x0, x):
+            res[rows] = logpdf
+        if not log:
+            np.exp(res, out=res)
+        return res
+
+    def weighted_logpdf(self, x0, x, weights):
+        """
+        Log-density of the points x under the mixture of kernels centered at x0,
+        i.e. log(sum_i weights[i] * pdf(x0[i], x)). The reduction is done block by
+        block, so the full pairwise matrix is never stored.
+
+        Parameters
+        ----------
+        x0 : ndarray
+            the kernel centers, one row per point
+        x : ndarray
+            the evaluation points, one row per point
+        weights : ndarray
+            the (normalized) weights of the centers
+
+        Returns
+        -------
+        ndarray
+            of shape (len(x),)
+        """
+        with np.errstate(divide='ignore'):
+            log_w = np.log(np.asarray(weights, dtype=float))
+        res = None
+        for rows, logpdf in self._logpdf_blocks(x0, x):
+            block = logsumexp(logpdf + log_w[rows, np.newaxis], axis=0)
+            res = block if res is None else np.logaddexp(res, block)
+        return res
 
     def rvs(self, x0, num_points = 1):
-        r = multivariate_normal.rvs(x0, self.cov)
+        x0 = np.asarray(x0, dtype=float)
+        z = np.random.standard_normal((num_points, self._cov.shape[0]))
+        r = x0 + z.dot(self._chol.T)
+        if num_points == 1:
+            return r[0]
         return r
 
+    def perturb(self, x0):
+        """
+        Draw one perturbation around each row of x0 in a single batch
+
+        Parameters
+        ----------
+        x0 : ndarray
+            the centers, one row per point
+
+        Returns
+        -------
+        ndarray
+            of the same shape as x0
+        """
+        x0 = np.asarray(x0, dtype=float).reshape(-1, self._cov.shape[0])
+        z = np.random.standard_normal(x0.shape)
+        return x0 + z.dot(self._chol.T)
+
     def adapt(self, population):
         if self._adapt:
             self.cov = (2.4/self.d) * np.cov(population, rowvar = False)
@@ -0,0 +1,36 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The Gamma Prior
+"""
+
+# Imports
+from sciope.utilities.priors.independent_prior import IndependentPrior, _broadcast
+from scipy.stats import gamma
+
+
+class GammaPrior(IndependentPrior):
+    """
+    Independent gamma distribution in each dimension
+    """
+
+    def __init__(self, shape, scale=1.0, use_logger=False):
+        """
+        :param shape: the shape parameter of each variable/dimension
+        :param scale: the scale parameter of each variable/dimension
+        :param use_logger: whether logging is enabled or disabled
+        """
+        self.shape, self.scale = _broadcast(shape, scale)
+        assert (self.shape > 0).all() and (self.scale > 0).all(), "shape and scale must be positive"
+        super(GammaPrior, self).__init__('Gamma', gamma(self.shape, scale=self.scale), len(self.shape), use_logger)
@@ -0,0 +1,88 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Base class for priors with independent dimensions
+"""
+
+# Imports
+from sciope.utilities.priors.prior_base import PriorBase
+from sciope.utilities.housekeeping import sciope_logger as ml
+import numpy as np
+
+
+class IndependentPrior(PriorBase):
+    """
+    Prior with independent dimensions, each following a (frozen, vectorized) scipy.stats distribution.
+    Subclasses set up the distribution, sampling and density evaluation are shared.
+    """
+
+    def __init__(self, name, distribution, d, use_logger=False):
+        """
+        :param name: unique identifier for the prior
+        :param distribution: frozen scipy.stats distribution with parameters broadcast to d dimensions
+        :param d: the number of dimensions
+        :param use_logger: whether logging is enabled or disabled
+        """
+        self.distribution = distribution
+        self.d = d
+        super(IndependentPrior, self).__init__(name, use_logger)
+        if self.use_logger:
+            self.logger = ml.SciopeLogger().get_logger()
+            self.logger.info("{0} prior in {1} dimensions initialized".format(name, d))
+
+    def draw(self, n=1, chunk_size=1):
+        """
+        Draw 'n' samples in delayed chunks of 'chunk_size'
+        :param n: the desired number of samples
+        :param chunk_size: the number of samples in each chunk
+        :return: list of delayed (m, d) arrays
+        """
+        return self._draw_chunks(n, chunk_size, self.rvs)
+
+    def rvs(self, n=1):
+        """
+        Draw 'n' samples directly, without dask
+        :param n: the desired number of samples
+        :return: (n, d) array of samples
+        """
+        return self.distribution.rvs(size=(n, self.d))
+
+    def pdf(self, x, log=False, out=None):
+        """
+        Evaluate the (log) density at a point or at each row of an (n, d) array
+        :param x: the point or collection of points to evaluate the pdf at
+        :param log: whether to return the log pdf
+        :param out: optional preallocated array of length n for the result of 2-D input
+        :return: the pdf evaluated at x, a scalar for a single point
+        """
+        z = np.asarray(x, dtype=float)
+        logpdf = self.distribution.logpdf(z).sum(axis=-1)
+        if z.ndim == 1:
+            return logpdf if log else np.exp(logpdf)
+        if out is None:
+            out = logpdf
+        else:
+            out[:] = logpdf
+        if not log:
+            np.exp(out, out=out)
+        return out
+
+    def get_dimension(self):
+        return self.d
+
+
+def _broadcast(*params):
+    """ Broadcast parameters to 1-D float arrays of a common length """
+    params = np.broadcast_arrays(*[np.atleast_1d(np.asarray(p, dtype=float)) for p in params])
+    return [np.array(p) for p in params]
@@ -0,0 +1,38 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The Log-Normal Prior
+"""
+
+# Imports
+from sciope.utilities.priors.independent_prior import IndependentPrior, _broadcast
+from scipy.stats import lognorm
+import numpy as np
+
+
+class LogNormalPrior(IndependentPrior):
+    """
+    Independent log-normal distribution in each dimension, i.e. log(x_i) ~ N(mu_i, sigma_i)
+    """
+
+    def __init__(self, mu, sigma, use_logger=False):
+        """
+        :param mu: the mean of the logarithm of each variable/dimension
+        :param sigma: the standard deviation of the logarithm of each variable/dimension
+        :param use_logger: whether logging is enabled or disabled
+        """
+        self.mu, self.sigma = _broadcast(mu, sigma)
+        assert (self.sigma > 0).all(), "sigma must be positive"
+        super(LogNormalPrior, self).__init__('LogNormal', lognorm(self.sigma, scale=np.exp(self.mu)),
+                                             len(self.mu), use_logger)
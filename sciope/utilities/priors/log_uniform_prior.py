@@ -0,0 +1,37 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The Log-Uniform Prior
+"""
+
+# Imports
+from sciope.utilities.priors.independent_prior import IndependentPrior, _broadcast
+from scipy.stats import loguniform
+
+
+class LogUniformPrior(IndependentPrior):
+    """
+    Uniform in log-space in each dimension, within [min_i, max_i], i=1..d. Suited for rate constants
+    spanning several orders of magnitude.
+    """
+
+    def __init__(self, space_min, space_max, use_logger=False):
+        """
+        :param space_min: the (positive) lowerbound of each variable/dimension
+        :param space_max: the upperbound of each variable/dimension
+        :param use_logger: whether logging is enabled or disabled
+        """
+        self.lb, self.ub = _broadcast(space_min, space_max)
+        assert (self.lb > 0).all() and (self.ub > self.lb).all(), "bounds must satisfy 0 < space_min < space_max"
+        super(LogUniformPrior, self).__init__('LogUniform', loguniform(self.lb, self.ub), len(self.lb), use_logger)
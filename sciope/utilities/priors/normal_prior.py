@@ -0,0 +1,58 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The Normal and Truncated Normal Priors
+"""
+
+# Imports
+from sciope.utilities.priors.independent_prior import IndependentPrior, _broadcast
+from scipy.stats import norm, truncnorm
+
+
+class NormalPrior(IndependentPrior):
+    """
+    Independent normal distribution in each dimension
+    """
+
+    def __init__(self, mean, std, use_logger=False):
+        """
+        :param mean: the mean of each variable/dimension
+        :param std: the standard deviation of each variable/dimension
+        :param use_logger: whether logging is enabled or disabled
+        """
+        self.mean, self.std = _broadcast(mean, std)
+        assert (self.std > 0).all(), "std must be positive"
+        super(NormalPrior, self).__init__('Normal', norm(self.mean, self.std), len(self.mean), use_logger)
+
+
+class TruncatedNormalPrior(IndependentPrior):
+    """
+    Independent normal distribution in each dimension, truncated to [lower_i, upper_i], i=1..d
+    """
+
+    def __init__(self, mean, std, lower, upper, use_logger=False):
+        """
+        :param mean: the mean of each variable/dimension before truncation
+        :param std: the standard deviation of each variable/dimension before truncation
+        :param lower: the lowerbound of each variable/dimension, may be -inf
+        :param upper: the upperbound of each variable/dimension, may be inf
+        :param use_logger: whether logging is enabled or disabled
+        """
+        self.mean, self.std, self.lb, self.ub = _broadcast(mean, std, lower, upper)
+        assert (self.std > 0).all(), "std must be positive"
+        assert (self.ub > self.lb).all(), "upper must be larger than lower"
+        a = (self.lb - self.mean) / self.std
+        b = (self.ub - self.mean) / self.std
+        super(TruncatedNormalPrior, self).__init__('TruncatedNormal', truncnorm(a, b, self.mean, self.std),
+                                                   len(self.mean), use_logger)
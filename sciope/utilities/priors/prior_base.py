@@ -17,6 +17,7 @@ Base Class for Prior Functions
 
 # Imports
 from abc import ABCMeta, abstractmethod
+from dask import delayed
 
 
 # Class definition
@@ -56,3 +57,24 @@ class PriorBase(object):
         """
         Get the dimension of the prior.
         """
+
+    def _draw_chunks(self, n, chunk_size, sample):
+        """
+        Split 'n' samples into delayed chunks, a smaller remainder chunk first
+        :param n: number of desired samples
+        :param chunk_size: number of samples in each chunk
+        :param sample: function drawing an (m, d) array of m samples
+        :return: list of delayed (m, d) arrays
+        """
+        assert n >= chunk_size, "chunk_size can not be larger than n"
+
+        sample = delayed(sample, pure=False)
+        generated_samples = []
+        m = n % chunk_size
+        if m > 0:
+            generated_samples.append(sample(m))
+
+        for i in range(0, n - m, chunk_size):
+            generated_samples.append(sample(chunk_size))
+
+        return generated_samples
@@ -0,0 +1,84 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The Product Prior
+"""
+
+# Imports
+from sciope.utilities.priors.prior_base import PriorBase
+from sciope.utilities.housekeeping import sciope_logger as ml
+import numpy as np
+
+
+class ProductPrior(PriorBase):
+    """
+    Independent product of priors, the dimensions of the components are concatenated in order.
+    The components must implement rvs(n), e.g. UniformPrior or any of the independent priors.
+    """
+
+    def __init__(self, priors, use_logger=False):
+        """
+        :param priors: list of prior objects
+        :param use_logger: whether logging is enabled or disabled
+        """
+        assert len(priors) > 0, "at least one prior is needed"
+        self.priors = list(priors)
+        self.dims = [p.get_dimension() for p in self.priors]
+        self._splits = np.cumsum(self.dims)[:-1]
+        super(ProductPrior, self).__init__('Product', use_logger)
+        if self.use_logger:
+            self.logger = ml.SciopeLogger().get_logger()
+            self.logger.info("Product prior in {} dimensions initialized".format(sum(self.dims)))
+
+    def draw(self, n=1, chunk_size=1):
+        """
+        Draw 'n' samples in delayed chunks of 'chunk_size'
+        :param n: the desired number of samples
+        :param chunk_size: the number of samples in each chunk
+        :return: list of delayed (m, d) arrays
+        """
+        return self._draw_chunks(n, chunk_size, self.rvs)
+
+    def rvs(self, n=1):
+        """
+        Draw 'n' samples directly, without dask
+        :param n: the desired number of samples
+        :return: (n, d) array of samples
+        """
+        return np.hstack([np.asarray(p.rvs(n)).reshape(n, -1) for p in self.priors])
+
+    def pdf(self, x, log=False, out=None):
+        """
+        Evaluate the (log) density at a point or at each row of an (n, d) array
+        :param x: the point or collection of points to evaluate the pdf at
+        :param log: whether to return the log pdf
+        :param out: optional preallocated array of length n for the result of 2-D input
+        :return: the pdf evaluated at x, a scalar for a single point
+        """
+        z = np.asarray(x, dtype=float)
+        parts = np.split(z, self._splits, axis=-1)
+        with np.errstate(divide='ignore'):
+            logpdf = sum(p.pdf(part, log=True) for p, part in zip(self.priors, parts))
+        if z.ndim == 1:
+            return logpdf if log else np.exp(logpdf)
+        if out is None:
+            out = np.asarray(logpdf, dtype=float)
+        else:
+            out[:] = logpdf
+        if not log:
+            np.exp(out, out=out)
+        return out
+
+    def get_dimension(self):
+        return sum(self.dims)
@@ -0,0 +1,148 @@
+# Copyright 2019 Prashant Singh, Fredrik Wrede and Andreas Hellander
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The Quasi-Monte Carlo (Sobol/Halton) Uniform Prior
+"""
+
+# Imports
+from sciope.utilities.priors.uniform_prior import UniformPrior
+from sciope.utilities.housekeeping import sciope_logger as ml
+from scipy.stats import qmc
+from dask import delayed
+import numpy as np
+import warnings
+
+_engines = {'sobol': qmc.Sobol, 'halton': qmc.Halton}
+
+
+def _qmc_points(method, d, scramble, seed, start, n, lb, ub):
+    """
+    Points start, ..., start + n - 1 of a (scrambled) low-discrepancy sequence, scaled to [lb, ub].
+    The sequence is fully determined by the seed, so chunks can be generated independently.
+    """
+    engine = _engines[method](d, scramble=scramble, seed=seed)
+    if start > 0:
+        engine.fast_forward(start)
+    with warnings.catch_warnings():
+        # chunks of a Sobol sequence need not be powers of 2, the balance
+        # properties hold for the sequence drawn as a whole
+        warnings.simplefilter("ignore", UserWarning)
+        x = engine.random(n)
+    x *= ub - lb
+    x += lb
+    return x
+
+
+def _qmc_chunks(method, d, scramble, seed, start, sizes, lb, ub):
+    """
+    Consecutive chunks of the given sizes of the sequence, starting at point start. The points are
+    generated by a single engine, fast-forwarded once.
+    """
+    x = _qmc_points(method, d, scramble, seed, start, sum(sizes), lb, ub)
+    return np.split(x, np.cumsum(sizes)[:-1])
+
+
+# Class definition: QMC Prior
+class QMCPrior(UniformPrior):
+    """
+    Uniform prior over [min_i, max_i], i=1..d, drawn from a scrambled Sobol or Halton sequence
+    instead of i.i.d. uniform points. The low-discrepancy points cover the space more evenly,
+    which in low dimensions gives equally good rejection ABC or StochMET sweeps with fewer
+    simulations.
+
+    The prior is resumable, repeated calls to draw continue the sequence where the previous
+    call stopped. The chunks are generated on the workers, in tasks of up to block_size
+    consecutive points each fast-forwarding the sequence once to their offset, no points are
+    generated on the client.
+    """
+
+    def __init__(self, space_min, space_max, method='sobol', scramble=True, seed=None, block_size=2 ** 16,
+                 use_logger=False):
+        """
+        Set up a QMC prior corresponding to the space bounded by:
+        :param space_min: the lowerbound of each variable/dimension
+        :param space_max: the upperbound of each variable/dimension
+        :param method: the low-discrepancy sequence, 'sobol' or 'halton'
+        :param scramble: whether to randomize the sequence by scrambling
+        :param seed: seed of the scrambling, by default drawn from the global numpy random state
+        :param block_size: the number of consecutive points generated by each task of draw
+        :param use_logger: whether logging is enabled or disabled
+        """
+        if method not in _engines:
+            raise ValueError("Supported QMC methods are: {0} got method={1}".format(list(_engines), method))
+        super(QMCPrior, self).__init__(space_min, space_max, use_logger=False)
+        self.name = 'QMC'
+        self.method = method
+        self.scramble = scramble
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        self.seed = seed
+        self.block_size = block_size
+        self.n_drawn = 0
+        self.use_logger = use_logger
+        if self.use_logger:
+            self.logger = ml.SciopeLogger().get_logger()
+            self.logger.info("QMC ({0}) prior in {1} dimensions initialized".format(method, len(self.lb)))
+
+    def _next(self, n):
+        """ Reserve the next 'n' points of the sequence, returns the offset of the first """
+        start = self.n_drawn
+        self.n_drawn += n
+        return start
+
+    def _points(self, start, n):
+        return _qmc_points(self.method, len(self.lb), self.scramble, self.seed, start, n,
+                           np.asarray(self.lb, dtype=float), np.asarray(self.ub, dtype=float))
+
+    def draw(self, n=1, chunk_size=1):
+        """
+        Draw the next 'n' points of the sequence, scaled to self.lb and self.ub
+        :param n: the desired number of samples
+        :param chunk_size: the number of samples in each chunk
+        :return: list of delayed (m, d) arrays, in sequence order
+        """
+        assert n >= chunk_size, "chunk_size can not be larger than n"
+
+        d = len(self.lb)
+        lb = np.asarray(self.lb, dtype=float)
+        ub = np.asarray(self.ub, dtype=float)
+
+        m = n % chunk_size
+        sizes = ([m] if m > 0 else []) + [chunk_size] * ((n - m) // chunk_size)
+        chunks_per_task = max(1, self.block_size // chunk_size)
+
+        generated_samples = []
+        for i in range(0, len(sizes), chunks_per_task):
+            block = sizes[i:i + chunks_per_task]
+            chunks = delayed(_qmc_chunks, pure=True, nout=len(block))
+            generated_samples.extend(chunks(self.method, d, self.scramble, self.seed, self._next(sum(block)),
+                                            block, lb, ub))
+
+        if self.use_logger:
+            self.logger.info("QMC Prior: drew {0} points, {1} drawn in total".format(n, self.n_drawn))
+        return generated_samples
+
+    def rvs(self, n=1):
+        """
+        Draw the next 'n' points of the sequence directly, without dask
+        :param n: the desired number of samples
+        :return: (n, d) array of samples
+        """
+        return self._points(self._next(n), n)
+
+    def reset(self):
+        """
+        Restart the sequence from its first point
+        """
+        self.n_drawn = 0
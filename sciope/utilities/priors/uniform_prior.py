@@ -64,48 +64,53 @@ class UniformPrior(PriorBase):
 
         return generated_samples
 
-    def pdf(self, x, log = False):
-        if len(np.asarray(x).shape) == 1:
-            z = np.asarray(x)
-            if (z > self.lb).all() and (z < self.ub).all():
-                v = np.prod(1/(self.ub - self.lb))
-                if log:
-                    v = np.log(v)
-            else:
-                v = 0
-                if log:
-                    v = -np.inf
-            return v
+    def pdf(self, x, log = False, out = None):
+        """
+        Evaluate the (log) density at a point or at each row of an (n, d) array
+        :param x: the point or collection of points to evaluate the pdf at
+        :param log: whether to return the log pdf
+        :param out: optional preallocated array of length n for the result of 2-D input
+        :return: the pdf evaluated at x, a scalar for a single point
+        """
+        lb = np.asarray(self.lb, dtype=float)
+        ub = np.asarray(self.ub, dtype=float)
+        v = np.prod(1/(ub - lb))
+        if log:
+            v, outside = np.log(v), -np.inf
         else:
-            z = np.asarray(x)
-            vs = []
-            for i in range(z.shape[0]):
-                if (z[i] > self.lb).all() and (z[i] < self.ub).all():
-                    v = np.prod(1/(self.ub - self.lb))
-                    if log:
-                        vs.append(np.log(v))
-                    else:
-                        vs.append(v)
-                else:
-                    if log:
-                        vs.append(-np.inf)
-                    else:
-                        vs.append(0)
-            return np.asarray(vs)
-        return v
+            outside = 0
+
+        z = np.asarray(x)
+        if len(z.shape) == 1:
+            if (z > lb).all() and (z < ub).all():
+                return v
+            return outside
+
+        inside = np.all((z > lb) & (z < ub), axis=1)
+        if out is None:
+            out = np.empty(z.shape[0])
+        out.fill(outside)
+        out[inside] = v
+        return out
 
     def get_dimension(self):
         return len(self.lb)
 
+    def rvs(self, n=1):
+        """
+        Draw 'n' samples directly, without dask
+        :param n: the desired number of samples
+        :return: (n, d) array of samples
+        """
+        # Generate samples in [0,1) and scale to the problem range in place
+        scaled_values = np.random.random((n, len(self.lb)))
+        scaled_values *= np.asarray(self.ub, dtype=float) - np.asarray(self.lb, dtype=float)
+        scaled_values += np.asarray(self.lb, dtype=float)
+        return scaled_values
+
     @delayed
     def _uniform_scale(self, n, d):
-        # Generate samples in [0,1)
-        generated_samples = np.random.random((n, d))
-
-        # scale from [0,1) to problem range
-        scaled_values = generated_samples
-        for j in range(0, d):
-            scaled_values[:, j] = (generated_samples[:, j] * (self.ub[j] - self.lb[j])) + self.lb[j]
+        scaled_values = self.rvs(n)
         if self.use_logger:
             self.logger.info("Uniform Prior: sampled {} points in {} dimensions".format(n, len(self.lb)))
 
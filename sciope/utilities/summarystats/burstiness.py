@@ -31,7 +31,7 @@ class Burstiness(SummaryBase):
     Ref: Burstiness and memory in complex systems, Europhys. Let., 81, pp. 48002, 2008.
     """
 
-    def __init__(self, mean_trajectories=False, improvement=False, use_logger=False):
+    def __init__(self, mean_trajectories=False, improvement=False, dtype=np.float64, use_logger=False):
         """
         [summary]
         
@@ -41,46 +41,63 @@ class Burstiness(SummaryBase):
             [description], by default True
         improvement : bool, optional
             [description], by default False
+        dtype : data-type, optional
+            floating point type of the computation and the result, e.g. np.float32 to halve the
+            memory traffic, by default np.float64
         """
         self.name = 'Burstiness'
         self.improvement = improvement
+        self.dtype = np.dtype(dtype)
         super(Burstiness, self).__init__(self.name, mean_trajectories, use_logger)
         if self.use_logger:
             self.logger = ml.SciopeLogger().get_logger()
             self.logger.info("Burstiness summary statistic initialized")
 
-    def _compute(self, data):
+    def _burstiness(self, data, out=None):
         """
-        Calculates the measure per specie
+        Calculates the measure per trajectory, over the last axis
         Parameters
         ----------
         data : [type]
-            simulated or data set in the form N x S X T - num data points x num species x num time steps
+            simulated or data set in the form N x T or N x S X T - num data points x num species x num time steps
+        out : ndarray, optional
+            array of shape data.shape[:-1] to store the result in
 
         Returns
         -------
         [type]
-            computed statistic value
+            computed statistic value, of shape data.shape[:-1]
         """
-        trajs = []
-        for i in range(np.shape(data)[0]):
-            y = data[i, :]
-            r = np.std(y) / np.mean(y)
-            if not self.improvement:
-                # original burstiness due to Goh and Barabasi
-                out = (r - 1) / (r + 1)
-            else:
-                # improvement by Kim & Ho, 2016 (arxiv)
-                n = len(y)
-                out = (mt.sqrt(n + 1) * r - mt.sqrt(n - 1)) / ((mt.sqrt(n + 1) - 2) * r + mt.sqrt(n - 1))
+        data = np.ascontiguousarray(data, dtype=self.dtype)
+        # per-trajectory reductions over contiguous rows, as np.std(y) / np.mean(y) for each row y
+        r = np.std(data, axis=-1)
+        r /= np.mean(data, axis=-1)
+        if not self.improvement:
+            # original burstiness due to Goh and Barabasi
+            out = np.divide(r - 1, r + 1, out=out)
+        else:
+            # improvement by Kim & Ho, 2016 (arxiv)
+            n = data.shape[-1]
+            a, b = mt.sqrt(n + 1), mt.sqrt(n - 1)
+            out = np.divide(a * r - b, (a - 2) * r + b, out=out)
+        return out
 
-            trajs.append(out)
+    def _compute(self, data):
+        """
+        Calculates the measure per specie
+        Parameters
+        ----------
+        data : [type]
+            simulated or data set in the form N x T - num data points x num time steps of one species
 
-        out = np.array(trajs)
-        res = np.reshape(out, (out.size, 1))
-        return res
+        Returns
+        -------
+        [type]
+            computed statistic value, of shape N x 1
+        """
+        return self._burstiness(data).reshape(-1, 1)
 
-    def compute(self, data):
+    def compute(self, data, out=None):
         """
         Calculate the value(s) of the summary statistic(s)
         
@@ -88,6 +105,8 @@ class Burstiness(SummaryBase):
         ----------
         data : [type]
             simulated or data set in the form N x S X T - num data points x num species x num time steps
+        out : ndarray, optional
+            array to store the result in, of shape N x S, or S if mean_trajectories is enabled
         
         Returns
         -------
@@ -95,20 +114,16 @@ class Burstiness(SummaryBase):
             computed statistic value
         
         """
-        data_arr = np.array(data)
+        data_arr = np.asarray(data)
         assert len(data_arr.shape) == 3, "required input shape is (n_points, n_species, n_timepoints)"
 
-        res = []
-        for i in range(data_arr.shape[1]):
-            bs_value = self._compute(data_arr[:, i, :].reshape((data_arr.shape[0], data_arr.shape[2])))
-            res.append(bs_value.ravel())
-        res = np.asarray(res)
-        res = res.transpose()
-
         if self.mean_trajectories:
-            res = np.asarray(np.mean(res, axis=0))  # returns a scalar, so we cast it as an array
+            # average each species over contiguous memory, as the per-species results were averaged
+            res = np.mean(np.ascontiguousarray(self._burstiness(data_arr).T), axis=1, out=out)
+        else:
+            res = self._burstiness(data_arr, out=out)
 
         if self.use_logger:
             self.logger.info("Burstiness summary statistic: processed data matrix of shape {0} and generated summaries"
-                             " of shape {1}".format(data.shape, res.shape))
+                             " of shape {1}".format(data_arr.shape, res.shape))
         return res
@@ -55,7 +55,8 @@ setup(
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
     ],
 
     # What does your project relate to?
@@ -65,6 +66,9 @@ setup(
     # simple. Or you can use find_packages().
     packages=find_packages(),
 
+    # scipy.stats.qmc, cKDTree.query(workers=) and multivariate_normal.cdf(lower_limit=)
+    python_requires='>=3.8',
+
     # Alternatively, if you want to distribute just a my_module.py, uncomment
     # this:
     #   py_modules=["my_module"],
@@ -75,7 +79,7 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
         'numpy',
-        'scipy',
+        'scipy>=1.10',
         'scikit-learn',
         'tsfresh==0.15.0',
         'ipywidgets',